@@ -1,35 +1,40 @@
 # Tệp: app_controller.py
 
-import tkinter as tk
 from tkinter import filedialog
 import threading
 import os
 import sys
-import json
-import time
-import queue
 import re
 import uuid
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, Future, CancelledError
 
 from logger_setup import logger
-from config import MAX_ROWS, MAX_ACTIVE_USERS, COOKIES
+from config import MAX_ROWS, MAX_ACTIVE_USERS, COOKIES, RECORDING_ENGINE, ASYNC_MAX_ACTIVE_USERS, UI_STATS_INTERVAL_MS
 from rec_logic import (
-    TikTokRecorder, TikTokException, UserLiveException,
-    LiveNotFound, RecordingException
+    TikTokRecorder, TikTokAPI, TikTokException, UserLiveException,
+    LiveNotFound, RecordingException, close_http_clients
 )
-from gui_view import GUIView
+from live_poller import PollScheduler, future_error
+from post_processor import get_post_processor, PRIORITY_MANUAL
+from metrics import get_metrics, start_metrics_exporter, RateTracker
+from storage import shutdown_storage_manager
+from gui_view import GUIView, format_stats
+from ui_utils import UiUpdater
 
 class UserRowModel:
     """Lớp chứa toàn bộ dữ liệu và trạng thái của một hàng trong giao diện."""
     def __init__(self, row_id):
         self.id = row_id
         self.status = "Chờ"
+        self.status_color = "grey"
+        self.stats_text = ""
+        self.input_text = ""
+        self.duration_text = ""
+        self.convert_to_mp3 = True
         self.recorder = None
         self.future = None
         self.is_stopping = False
-        self.widgets = {}
-        self.last_known_input = ""
+        self.byte_rate = None
 
 class AppController:
     def __init__(self, root):
@@ -47,63 +52,69 @@ class AppController:
         self.protected_rows = []
         self.custom_output_dir = None
         self.cookies = COOKIES
-        self.thread_pool = ThreadPoolExecutor(max_workers=MAX_ACTIVE_USERS + 5)
+        # Chỉ user đang ghi hình mới chiếm luồng và bị giới hạn; user chờ live nằm trong PollScheduler
+        self.thread_pool = ThreadPoolExecutor(max_workers=MAX_ACTIVE_USERS)
+        self.poll_scheduler = PollScheduler(TikTokAPI(self.cookies), capture_executor=self.thread_pool,
+                                            max_captures=MAX_ACTIVE_USERS)
+        self.post_processor = get_post_processor()
+        self.async_engine = None
+        self.max_active_users = MAX_ACTIVE_USERS
+        if RECORDING_ENGINE == "asyncio":
+            from async_recorder import AsyncRecordingEngine
+            self.async_engine = AsyncRecordingEngine(self.cookies, max_captures=ASYNC_MAX_ACTIVE_USERS)
+            self.max_active_users = ASYNC_MAX_ACTIVE_USERS
 
         self.successful_users = []  
         self.failed_users = []      
         self.active_users = set()     
+        get_metrics().register_collector('app', self.collect_metrics)
+        self.metrics_exporter = start_metrics_exporter()
 
+        self.ui = UiUpdater(root)
+        self.stats_after_id = None
         self.view = GUIView(root, self)
         self.add_user_row()
 
-        self.update_queue = queue.Queue()
-        self.process_queue()
-
-        logger.debug("Khởi động monitor_threads")
-        self.monitor_thread = threading.Thread(target=self.monitor_threads, daemon=True)
-        self.monitor_thread.start()
-
         logger.debug("Hoàn tất khởi tạo AppController")
 
-    def handle_url_entry_focus_out(self, row_id, widget):
+    def handle_url_entry_focus_out(self, row_id, text):
         model = self.user_rows.get(row_id)
         if not model: return
-        current_text = widget.get().strip()
-        if current_text == model.last_known_input: return
+        current_text = text.strip()
+        if current_text == model.input_text: return
         username = self.extract_username(current_text)
-        widget.delete(0, tk.END)
         if username:
-            normalized_text = f"@{username}"
-            widget.insert(0, normalized_text)
-            widget.config(foreground='black')
-            logger.info(f"Đã chuẩn hóa username cho hàng {row_id} thành: {normalized_text}")
-            model.last_known_input = normalized_text
+            model.input_text = f"@{username}"
+            logger.info(f"Đã chuẩn hóa username cho hàng {row_id} thành: {model.input_text}")
         else:
             logger.warning(f"Input '{current_text}' không hợp lệ, đã xóa trắng ô nhập liệu.")
-            model.last_known_input = ""
+            model.input_text = ""
+        self.view.refresh_row(row_id)
 
     def update_row_status(self, row_id, text, color):
         model = self.user_rows.get(row_id)
         if model:
             model.status = text
-            status_label_widget = model.widgets.get('status_label')
-            self.update_queue.put(lambda: self.view.update_status_label(status_label_widget, text, color))
-
-    def process_queue(self):
-        try:
-            while not self.update_queue.empty():
-                callback = self.update_queue.get_nowait()
-                if callable(callback): callback()
-        except queue.Empty: pass
-        finally:
-            if self.is_running: self.root.after(100, self.process_queue)
+            model.status_color = color
+            # Trạng thái cũ chưa kịp vẽ bị thay thế, chỉ bản mới nhất được áp dụng
+            self.ui.set(('status', row_id), lambda: self.view.refresh_row(row_id))
 
-    def update_all_button_states(self):
+    def refresh_row_stats(self):
+        """Làm mới tốc độ/dung lượng của các hàng đang ghi hình; tự dừng khi không còn hàng nào ghi."""
+        self.stats_after_id = None
         with self.rows_lock:
-            at_max_rows = len(self.user_rows) >= MAX_ROWS
-            for row_id, model in self.user_rows.items():
-                self.view.set_widget_state(model.widgets['add_button'], 'disabled' if at_max_rows else 'normal')
-                self.view.set_widget_state(model.widgets['remove_button'], 'normal')
+            models = [model for model in self.user_rows.values() if model.recorder]
+        for model in models:
+            recorder = model.recorder
+            if not recorder or not recorder.bytes_received: continue
+            rate = model.byte_rate.update(recorder.bytes_received)
+            model.stats_text = format_stats(rate, recorder.get_bytes_written())
+            self.view.refresh_row(model.id)
+        if models and self.is_running:
+            self.stats_after_id = self.root.after(UI_STATS_INTERVAL_MS, self.refresh_row_stats)
+
+    def update_all_button_states(self):
+        self.view.set_add_enabled(len(self.user_rows) < MAX_ROWS)
 
     def add_user_row(self):
         with self.rows_lock:
@@ -111,15 +122,12 @@ class AppController:
                 self.view.show_messagebox("warning", "Cảnh báo", f"Đã đạt tối đa {MAX_ROWS} hàng.")
                 return None
             row_id = str(uuid.uuid4())
-            new_row_widgets = self.view.add_user_row_to_gui(row_id, len(self.user_rows))
-            new_model = UserRowModel(row_id)
-            new_model.widgets = new_row_widgets
-            self.user_rows[row_id] = new_model
+            self.user_rows[row_id] = UserRowModel(row_id)
             if len(self.user_rows) == 1: self.protected_rows.append(row_id)
-            self.view.update_window_size(len(self.user_rows))
-            self.update_all_button_states()
-            logger.debug(f"Đã thêm hàng mới với row_id: {row_id}")
-            return row_id
+        self.update_all_button_states()
+        self.view.rows_changed(scroll_to=row_id)
+        logger.debug(f"Đã thêm hàng mới với row_id: {row_id}")
+        return row_id
 
     def remove_user_row(self, row_id):
         model = self.user_rows.get(row_id)
@@ -133,14 +141,13 @@ class AppController:
                 self.stop_recording(row_id, is_removing=True)
         else:
             if is_protected:
-                model.widgets['url_entry'].delete(0, tk.END)
-                model.last_known_input = ""
+                model.input_text = ""
                 self.update_row_status(row_id, "Chờ", "grey")
+                self.view.refresh_row(row_id)
             else:
-                self.view.remove_user_row_from_gui(row_id)
                 with self.rows_lock: del self.user_rows[row_id]
-                self.view.update_window_size(len(self.user_rows))
                 self.update_all_button_states()
+                self.view.rows_changed()
                 logger.info(f"Đã xóa hàng với row_id: {row_id}")
 
     def cleanup_ui_and_data(self, row_id, username, is_protected):
@@ -154,15 +161,15 @@ class AppController:
                 model.recorder = None
                 model.future = None
                 model.is_stopping = False
+                model.byte_rate = None
+                model.stats_text = ""
                 if is_protected:
-                    self.view.update_ui_for_state(row_id, 'stopped')
-                    model.widgets['url_entry'].delete(0, tk.END)
-                    model.last_known_input = ""
+                    model.input_text = ""
                     self.update_row_status(row_id, "Chờ", "grey")
+                    self.view.refresh_row(row_id)
                 else:
-                    self.view.remove_user_row_from_gui(row_id)
                     if row_id in self.user_rows: del self.user_rows[row_id]
-                    self.view.update_window_size(len(self.user_rows))
+                    self.view.rows_changed()
         self.update_all_button_states()
         self.view.update_status_labels(len(self.successful_users), len(self.failed_users))
         self.view.close_active_dialog()
@@ -179,70 +186,93 @@ class AppController:
         model = self.user_rows.get(row_id)
         if not model or model.recorder: return
 
-        if len(self.active_users) >= MAX_ACTIVE_USERS:
-            self.view.show_messagebox("warning", "Quá tải", f"Đã đạt tối đa {MAX_ACTIVE_USERS} user ghi hình cùng lúc.")
-            return
-
-        url_input = model.widgets['url_entry'].get()
-        username = self.extract_username(url_input)
+        # Nút bấm không lấy focus: lưu nội dung đang gõ dở trước khi đọc
+        self.view.commit_row(row_id)
+        username = self.extract_username(model.input_text)
 
         if not username:
             self.view.show_messagebox("error", "Lỗi", "Tên người dùng không hợp lệ.")
             return
         
-        normalized_text = f"@{username}"
-        model.widgets['url_entry'].delete(0, tk.END)
-        model.widgets['url_entry'].insert(0, normalized_text)
-        model.last_known_input = normalized_text
+        model.input_text = f"@{username}"
+        self.view.refresh_row(row_id)
 
         for r_id, r_model in self.user_rows.items():
             if r_id != row_id and r_model.recorder and r_model.recorder.user == username:
                 self.view.show_messagebox("warning", "Trùng lặp", f"User {username} đã đang được ghi hình ở hàng khác.")
                 return
 
-        def record_in_thread():
-            try:
-                duration_str = model.widgets['duration_entry'].get()
-                duration = int(duration_str) if duration_str.isdigit() else None
-                
-                recorder = TikTokRecorder(
-                    user=username, cookies=self.cookies, duration=duration,
-                    convert_to_mp3=model.widgets['convert_var'].get(),
-                    recording_id=row_id, custom_output_dir=self.custom_output_dir,
-                    status_callback=self.update_row_status 
-                )
-                
-                with self.rows_lock: model.recorder = recorder
-                
-                self.active_users.add(recorder.user)
-                self.update_queue.put(lambda: self.view.update_ui_for_state(row_id, 'recording'))
-                self.update_queue.put(self.update_all_button_states)
-                
-                recorder.run()
-
-                if not recorder.cancellation_requested and recorder.final_video_path and os.path.exists(recorder.final_video_path):
-                    self.successful_users.append(recorder.user)
-                    self.update_row_status(row_id, "Hoàn tất", "green")
-                
-                elif recorder.cancellation_requested:
-                    self.failed_users.append(username)
-                    self.update_row_status(row_id, "Đã hủy", "red")
-                
-                else:
-                    self.failed_users.append(username)
-                    self.update_row_status(row_id, "Đã dừng/Lỗi", "grey")
-                
-            except (TikTokException, UserLiveException, LiveNotFound, RecordingException) as e:
-                logger.error(f"Lỗi ghi hình cho {username}: {e}")
-                self.failed_users.append(username)
-                self.update_row_status(row_id, f"Lỗi: {e}", "red")
-            except Exception as e:
-                logger.critical(f"Lỗi không mong muốn khi ghi hình {username}: {e}", exc_info=True)
-                self.failed_users.append(username)
-                self.update_row_status(row_id, "Lỗi nghiêm trọng", "red")
+        # Future của hàng chỉ xong khi cả ghi hình lẫn hậu xử lý đã kết thúc
+        done_future = Future()
+        with self.rows_lock: model.future = done_future
+        done_future.add_done_callback(lambda f: self._on_row_done(row_id, f))
+
+        recorder = self._create_recorder(model, row_id, username)
+        self._begin_recording(row_id, model, recorder)
+        # Chờ live không giữ luồng: engine asyncio hoặc PollScheduler chỉ cấp luồng khi bắt đầu ghi hình
+        engine = self.async_engine or self.poll_scheduler
+        future = engine.submit(recorder)
+        future.add_done_callback(lambda f: self._after_capture(row_id, username, recorder, done_future, future_error(f)))
 
-        future = self.thread_pool.submit(record_in_thread)
-        with self.rows_lock: model.future = future
+    def _create_recorder(self, model, row_id, username):
+        duration = int(model.duration_text) if model.duration_text.isdigit() else None
+        options = dict(
+            cookies=self.cookies, duration=duration,
+            convert_to_mp3=model.convert_to_mp3,
+            recording_id=row_id, custom_output_dir=self.custom_output_dir,
+            status_callback=self.update_row_status
+        )
+        if self.async_engine:
+            return self.async_engine.create_recorder(username, **options)
+        return TikTokRecorder(user=username, **options)
+
+    def _begin_recording(self, row_id, model, recorder):
+        with self.rows_lock:
+            model.recorder = recorder
+            model.byte_rate = RateTracker(min_interval=UI_STATS_INTERVAL_MS / 2000)
+        
+        self.active_users.add(recorder.user)
+        self.ui.call(lambda: self.view.refresh_row(row_id))
+        self.ui.call(self.update_all_button_states)
+        if self.stats_after_id is None:
+            self.stats_after_id = self.root.after(UI_STATS_INTERVAL_MS, self.refresh_row_stats)
+
+    def _after_capture(self, row_id, username, recorder, done_future, error=None):
+        """Gọi khi ngừng nhận stream; luồng ghi hình được trả về ngay, kết quả chờ hàng đợi hậu xử lý."""
+        post_process_future = recorder.post_process_future if recorder and error is None else None
+        if post_process_future is None:
+            self._finish_recording(row_id, username, recorder, error)
+            done_future.set_result(None)
+            return
+
+        self.update_row_status(row_id, "Đang xử lý...", "blue")
+        def on_processed(f):
+            self._finish_recording(row_id, username, recorder, future_error(f))
+            done_future.set_result(None)
+        post_process_future.add_done_callback(on_processed)
+
+    def _finish_recording(self, row_id, username, recorder, error=None):
+        if isinstance(error, (TikTokException, UserLiveException, LiveNotFound, RecordingException)):
+            logger.error(f"Lỗi ghi hình cho {username}: {error}")
+            self.failed_users.append(username)
+            self.update_row_status(row_id, f"Lỗi: {error}", "red")
+        elif isinstance(error, CancelledError):
+            logger.warning(f"Phiên ghi hình của {username} đã bị hủy trước khi hoàn tất.")
+            self.failed_users.append(username)
+            self.update_row_status(row_id, "Đã hủy", "red")
+        elif error is not None:
+            logger.critical(f"Lỗi không mong muốn khi ghi hình {username}: {error}", exc_info=error)
+            self.failed_users.append(username)
+            self.update_row_status(row_id, "Lỗi nghiêm trọng", "red")
+        elif not recorder.cancellation_requested and recorder.final_video_path and os.path.exists(recorder.final_video_path):
+            self.successful_users.append(recorder.user)
+            self.update_row_status(row_id, "Hoàn tất", "green")
+        elif recorder.cancellation_requested:
+            self.failed_users.append(username)
+            self.update_row_status(row_id, "Đã hủy", "red")
+        else:
+            self.failed_users.append(username)
+            self.update_row_status(row_id, "Đã dừng/Lỗi", "grey")
 
     def stop_recording(self, row_id, is_removing=False):
         with self.rows_lock:
@@ -266,34 +296,48 @@ class AppController:
         logger.warning(f"Không thể trích xuất username từ đầu vào: '{text_input}'")
         return ""
 
-    def monitor_threads(self):
-        while self.is_running:
-            time.sleep(1)
-            with self.rows_lock:
-                for row_id in list(self.user_rows.keys()):
-                    model = self.user_rows.get(row_id)
-                    if not model or model.is_stopping: continue
-                    future = model.future
-                    if future and future.done():
-                        recorder = model.recorder
-                        if not recorder: continue
-                        username = recorder.user
-                        if future.exception():
-                            logger.error(f"Luồng cho user '{username}' đã kết thúc với một exception: {future.exception()}", exc_info=future.exception())
-                        else:
-                            logger.info(f"Luồng cho user '{username}' đã hoàn thành, chuẩn bị dọn dẹp.")
-                        model.is_stopping = True
-                        is_protected = row_id in self.protected_rows
-                        self.update_queue.put(lambda rid=row_id, u=username, prot=is_protected: self.cleanup_ui_and_data(rid, u, prot))
+    def _on_row_done(self, row_id, future):
+        """Chạy ngay khi Future của hàng hoàn tất (trên luồng vừa kết thúc), đưa việc dọn dẹp về luồng Tk."""
+        with self.rows_lock:
+            model = self.user_rows.get(row_id)
+            if not model or model.is_stopping or model.future is not future or not model.recorder: return
+            username = model.recorder.user
+            model.is_stopping = True
+            is_protected = row_id in self.protected_rows
+        error = future_error(future)
+        if error:
+            logger.error(f"Luồng cho user '{username}' đã kết thúc với một exception: {error!r}", exc_info=error)
+        else:
+            logger.info(f"Luồng cho user '{username}' đã hoàn thành, chuẩn bị dọn dẹp.")
+        # Trả suất ghi hình ngay, phần giao diện được dọn ở lần cập nhật kế tiếp
+        self.active_users.discard(username)
+        self.ui.call(lambda: self.cleanup_ui_and_data(row_id, username, is_protected))
+
+    def collect_metrics(self):
+        return [
+            ('active_users', {}, len(self.active_users)),
+            ('max_active_users', {}, self.max_active_users),
+            ('successful_recordings_total', {}, len(self.successful_users)),
+            ('failed_recordings_total', {}, len(self.failed_users)),
+        ]
 
     def on_closing(self):
         logger.info("Bắt đầu quy trình đóng chương trình")
         self.is_running = False
+        self.ui.stop()
+        if self.stats_after_id: self.root.after_cancel(self.stats_after_id)
         for model in self.user_rows.values():
             if model.recorder: model.recorder.stop()
+        self.poll_scheduler.shutdown(wait=True)
         logger.info("Đang chờ các luồng ghi hình kết thúc...")
+        if self.async_engine: self.async_engine.shutdown(wait=True)
         self.thread_pool.shutdown(wait=True)
         logger.info("Đã đóng ThreadPoolExecutor")
+        logger.info("Đang chờ hàng đợi hậu xử lý hoàn tất...")
+        self.post_processor.shutdown(wait=True)
+        if self.metrics_exporter: self.metrics_exporter.stop()
+        shutdown_storage_manager()
+        close_http_clients()
         self.root.destroy()
         
     def convert_to_mp3_manual(self, input_file, output_dir):
@@ -307,17 +351,21 @@ class AppController:
         logger.info(f"Bắt đầu chuyển đổi thủ công sang MP3: {os.path.basename(input_file)}")
         self.view.set_mp3_button_state('disabled')
         def conversion_thread():
-            from rec_logic import VideoManagement
+            from rec_logic import VideoManagement, probe_media
             try:
+                info = probe_media(input_file)
+                if info is not None and not info.has_audio:
+                    raise ValueError("File không có luồng âm thanh")
                 VideoManagement.convert_mp4_to_mp3(file=input_file, output_file=output_file)
-                self.update_queue.put(lambda: self.view.show_messagebox("info", "Thành công", f"Đã chuyển đổi thành công file:\n{os.path.basename(output_file)}"))
+                self.ui.call(lambda: self.view.show_messagebox("info", "Thành công", f"Đã chuyển đổi thành công file:\n{os.path.basename(output_file)}"))
             except Exception as e:
                 logger.error(f"Lỗi khi chuyển đổi MP3 thủ công: {e}")
-                self.update_queue.put(lambda: self.view.show_messagebox("error", "Lỗi", f"Chuyển đổi thất bại: {e}"))
+                message = f"Chuyển đổi thất bại: {e}"
+                self.ui.call(lambda: self.view.show_messagebox("error", "Lỗi", message))
             finally:
-                self.update_queue.put(lambda: self.view.set_mp3_button_state('normal'))
-                self.update_queue.put(self.view.close_active_dialog)
-        self.thread_pool.submit(conversion_thread)
+                self.ui.call(lambda: self.view.set_mp3_button_state('normal'))
+                self.ui.call(self.view.close_active_dialog)
+        self.post_processor.submit(PRIORITY_MANUAL, conversion_thread)
 
     def show_status_details(self, status_type):
         if status_type == "success":
@@ -0,0 +1,309 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+
+import aiohttp
+
+from logger_setup import logger
+from config import (
+    TIKTOK_CONFIG, COOKIES, ASYNC_MAX_CONNECTIONS, ASYNC_IO_WORKERS,
+    ASYNC_READ_CHUNK_SIZE, ASYNC_WRITE_SIZE, POLL_ERROR_DELAY, CAPTURE_SLOT_RETRY
+)
+from rec_logic import (
+    TikTokRecorder, TikTokException, UserLiveException, LiveNotFound,
+    RecordingException, TikTokError, RoomStatus, DEFAULT_HEADERS, TikTokAPI, SigiStateReader
+)
+from room_cache import get_room_id_cache
+from live_poller import next_poll_delay, record_live_start
+from storage import get_storage_manager
+
+class AsyncTikTokAPI:
+    """Phiên bản asyncio của TikTokAPI, dùng chung ClientSession của engine."""
+    def __init__(self, session, room_cache=None):
+        self.config = TIKTOK_CONFIG
+        self.session = session
+        self.room_cache = room_cache
+
+    async def get_room_id_from_user(self, user: str, use_cache=True) -> str:
+        if self.room_cache and use_cache:
+            room_id = self.room_cache.get(user)
+            if room_id:
+                logger.debug(f"Dùng RoomID đã cache cho {user}: {room_id}")
+                return room_id
+        url = f"{self.config['api_endpoints']['base_url']}/@{user}/live"
+        reader = SigiStateReader()
+        sigi_state = None
+        try:
+            async with self.session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                if response.status == 404:
+                    raise UserLiveException(TikTokError.USERNAME_NOT_FOUND)
+                response.raise_for_status()
+                async for chunk in response.content.iter_chunked(SigiStateReader.CHUNK_SIZE):
+                    sigi_state = reader.feed(chunk)
+                    if sigi_state is not None: break
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Lỗi mạng khi lấy RoomID từ {user}: {e}")
+            raise TikTokException(f"Lỗi mạng: {e}")
+
+        room_id = TikTokAPI.extract_room_id(sigi_state) if sigi_state is not None else None
+        if not room_id:
+            logger.warning(f"Không tìm thấy RoomID cho {user} trong SIGI_STATE, thử API user_detail.")
+            room_id = await self.get_room_id_from_user_detail(user, sigi_state is None)
+        if self.room_cache: self.room_cache.set(user, room_id)
+        return room_id
+
+    async def get_room_id_from_user_detail(self, user, sigi_missing=False):
+        url = f"{self.config['api_endpoints']['base_url']}{self.config['api_endpoints']['user_detail'].format(user=user)}"
+        try:
+            async with self.session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                response.raise_for_status()
+                payload = await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.error(f"Lỗi khi lấy RoomID từ user_detail cho {user}: {e}")
+            payload = {}
+        return TikTokAPI.parse_user_detail_room_id(user, payload, sigi_missing)
+
+    async def _get_room_info(self, room_id, timeout):
+        url = f"{self.config['api_endpoints']['webcast_url']}{self.config['api_endpoints']['room_info'].format(room_id=room_id)}"
+        async with self.session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            if response.status != 200: return {}
+            payload = await response.json(content_type=None)
+            return TikTokAPI.handle_room_info(self.room_cache, room_id, payload)
+
+    async def is_room_alive(self, room_id: str):
+        if not room_id: return False
+        try:
+            data = await self._get_room_info(room_id, timeout=5)
+            return data.get('status', 0) == RoomStatus.LIVE
+        except Exception:
+            return False
+
+    async def get_live_url(self, room_id: str, low_quality=False):
+        try:
+            data = await self._get_room_info(room_id, timeout=10)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            raise LiveNotFound(TikTokError.RETRIEVE_LIVE_URL)
+        return TikTokAPI.parse_live_url(data, low_quality)
+
+class AsyncTikTokRecorder(TikTokRecorder):
+    """Recorder chạy trên event loop của AsyncRecordingEngine thay vì chiếm một luồng riêng.
+
+    Giữ nguyên hợp đồng run/stop/cancel và status_callback của TikTokRecorder;
+    run() là coroutine, stop()/cancel() có thể gọi từ bất kỳ luồng nào.
+    """
+    def __init__(self, user, engine, **kwargs):
+        self.engine = engine
+        # fetch_stream bất đồng bộ chỉ ghi FLV thô vào một file
+        kwargs.update(segment_minutes=0, segment_mb=0, live_remux=False)
+        super().__init__(user, **kwargs)
+        self.async_stop_event = asyncio.Event()
+
+    def _create_api(self):
+        return AsyncTikTokAPI(self.engine.session, room_cache=get_room_id_cache())
+
+    async def _wait(self, seconds):
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self.async_stop_event.wait(), seconds)
+
+    async def run(self):
+        self.watch_started_at = started_at = time.monotonic()
+        try:
+            self._update_status("Lấy RoomID...", "blue")
+            self.room_id = await self.tiktok.get_room_id_from_user(self.user)
+            self._event('resolve', room_id=self.room_id, seconds=round(time.monotonic() - started_at, 3))
+        except (UserLiveException, TikTokException) as e:
+            logger.error(f"Lỗi khi lấy RoomID cho {self.user}: {e}")
+            self._event('resolve', error=str(e), seconds=round(time.monotonic() - started_at, 3))
+            self._update_status(f"Lỗi: {e}", "red")
+            return
+
+        interval_index = 0
+
+        while not self.stop_event.is_set():
+            try:
+                if interval_index and self.tiktok.room_cache and self.tiktok.room_cache.get(self.user) is None:
+                    self.room_id = await self.tiktok.get_room_id_from_user(self.user)
+                self._update_status("Kiểm tra live...", "blue")
+                checked_at = time.monotonic()
+                is_live = await self.tiktok.is_room_alive(self.room_id)
+                poll_seconds = round(time.monotonic() - checked_at, 3)
+                if is_live and not self.engine.acquire_capture():
+                    logger.info(f"User {self.user} đang livestream nhưng đã đủ {self.engine.max_captures} user ghi hình, chờ suất trống.")
+                    self._update_status("Đang live, chờ suất ghi hình...", "orange")
+                    await self._wait(CAPTURE_SLOT_RETRY)
+                    continue
+                if is_live:
+                    self._event('poll', live=True, attempt=interval_index, seconds=poll_seconds)
+                    logger.info(f"User {self.user} đang livestream. Bắt đầu ghi hình.")
+                    self._update_status("Đang ghi hình...", "green")
+                    self._on_go_live(interval_index + 1)
+                    if interval_index:
+                        await asyncio.get_running_loop().run_in_executor(None, record_live_start, self.user)
+                    try:
+                        await self.start_recording()
+                    finally:
+                        self.engine.release_capture()
+                    break
+                wait_time = next_poll_delay(self.user, interval_index)
+                self._event('poll', live=False, attempt=interval_index, seconds=poll_seconds, next_delay=round(wait_time, 1))
+                wait_time_minutes = wait_time / 60
+                logger.info(f"User {self.user} không live, chờ {wait_time_minutes:.1f} phút.")
+                self._update_status(f"Chờ live ({wait_time_minutes:.1f}p)...", "orange")
+                interval_index += 1
+                await self._wait(wait_time)
+            except Exception as e:
+                logger.error(f"Lỗi trong vòng lặp chờ của {self.user}: {e}")
+                self._update_status("Lỗi, đang thử lại...", "red")
+                await self._wait(POLL_ERROR_DELAY)
+
+    async def start_recording(self):
+        error = None
+        storage = get_storage_manager()
+        loop = asyncio.get_running_loop()
+        try:
+            # Tạo thư mục và kiểm tra dung lượng (disk_usage, scandir) là I/O chặn: chạy trên luồng ghi file
+            user_dir = await loop.run_in_executor(self.engine.io_executor, self.get_user_dir)
+            await loop.run_in_executor(self.engine.io_executor, self._admit, user_dir)
+            live_url = await self.tiktok.get_live_url(self.room_id, low_quality=self.low_quality)
+            self.session_basepath = os.path.join(
+                user_dir,
+                f"TK_{self.user}_{time.strftime('%Y%m%d_%H%M%S')}"
+            )
+            self.output_filepath = self.session_basepath + self._raw_suffix()
+            logger.info(f"Bắt đầu ghi hình @{self.user}. Lưu vào: {os.path.basename(self.output_filepath)}")
+            self._track_metrics()
+            storage.register(self, self.output_filepath)
+            await self.fetch_stream(live_url, self.output_filepath)
+        except LiveNotFound as e:
+            error = e
+            logger.warning(f"Không thể bắt đầu ghi hình cho {self.user}: {e}")
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._untrack_metrics()
+            storage.unregister(self)
+            self._on_stopped(error)
+            if self.cancellation_requested:
+                logger.warning(f"Hủy bỏ được yêu cầu, xóa file tạm cho {self.user}.")
+                if self.output_filepath and os.path.exists(self.output_filepath):
+                    with suppress(OSError):
+                        os.remove(self.output_filepath)
+                        logger.info("Đã xóa thành công file tạm.")
+            else:
+                # Chỉ xếp job vào hàng đợi hậu xử lý, FFmpeg không chạy trên event loop
+                self.process_recorded_file(self.output_filepath)
+
+    async def fetch_stream(self, live_url, output_file):
+        loop = asyncio.get_running_loop()
+        io_executor = self.engine.io_executor
+        start_time = loop.time()
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=10)
+
+        f = await loop.run_in_executor(io_executor, open, output_file, "wb")
+        buffer = bytearray()
+        pending_write = None
+        first_byte = True
+        self.piece_started_at = time.monotonic()
+        try:
+            async with self.tiktok.session.get(live_url, timeout=timeout) as response:
+                response.raise_for_status()
+                async for chunk in response.content.iter_chunked(ASYNC_READ_CHUNK_SIZE):
+                    if self.stop_event.is_set():
+                        break
+                    if self.duration and (loop.time() - start_time) > self.duration:
+                        logger.info(f"Đã đạt thời gian ghi hình {self.duration}s. Dừng lại.")
+                        break
+                    if first_byte:
+                        first_byte = False
+                        self._on_first_byte(len(chunk))
+                    buffer += chunk
+                    self.bytes_received += len(chunk)
+                    self.last_chunk_at = time.monotonic()
+                    if len(buffer) >= ASYNC_WRITE_SIZE:
+                        # Chỉ giữ một lệnh ghi đang chạy cho mỗi recorder, tiếp tục nhận dữ liệu trong lúc ghi
+                        if pending_write: self.bytes_written += await pending_write
+                        data, buffer = buffer, bytearray()
+                        pending_write = loop.run_in_executor(io_executor, f.write, data)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise RecordingException(f"Lỗi kết nối khi tải stream: {e}")
+        finally:
+            if pending_write: self.bytes_written += await pending_write
+            if buffer: self.bytes_written += await loop.run_in_executor(io_executor, f.write, buffer)
+            await loop.run_in_executor(io_executor, f.close)
+            self._event('piece_end', piece=0, seconds=round(time.monotonic() - self.piece_started_at, 3),
+                        bytes_received=self.bytes_received, bytes_written=self.bytes_written)
+
+    def stop(self):
+        super().stop()
+        self.engine.call_soon(self.async_stop_event.set)
+
+    def cancel(self):
+        super().cancel()
+        self.engine.call_soon(self.async_stop_event.set)
+
+class AsyncRecordingEngine:
+    """Event loop chạy trong một luồng nền, dùng chung cho toàn bộ AsyncTikTokRecorder."""
+    def __init__(self, cookies=None, max_connections=ASYNC_MAX_CONNECTIONS, io_workers=ASYNC_IO_WORKERS, max_captures=None):
+        self.cookies = cookies or COOKIES
+        self.max_connections = max_connections
+        self.max_captures = max_captures
+        self.capturing = 0   # Chỉ đọc/ghi trên event loop
+        self.io_executor = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="AsyncIO")
+        self.session = None
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run_loop, name="AsyncRecordingEngine", daemon=True)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._create_session(), self.loop).result()
+        logger.info(f"Đã khởi động AsyncRecordingEngine (tối đa {max_connections} kết nối)")
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def _create_session(self):
+        connector = aiohttp.TCPConnector(limit=self.max_connections, ttl_dns_cache=300)
+        cookies = {key: value for key, value in self.cookies.items() if value}
+        self.session = aiohttp.ClientSession(
+            connector=connector, headers=DEFAULT_HEADERS, cookies=cookies, trust_env=False
+        )
+
+    def create_recorder(self, user, **kwargs):
+        return AsyncTikTokRecorder(user, engine=self, **kwargs)
+
+    def submit(self, recorder):
+        """Lên lịch recorder.run() và trả về concurrent.futures.Future như ThreadPoolExecutor."""
+        return asyncio.run_coroutine_threadsafe(recorder.run(), self.loop)
+
+    def acquire_capture(self):
+        """Giữ một suất ghi hình; False nếu đã đủ max_captures user đang ghi."""
+        if self.max_captures and self.capturing >= self.max_captures:
+            return False
+        self.capturing += 1
+        return True
+
+    def release_capture(self):
+        self.capturing -= 1
+
+    def call_soon(self, callback):
+        self.loop.call_soon_threadsafe(callback)
+
+    async def _drain(self):
+        current = asyncio.current_task()
+        tasks = [task for task in asyncio.all_tasks() if task is not current]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        await self.session.close()
+
+    def shutdown(self, wait=True):
+        future = asyncio.run_coroutine_threadsafe(self._drain(), self.loop)
+        if wait:
+            with suppress(Exception):
+                future.result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.io_executor.shutdown(wait=True)
+        logger.info("Đã đóng AsyncRecordingEngine")
@@ -0,0 +1,461 @@
+"""Benchmark recorder với server giả lập TikTok/CDN chạy trên máy (không cần mạng, không cần FFmpeg).
+
+Cách dùng:
+    python benchmark.py                                  # chạy các kịch bản mặc định
+    python benchmark.py --scenarios scaling --max-streams 32 --bitrate 4000 --duration 20
+    python benchmark.py --compare                        # so sánh lần chạy gần nhất với lần trước
+
+Kịch bản:
+    throughput  một stream: tốc độ nhận, CPU/MB, thời gian tới byte đầu tiên trên đĩa
+    scaling     1, 2, 4... tới --max-streams stream đồng thời
+    golive      từ lúc user bắt đầu live (check_alive thấy live) tới byte đầu tiên trên đĩa
+    faults      stream bị treo định kỳ và bị ngắt kết nối: tỉ lệ dữ liệu nhận được, thời gian gián đoạn
+
+Server giả lập chạy ở tiến trình riêng nên CPU đo được chỉ là của recorder. Các phiên ghi
+chỉ đo phần ghi hình: file bị xóa khi kết thúc và không chạy hậu xử lý FFmpeg.
+Kết quả mỗi lần chạy được nối vào benchmark_results.jsonl (kèm commit git) để so sánh.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import statistics
+import multiprocessing
+import urllib.request
+from urllib.parse import urlparse, parse_qs, urlencode
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Module của ứng dụng chỉ được import trong tiến trình đo (xem run_benchmarks):
+# tiến trình server không cần chúng và không cần mở recording.txt.
+
+RESULTS_FILE = "benchmark_results.jsonl"
+FPS = 25
+GOP_SECONDS = 2
+AUDIO_BYTES_PER_FRAME = 640  # ~128 kbps AAC
+
+def flv_tag(tag_type, timestamp, body):
+    header = (bytes((tag_type,)) + len(body).to_bytes(3, 'big') + (timestamp & 0xFFFFFF).to_bytes(3, 'big')
+              + bytes(((timestamp >> 24) & 0xFF,)) + b'\x00\x00\x00')
+    return header + body + (11 + len(body)).to_bytes(4, 'big')
+
+FLV_PREAMBLE = (
+    b'FLV\x01\x05\x00\x00\x00\x09' + b'\x00\x00\x00\x00'
+    + flv_tag(18, 0, b'\x02\x00\x0aonMetaData\x08\x00\x00\x00\x00\x00\x00\x09')
+    + flv_tag(9, 0, b'\x17\x00\x00\x00\x00\x01\x64\x00\x1f\xff')   # AVC sequence header
+    + flv_tag(8, 0, b'\xaf\x00\x12\x10')                            # AAC sequence header
+)
+
+class FakeTikTokServer(ThreadingHTTPServer):
+    """Server giả lập trang /@user/live, API room_info/check_alive/user_detail và CDN FLV vô tận."""
+    daemon_threads = True
+
+    def __init__(self, address):
+        super().__init__(address, FakeTikTokHandler)
+        self.lock = threading.Lock()
+        self.users = {}   # user -> cấu hình stream
+        self.rooms = {}   # room_id -> user
+
+    def update_user(self, name, **settings):
+        with self.lock:
+            user = self.users.get(name)
+            if user is None:
+                room_id = str(7000000000000000000 + len(self.users))
+                user = {'room_id': room_id, 'live': False, 'bitrate': 2000, 'stall_every': 0, 'stall_for': 0,
+                        'disconnect_after': 0}
+                self.users[name] = user
+                self.rooms[room_id] = name
+            user.update(settings)
+            return dict(user)
+
+    def user_by_room(self, room_id):
+        with self.lock:
+            name = self.rooms.get(room_id)
+            return (name, dict(self.users[name])) if name else (None, None)
+
+class FakeTikTokHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path == "/_control/user":
+            settings = {key: float(value) for key, value in query.items() if key != 'name'}
+            if 'live' in settings: settings['live'] = bool(settings['live'])
+            self._send_json(self.server.update_user(query['name'], **settings))
+        elif url.path.startswith("/@") and url.path.endswith("/live"):
+            self._live_page(url.path[2:-5])
+        elif url.path.startswith("/api/user/detail/"):
+            user = self.server.users.get(query.get('uniqueId'))
+            self._send_json({'userInfo': {'user': {'roomId': user['room_id']}}} if user else {})
+        elif url.path.startswith("/webcast/room/info/"):
+            self._room_info(query.get('room_id'))
+        elif url.path.startswith("/webcast/room/check_alive/"):
+            data = []
+            for room_id in query.get('room_ids', '').split(','):
+                _, user = self.server.user_by_room(room_id)
+                data.append({'room_id_str': room_id, 'alive': bool(user and user['live'])})
+            self._send_json({'status_code': 0, 'data': data})
+        elif url.path.startswith("/stream/"):
+            self._stream(url.path[len("/stream/"):-len(".flv")])
+        else:
+            self.send_error(404)
+
+    def _live_page(self, name):
+        with self.server.lock:
+            user = self.server.users.get(name)
+        if user is None:
+            self.send_error(404)
+            return
+        sigi = json.dumps({'LiveRoom': {'liveRoomUserInfo': {'user': {'roomId': user['room_id'], 'uniqueId': name}}}})
+        # Phần HTML còn lại sau SIGI_STATE mô phỏng kích thước trang thật (recorder dừng đọc trước đó)
+        body = (f'<html><head><script id="SIGI_STATE" type="application/json">{sigi}</script></head>'
+                f'<body>{"x" * 200000}</body></html>').encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _room_info(self, room_id):
+        name, user = self.server.user_by_room(room_id)
+        if user is None:
+            self._send_json({'status_code': 4003110, 'data': {}})
+            return
+        host = self.headers.get('Host')
+        stream_url = f"http://{host}/stream/{name}.flv"
+        self._send_json({'status_code': 0, 'data': {
+            'status': 2 if user['live'] else 4,
+            'stream_url': {'flv_pull_url': {'FULL_HD1': stream_url}},
+        }})
+
+    def _stream(self, name):
+        with self.server.lock:
+            user = dict(self.server.users.get(name) or {})
+        if not user.get('live'):
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "video/x-flv")
+        self.end_headers()
+
+        frame_bytes = int(user['bitrate'] * 1000 / 8 / FPS)
+        video_payload = bytes(max(16, frame_bytes - AUDIO_BYTES_PER_FRAME - 40))
+        audio_body = b'\xaf\x01' + bytes(AUDIO_BYTES_PER_FRAME)
+        started_at = time.monotonic()
+        delay = 0.0
+        next_stall = user['stall_every'] or None
+        try:
+            self.wfile.write(FLV_PREAMBLE)
+            frame = 0
+            while True:
+                elapsed = frame / FPS
+                if user['disconnect_after'] and elapsed >= user['disconnect_after']:
+                    return
+                if next_stall and elapsed >= next_stall:
+                    delay += user['stall_for']
+                    next_stall += user['stall_every']
+                if frame % FPS == 0:
+                    with self.server.lock:
+                        if not self.server.users[name]['live']:
+                            return
+                wait = started_at + elapsed + delay - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                timestamp = frame * 1000 // FPS
+                key = frame % (FPS * GOP_SECONDS) == 0
+                video_body = (b'\x17\x01' if key else b'\x27\x01') + b'\x00\x00\x00' + video_payload
+                self.wfile.write(flv_tag(9, timestamp, video_body) + flv_tag(8, timestamp, audio_body))
+                frame += 1
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+def serve_fake_server(conn):
+    server = FakeTikTokServer(("127.0.0.1", 0))
+    conn.send(server.server_address[1])
+    conn.close()
+    server.serve_forever()
+
+class FakeServerProcess:
+    def __init__(self):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=serve_fake_server, args=(child_conn,), daemon=True)
+        self.process.start()
+        self.base_url = f"http://127.0.0.1:{parent_conn.recv()}"
+
+    def update_user(self, name, **settings):
+        with urllib.request.urlopen(f"{self.base_url}/_control/user?{urlencode(dict(settings, name=name))}") as response:
+            return json.load(response)
+
+    def close(self):
+        self.process.terminate()
+        self.process.join()
+
+def _summary(values, scale=1.0, digits=1):
+    if not values:
+        return None
+    return {
+        'avg': round(statistics.mean(values) * scale, digits),
+        'min': round(min(values) * scale, digits),
+        'max': round(max(values) * scale, digits),
+    }
+
+class BenchmarkRunner:
+    def __init__(self, server, output_dir, bitrate, duration):
+        self.server = server
+        self.output_dir = output_dir
+        self.bitrate = bitrate
+        self.duration = duration
+
+    def _new_recorder(self, **stream_settings):
+        from rec_logic import TikTokRecorder
+        user = f"bench_{uuid.uuid4().hex[:8]}"
+        self.server.update_user(user, **stream_settings)
+        recorder = TikTokRecorder(user, custom_output_dir=self.output_dir, segment_minutes=0, segment_mb=0, live_remux=False)
+        recorder.tiktok.room_cache = None
+        # Chỉ đo phần ghi hình: bỏ file khi kết thúc và bỏ qua hậu xử lý
+        recorder.cancellation_requested = True
+        if not recorder.prepare():
+            raise RuntimeError(f"Không lấy được RoomID của {user} từ server giả lập")
+        return recorder
+
+    @staticmethod
+    def _wait_first_byte(recorder, started_at, timeout):
+        deadline = started_at + timeout
+        while time.perf_counter() < deadline:
+            path = recorder.output_filepath
+            if path and os.path.exists(path) and os.path.getsize(path) > 0:
+                return time.perf_counter() - started_at
+            time.sleep(0.005)
+        return None
+
+    def run_streams(self, count, **faults):
+        """Ghi count stream đồng thời trong self.duration giây."""
+        bitrate = faults.pop('bitrate', self.bitrate)
+        recorders = [self._new_recorder(live=1, bitrate=bitrate, **faults) for _ in range(count)]
+        threads = [threading.Thread(target=recorder.start_recording, daemon=True) for recorder in recorders]
+        first_bytes = {}
+
+        cpu_started = time.process_time()
+        started_at = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        while time.perf_counter() - started_at < self.duration:
+            for recorder in recorders:
+                if recorder not in first_bytes:
+                    path = recorder.output_filepath
+                    if path and os.path.exists(path) and os.path.getsize(path) > 0:
+                        first_bytes[recorder] = time.perf_counter() - started_at
+            time.sleep(0.01)
+        for recorder in recorders:
+            recorder.stop()
+        for thread in threads:
+            thread.join()
+        # Recorder đọc nốt block đang dở sau khi dừng nên tính thời gian tới lúc các luồng kết thúc
+        elapsed = time.perf_counter() - started_at
+        cpu = time.process_time() - cpu_started
+        for recorder in recorders:
+            self.server.update_user(recorder.user, live=0)
+
+        expected = bitrate * 1000 / 8 * elapsed
+        received = [recorder.bytes_received for recorder in recorders]
+        total_mb = sum(received) / (1024 * 1024)
+        gaps = [gap['seconds'] for recorder in recorders for gap in recorder.stream_gaps]
+        return {
+            'streams': count,
+            'bitrate_kbps': bitrate,
+            'seconds': round(elapsed, 2),
+            'throughput_kbps': _summary([value * 8 / 1000 / elapsed for value in received]),
+            'aggregate_kbps': round(sum(received) * 8 / 1000 / elapsed, 1),
+            'delivery_ratio': round(sum(received) / (expected * count), 3),
+            'total_mb': round(total_mb, 2),
+            'cpu_seconds': round(cpu, 3),
+            'cpu_ms_per_mb': round(cpu * 1000 / total_mb, 2) if total_mb else None,
+            'first_byte_ms': _summary(list(first_bytes.values()), 1000, 0),
+            'missing_first_byte': count - len(first_bytes),
+            'reconnects': len(gaps),
+            'gap_seconds': _summary(gaps, 1, 2),
+        }
+
+    def throughput(self):
+        return self.run_streams(1)
+
+    def scaling(self, max_streams):
+        results = []
+        count = 1
+        while count <= max_streams:
+            results.append(self.run_streams(count))
+            count *= 2
+        return results
+
+    def golive(self, samples):
+        """Từ lúc server chuyển user sang live: kiểm tra check_alive, lấy URL, kết nối và byte đầu tiên xuống đĩa."""
+        detect, first_byte = [], []
+        for _ in range(samples):
+            recorder = self._new_recorder(live=0, bitrate=self.bitrate)
+            self.server.update_user(recorder.user, live=1)
+            started_at = time.perf_counter()
+            if not recorder.tiktok.check_rooms_alive([recorder.room_id]).get(str(recorder.room_id)):
+                raise RuntimeError("check_alive không thấy user đã live")
+            detect.append(time.perf_counter() - started_at)
+            thread = threading.Thread(target=recorder.start_recording, daemon=True)
+            thread.start()
+            latency = self._wait_first_byte(recorder, started_at, timeout=30)
+            if latency is not None:
+                first_byte.append(latency)
+            recorder.stop()
+            thread.join()
+            self.server.update_user(recorder.user, live=0)
+        return {
+            'samples': samples,
+            'bitrate_kbps': self.bitrate,
+            'detect_ms': _summary(detect, 1000, 1),
+            'first_byte_ms': _summary(first_byte, 1000, 0),
+            'missing_first_byte': samples - len(first_byte),
+        }
+
+    def faults(self):
+        stall_every = max(2.0, self.duration / 4)
+        return {
+            'stalls': self.run_streams(1, stall_every=stall_every, stall_for=1.5),
+            'disconnects': self.run_streams(1, disconnect_after=max(2.0, self.duration / 3)),
+        }
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def _results_path():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), RESULTS_FILE)
+
+def run_benchmarks(args):
+    import logging
+    from logger_setup import logger
+    if not args.verbose:
+        logger.setLevel(logging.ERROR)
+
+    server = FakeServerProcess()
+    from config import TIKTOK_CONFIG
+    TIKTOK_CONFIG['api_endpoints']['base_url'] = server.base_url
+    TIKTOK_CONFIG['api_endpoints']['webcast_url'] = server.base_url
+
+    output_dir = tempfile.mkdtemp(prefix="tiktok_bench_")
+    runner = BenchmarkRunner(server, output_dir, args.bitrate, args.duration)
+    results = {}
+    try:
+        for scenario in args.scenarios:
+            print(f"== {scenario}", flush=True)
+            if scenario == 'throughput':
+                results[scenario] = runner.throughput()
+            elif scenario == 'scaling':
+                results[scenario] = runner.scaling(args.max_streams)
+            elif scenario == 'golive':
+                results[scenario] = runner.golive(args.samples)
+            elif scenario == 'faults':
+                results[scenario] = runner.faults()
+            print(json.dumps(results[scenario], indent=2), flush=True)
+    finally:
+        from rec_logic import close_http_clients
+        from post_processor import get_post_processor
+        get_post_processor().shutdown(wait=True)
+        close_http_clients()
+        server.close()
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    from config import STREAM_BLOCK_SIZE, STREAM_BUFFER_SIZE
+    record = {
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'params': {
+            'bitrate_kbps': args.bitrate, 'duration': args.duration, 'max_streams': args.max_streams,
+            'samples': args.samples, 'stream_block_size': STREAM_BLOCK_SIZE, 'stream_buffer_size': STREAM_BUFFER_SIZE,
+        },
+        'results': results,
+    }
+    with open(_results_path(), 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record) + "\n")
+    print(f"Đã lưu kết quả vào {_results_path()}")
+
+def _flatten(value, prefix=""):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from _flatten(item, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            label = item.get('streams', index) if isinstance(item, dict) else index
+            yield from _flatten(item, f"{prefix}[{label}]")
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+def compare_last_runs():
+    try:
+        with open(_results_path(), 'r', encoding='utf-8') as f:
+            runs = [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        runs = []
+    if len(runs) < 2:
+        print("Cần ít nhất hai lần chạy để so sánh.")
+        return 1
+    old, new = runs[-2], runs[-1]
+    print(f"{old['time']} ({old.get('commit')})  ->  {new['time']} ({new.get('commit')})")
+    if old.get('params') != new.get('params'):
+        print(f"Lưu ý: tham số khác nhau {old.get('params')} -> {new.get('params')}")
+    old_values = dict(_flatten(old['results']))
+    for key, value in _flatten(new['results']):
+        previous = old_values.get(key)
+        if previous is None:
+            print(f"  {key}: {value} (mới)")
+        elif previous == value:
+            print(f"  {key}: {value}")
+        else:
+            change = f"{(value - previous) / abs(previous):+.1%}" if previous else ""
+            print(f"  {key}: {previous} -> {value} {change}")
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark TikTok Live Recorder với server giả lập")
+    parser.add_argument('--scenarios', default="throughput,scaling,golive,faults",
+                        help="Danh sách kịch bản, cách nhau bởi dấu phẩy (throughput, scaling, golive, faults)")
+    parser.add_argument('--bitrate', type=int, default=2500, help="Bitrate stream giả lập (kbps)")
+    parser.add_argument('--duration', type=float, default=10, help="Thời gian ghi của mỗi lần đo (giây)")
+    parser.add_argument('--max-streams', type=int, default=8, help="Số stream đồng thời tối đa cho kịch bản scaling")
+    parser.add_argument('--samples', type=int, default=5, help="Số lần đo cho kịch bản golive")
+    parser.add_argument('--compare', action='store_true', help="So sánh hai lần chạy gần nhất rồi thoát")
+    parser.add_argument('--verbose', action='store_true', help="Hiện log của recorder")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare_last_runs()
+    args.scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(args.scenarios) - {'throughput', 'scaling', 'golive', 'faults'}
+    if unknown:
+        parser.error(f"Kịch bản không hợp lệ: {', '.join(sorted(unknown))}")
+    run_benchmarks(args)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,111 @@
 # Giới hạn của ứng dụng
-MAX_ROWS = 10
-MAX_ACTIVE_USERS = 10
+MAX_ROWS = 500
+MAX_ACTIVE_USERS = 10   # Số user ghi hình cùng lúc; user chỉ đang chờ live không bị tính (chỉ giới hạn bởi MAX_ROWS)
+VISIBLE_ROWS = 12   # Số hàng hiển thị cùng lúc; danh sách dài hơn thì cuộn (chỉ tạo widget cho hàng đang thấy)
+
+# Ghi log (recording.txt): lọc và ghi file trên luồng nền
+LOG_DEDUP_SIZE = 2000        # Số thông điệp gần nhất được nhớ để bỏ log trùng ở bản đóng gói
+
+# Cập nhật giao diện: trạng thái mỗi hàng được gộp, chỉ bản mới nhất được vẽ
+UI_FRAME_MS = 33             # Khoảng cách tối thiểu giữa hai lần áp dụng cập nhật (một khung hình)
+UI_STATS_INTERVAL_MS = 1000  # Chu kỳ làm mới tốc độ/dung lượng của các hàng đang ghi hình
+
+# Kiểm tra live theo lô qua endpoint check_alive
+CHECK_ALIVE_BATCH_SIZE = 50      # Số room tối đa trong một request
+CHECK_ALIVE_BATCH_WINDOW = 0.5   # Các lần kiểm tra đến hạn cách nhau dưới mức này (giây) được gom chung một request
+
+# Lịch kiểm tra live của user đang chờ (một bộ lập lịch chung, không giữ luồng trong lúc chờ)
+POLL_BACKOFF_POLICY = "stepped"  # "stepped": theo POLL_BACKOFF_STEPS, "exponential": nhân đôi từ MIN tới MAX, "fixed": luôn MIN
+POLL_BACKOFF_STEPS = [120, 300, 600, 900]
+POLL_BACKOFF_MIN = 60
+POLL_BACKOFF_MAX = 900
+POLL_JITTER = 0.1                # Lệch ngẫu nhiên ±10% để rải đều các lần kiểm tra
+POLL_ERROR_DELAY = 300           # Chờ (giây) sau khi kiểm tra gặp lỗi
+CAPTURE_SLOT_RETRY = 60          # User đang live nhưng đã đủ số user ghi hình: kiểm tra lại sau chừng này giây
+POLL_WORKERS = 2                 # Số luồng thực hiện kiểm tra
+
+# Dự đoán giờ live từ lịch sử: kiểm tra dày trong khung giờ user hay live, thưa ngoài khung
+LIVE_HISTORY_FILE = "live_history.json"
+LIVE_HISTORY_MAX_ENTRIES = 200   # Số lần bắt đầu live lưu lại cho mỗi user
+LIVE_PREDICT_MIN_SAMPLES = 3     # Cần ít nhất chừng này lần live để bắt đầu dự đoán (0 = tắt)
+LIVE_PREDICT_THRESHOLD = 0.15    # Tỉ lệ (có trọng số) số lần live rơi vào khung giờ để coi là khung dự đoán
+LIVE_PREDICT_LEAD = 15 * 60      # Bắt đầu kiểm tra dày trước khung dự đoán chừng này giây
+LIVE_PREDICT_INTERVAL = 60       # Chu kỳ (giây) kiểm tra trong khung dự đoán
+LIVE_PREDICT_OUTSIDE_MAX = 30 * 60  # Chờ tối đa (giây) ngoài khung dự đoán
+
+# Engine ghi hình: "thread" (mỗi user một luồng) hoặc "asyncio" (một event loop, cần aiohttp)
+RECORDING_ENGINE = "thread"
+ASYNC_MAX_ACTIVE_USERS = 200     # Giới hạn user ghi hình cùng lúc khi dùng engine asyncio
+ASYNC_MAX_CONNECTIONS = 100      # Số kết nối HTTP tối đa của engine asyncio
+ASYNC_IO_WORKERS = 4             # Số luồng ghi file dùng chung cho engine asyncio
+ASYNC_READ_CHUNK_SIZE = 64 * 1024
+ASYNC_WRITE_SIZE = 512 * 1024    # Gom dữ liệu tới kích thước này trước mỗi lần ghi đĩa
+
+# Cache username -> RoomID trên đĩa
+ROOM_ID_CACHE_FILE = "room_cache.json"
+ROOM_ID_CACHE_TTL = 6 * 60 * 60  # Giây; đặt 0 để tắt cache
+
+# Bộ đệm giữa luồng nhận stream và luồng ghi đĩa (mỗi recorder)
+STREAM_BUFFER_SIZE = 8 * 1024 * 1024
+STREAM_BLOCK_SIZE = 256 * 1024   # Kích thước mỗi lần ghi xuống đĩa
+STREAM_READ_SIZE = 64 * 1024     # Tối đa mỗi lần đọc socket; đọc phần đã có sẵn để Dừng/thời gian chờ phản hồi nhanh với stream bitrate thấp
+STREAM_BUFFER_WARN_RATIO = 0.8   # Cảnh báo khi bộ đệm đầy quá tỉ lệ này
+
+# Ghi theo segment: mở file mới sau mỗi N phút hoặc N MB (0 = tắt), chỉ cắt tại keyframe
+SEGMENT_DURATION_MINUTES = 0
+SEGMENT_SIZE_MB = 0
+SEGMENT_CONCAT_AT_END = True     # Ghép các segment thành một MP4 (không nén lại) khi kết thúc
+
+# Hậu xử lý (remux/MP3) chạy trong hàng đợi riêng, giới hạn số FFmpeg chạy cùng lúc
+POST_PROCESS_WORKERS = 0         # 0 = tự động theo số nhân CPU
+FFMPEG_LOW_PRIORITY = True       # Hạ độ ưu tiên tiến trình FFmpeg hậu xử lý để không ảnh hưởng việc ghi
+
+# Pool kết nối HTTP dùng chung cho mọi recorder (keep-alive)
+HTTP_POOL_HOSTS = 10                         # Số host được giữ pool riêng
+HTTP_POOL_SIZE = MAX_ACTIVE_USERS + 5        # Kết nối giữ lại mỗi host cho API (recorder + poller)
+HTTP_STREAM_POOL_SIZE = MAX_ACTIVE_USERS     # Kết nối kéo stream từ CDN
+
+# Tự kết nối lại khi mất stream mà user vẫn live; các phần được ghép liền mạch khi xử lý
+RECONNECT_ATTEMPTS = 5
+RECONNECT_DELAY = 2              # Giây, tăng gấp đôi sau mỗi lần thử
+
+# Phân tích tag FLV khi ghi: thống kê, kiểm tra file và chỉ mục keyframe (file .idx.json cạnh file FLV)
+FLV_KEYFRAME_INDEX = True
+FLV_GAP_THRESHOLD_MS = 1000      # Khoảng trống timestamp lớn hơn mức này được ghi nhận là gián đoạn
+
+# Số liệu theo dõi recorder (tùy chọn): tốc độ ghi, độ trễ API, hàng đợi FFmpeg, pool kết nối
+METRICS_PORT = 0          # Cổng HTTP trên 127.0.0.1 phục vụ /metrics (Prometheus) và /metrics.json; 0 = tắt
+METRICS_FILE = ""         # File JSON ghi số liệu định kỳ (đường dẫn tương đối tính từ thư mục chương trình); rỗng = tắt
+METRICS_INTERVAL = 15     # Giây giữa hai lần ghi METRICS_FILE
+
+# Dung lượng ổ đĩa: kiểm tra trước khi ghi hình và trong lúc ghi
+STORAGE_MIN_FREE_MB = 2048          # Dưới mức này không bắt đầu ghi hình mới
+STORAGE_CRITICAL_MB = 512           # Dưới mức này khi đang ghi: dừng (vẫn lưu file) phiên bắt đầu gần nhất
+STORAGE_LOW_HOURS = 2               # Dự đoán đầy đĩa trong vòng N giờ: phiên mới ghi ở chất lượng thấp hơn (SD)
+STORAGE_DEFAULT_BITRATE_KBPS = 4000 # Tốc độ ước lượng của một stream mới khi chưa có phiên nào để đo
+STORAGE_CHECK_INTERVAL = 10         # Giây giữa hai lần đo tốc độ ghi và dung lượng trống
+
+# Chính sách lưu giữ: dọn thư mục Output/<user> trên luồng nền (0/False = tắt từng quy tắc)
+RETENTION_MAX_AGE_DAYS = 0          # Xóa file cũ hơn N ngày
+RETENTION_MAX_USER_GB = 0           # Giới hạn tổng dung lượng mỗi user, xóa file cũ nhất trước
+RETENTION_KEEP_MP3_ONLY = False     # Xóa file MP4 khi đã có file MP3 cùng tên
+RETENTION_INTERVAL_MINUTES = 30     # Chu kỳ dọn
+RETENTION_MIN_AGE_MINUTES = 60      # Không đụng tới file mới sửa trong N phút (đang ghi/hậu xử lý)
+
+# Nhật ký sự kiện JSON-lines (resolve, poll, go-live, byte đầu tiên, dừng, remux...) để phân tích offline
+EVENT_LOG_FILE = "events.jsonl"   # Đường dẫn tương đối tính từ thư mục chương trình; rỗng = tắt
+EVENT_LOG_MAX_MB = 20             # Xoay vòng file khi vượt kích thước này
+EVENT_LOG_BACKUPS = 5             # Số file cũ giữ lại (events.jsonl.1 ... .5)
+
+# Cache đường dẫn FFmpeg và danh sách encoder, lưu cạnh file chạy để khởi động không phải tìm lại
+FFMPEG_CACHE_FILE = "ffmpeg_cache.json"
+
+# Cache thông tin media (probe header bằng FFmpeg), khóa theo đường dẫn + kích thước + mtime
+PROBE_CACHE_SIZE = 256
+PROBE_KEYFRAME_SCAN_BYTES = 4 * 1024 * 1024  # Đọc tối đa chừng này byte đầu file FLV để ước lượng khoảng keyframe
+
+# Remux trực tiếp: đẩy stream vào FFmpeg để xuất MP4 phân mảnh (xem được khi đang ghi, không remux khi dừng)
+LIVE_REMUX = False
 
 # Cấu hình cookies và API
 COOKIES = {
@@ -25,13 +130,14 @@ TIKTOK_CONFIG = {
 }
 
 # Nội dung README cho cửa sổ "About"
-README_CONTENT = """
+README_CONTENT = f"""
 TikTok Live Recorder - Hướng Dẫn Sử Dụng
 
 1. Mô tả
 
 TikTok Live Recorder giúp bạn ghi hình livestream TikTok, lưu thành file MP4 và chuyển sang MP3 nếu cần.
-Chương trình hỗ trợ ghi nhiều user (tối đa 10) cùng lúc và có chế độ tự động kiểm tra, ghi hình khi user livestream.
+Chương trình theo dõi tối đa {MAX_ROWS} user (mỗi user một hàng), tự động ghi hình khi user livestream và ghi
+tối đa {MAX_ACTIVE_USERS} user cùng lúc; user lên live khi đã đủ suất sẽ chờ tới khi có suất trống.
 Sử dụng File -> Exit để thoát khẩn cấp nếu chương trình quá tải (chú ý: sẽ không có dữ liệu nào được lưu lại).
 
 2. Yêu cầu
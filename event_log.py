@@ -0,0 +1,85 @@
+"""Nhật ký sự kiện dạng JSON-lines để phân tích offline độ trễ từng giai đoạn của phiên ghi hình.
+
+Mỗi dòng là một object:
+    {"ts": 1700000000.123, "event": "first_byte", "recording_id": "...", "session_id": "...", ...}
+
+Sự kiện: resolve, poll, go_live, first_byte, piece_end, reconnect, stop, remux_start/remux_end,
+concat_start/concat_end. Như recording.txt, file được ghi nối tiếp qua các lần chạy và xoay vòng
+theo kích thước; việc ghi chạy trên luồng nền như log chính.
+"""
+
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+
+from config import EVENT_LOG_FILE, EVENT_LOG_MAX_MB, EVENT_LOG_BACKUPS
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        event = {'ts': round(record.created, 3), 'event': record.msg}
+        event.update(record.fields)
+        return json.dumps(event, ensure_ascii=False, default=str)
+
+class EventLog:
+    def __init__(self, path):
+        self.path = path
+        self.logger = logging.getLogger('TikTokRecorder.events')
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        file_handler = RotatingFileHandler(
+            path, maxBytes=EVENT_LOG_MAX_MB * 1024 * 1024, backupCount=EVENT_LOG_BACKUPS, encoding='utf-8'
+        )
+        file_handler.setFormatter(JsonLinesFormatter())
+        event_queue = queue.SimpleQueue()
+        self.logger.addHandler(QueueHandler(event_queue))
+        self.listener = QueueListener(event_queue, file_handler)
+        self.listener.start()
+        atexit.register(self.stop)
+
+    def emit(self, event, fields):
+        self.logger.info(event, extra={'fields': fields})
+
+    def stop(self):
+        if self.listener:
+            self.listener.stop()
+            self.listener = None
+
+_event_log = None
+_event_log_lock = threading.Lock()
+_event_log_failed = False
+
+def get_event_log():
+    """Nhật ký sự kiện dùng chung; None nếu bị tắt (EVENT_LOG_FILE rỗng) hoặc không mở được file."""
+    global _event_log, _event_log_failed
+    if _event_log is not None or _event_log_failed or not EVENT_LOG_FILE:
+        return _event_log
+    with _event_log_lock:
+        if _event_log is None and not _event_log_failed:
+            path = EVENT_LOG_FILE
+            if not os.path.isabs(path):
+                if hasattr(sys, '_MEIPASS'):
+                    base_path = os.path.dirname(sys.executable)
+                else:
+                    base_path = os.path.dirname(os.path.abspath(__file__))
+                path = os.path.join(base_path, path)
+            try:
+                _event_log = EventLog(os.path.normpath(path))
+            except OSError as e:
+                from logger_setup import logger
+                logger.warning(f"Không mở được file nhật ký sự kiện {path}: {e}")
+                _event_log_failed = True
+        return _event_log
+
+def log_event(event, recording_id=None, **fields):
+    """Ghi một sự kiện; thời lượng tính bằng giây, kích thước bằng byte."""
+    event_log = get_event_log()
+    if event_log is None:
+        return
+    if recording_id is not None:
+        fields = {'recording_id': recording_id, **fields}
+    event_log.emit(event, fields)
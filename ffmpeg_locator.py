@@ -0,0 +1,170 @@
+import os
+import re
+import sys
+import json
+import shutil
+import subprocess
+import threading
+
+from logger_setup import logger
+from config import FFMPEG_CACHE_FILE
+
+# Tên file FFmpeg và cờ ẩn cửa sổ console chỉ có trên Windows
+FFMPEG_BINARY = 'ffmpeg.exe' if sys.platform == 'win32' else 'ffmpeg'
+NO_WINDOW_FLAGS = getattr(subprocess, 'CREATE_NO_WINDOW', 0)
+
+ENCODER_RE = re.compile(r"^\s*[VASFXBD.]{6}\s+(\S+)")
+
+def _app_dir():
+    if hasattr(sys, '_MEIPASS'):
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.abspath(__file__))
+
+def _bundled_ffmpeg():
+    """Đường dẫn FFmpeg đi kèm chương trình (thư mục ffmpeg cạnh file chạy)."""
+    base_path = sys._MEIPASS if hasattr(sys, '_MEIPASS') else _app_dir()
+    return os.path.normpath(os.path.join(base_path, 'ffmpeg', FFMPEG_BINARY))
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+def setup_ffmpeg():
+    """Tìm FFmpeg (thư mục ffmpeg cạnh chương trình, sau đó tới PATH) và trả về đường dẫn."""
+    ffmpeg_path = _bundled_ffmpeg()
+    if os.path.exists(ffmpeg_path):
+        logger.info(f"Đã tìm thấy FFmpeg trong thư mục chương trình")
+    else:
+        logger.warning(f"Không tìm thấy {FFMPEG_BINARY} trong {os.path.dirname(ffmpeg_path)}, thử tìm trong PATH")
+        ffmpeg_path = shutil.which("ffmpeg")
+        if ffmpeg_path:
+            logger.info(f"Đã tìm thấy FFmpeg trong PATH")
+        else:
+            logger.warning("Không tìm thấy FFmpeg trong PATH")
+
+    if not ffmpeg_path:
+        error_msg = (
+            f"Không tìm thấy FFmpeg. Vui lòng tải và đặt '{FFMPEG_BINARY}' vào thư mục 'ffmpeg' "
+            "cùng cấp với chương trình, hoặc thêm vào biến môi trường PATH."
+        )
+        logger.error(error_msg)
+        raise FileNotFoundError(error_msg)
+
+    ffmpeg_path = os.path.normpath(ffmpeg_path)
+
+    if not os.access(ffmpeg_path, os.X_OK):
+        error_msg = f"Không có quyền thực thi FFmpeg tại {ffmpeg_path}."
+        logger.error(error_msg)
+        raise PermissionError(error_msg)
+
+    return ffmpeg_path
+
+class FFmpegLocator:
+    """Đường dẫn và khả năng (phiên bản, encoder) của FFmpeg, cache trên đĩa cạnh file chạy.
+
+    Cache còn hiệu lực khi file FFmpeg vẫn giữ nguyên kích thước/mtime và không có bản
+    đi kèm chương trình mới được thêm vào, nên các lần khởi động sau chỉ tốn một lệnh stat.
+    """
+    def __init__(self, path=None):
+        self.cache_path = os.path.normpath(path or os.path.join(_app_dir(), FFMPEG_CACHE_FILE))
+        self.lock = threading.Lock()
+        self.cache = None
+        self.ffmpeg_path = None
+        self.probe_failed = False
+
+    def _load(self):
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+            if isinstance(cache, dict):
+                return cache
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Không đọc được cache FFmpeg, tìm lại: {e}")
+        return {}
+
+    def _save(self):
+        tmp_path = f"{self.cache_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.cache, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logger.warning(f"Không ghi được cache FFmpeg: {e}")
+
+    def _is_cache_valid(self, cache):
+        path = cache.get('path')
+        if not path or _file_signature(path) != cache.get('signature'):
+            return False
+        bundled = _bundled_ffmpeg()
+        if path != bundled and os.path.exists(bundled):
+            return False
+        return os.access(path, os.X_OK)
+
+    def get_path(self):
+        """Đường dẫn FFmpeg; lần đầu đọc cache hoặc tìm lại, ném FileNotFoundError nếu không có."""
+        with self.lock:
+            if self.ffmpeg_path:
+                return self.ffmpeg_path
+            cache = self._load()
+            if self._is_cache_valid(cache):
+                logger.debug(f"Dùng đường dẫn FFmpeg đã cache: {cache['path']}")
+                self.cache = cache
+            else:
+                path = setup_ffmpeg()
+                self.cache = {'path': path, 'signature': _file_signature(path)}
+                self._save()
+            self.ffmpeg_path = self.cache['path']
+            return self.ffmpeg_path
+
+    def get_capabilities(self):
+        """{'version', 'encoders'} của FFmpeg hiện tại; None nếu không chạy được FFmpeg."""
+        path = self.get_path()
+        with self.lock:
+            if self.probe_failed:
+                return None
+            if 'encoders' not in self.cache:
+                try:
+                    version = self._run(path, "-version").splitlines()[0].strip()
+                    encoders = []
+                    for line in self._run(path, "-encoders").splitlines():
+                        match = ENCODER_RE.match(line)
+                        if match and match.group(1) != '=':
+                            encoders.append(match.group(1))
+                except (OSError, IndexError, subprocess.SubprocessError) as e:
+                    logger.warning(f"Không kiểm tra được khả năng của FFmpeg: {e}")
+                    self.probe_failed = True
+                    return None
+                self.cache.update(version=version, encoders=encoders)
+                self._save()
+                logger.info(f"{version}, {len(encoders)} encoder")
+            return {'version': self.cache['version'], 'encoders': self.cache['encoders']}
+
+    @staticmethod
+    def _run(path, option):
+        process = subprocess.run(
+            [path, "-hide_banner", option], capture_output=True, timeout=15, creationflags=NO_WINDOW_FLAGS
+        )
+        return process.stdout.decode('utf-8', errors='ignore')
+
+_ffmpeg_locator = None
+_ffmpeg_locator_lock = threading.Lock()
+
+def get_ffmpeg_locator():
+    global _ffmpeg_locator
+    with _ffmpeg_locator_lock:
+        if _ffmpeg_locator is None:
+            _ffmpeg_locator = FFmpegLocator()
+        return _ffmpeg_locator
+
+def get_ffmpeg_path():
+    return get_ffmpeg_locator().get_path()
+
+def has_ffmpeg_encoder(name):
+    """FFmpeg có encoder name hay không; coi như có khi không kiểm tra được."""
+    capabilities = get_ffmpeg_locator().get_capabilities()
+    return capabilities is None or name in capabilities['encoders']
@@ -0,0 +1,223 @@
+import os
+import json
+import mmap
+import struct
+
+FLV_SIGNATURE = b'FLV'
+FLV_HEADER_SIZE = 9
+PREVIOUS_TAG_SIZE = 4
+TAG_HEADER_SIZE = 11
+
+TAG_AUDIO = 8
+TAG_VIDEO = 9
+TAG_SCRIPT = 18
+
+VIDEO_FRAME_KEY = 1
+VIDEO_CODECS_WITH_PACKET_TYPE = (7, 12, 13)  # AVC, HEVC (bản mở rộng), AV1
+AUDIO_CODEC_AAC = 10
+
+class FlvTag:
+    """Thông tin một tag FLV hoàn chỉnh trong buffer (không sao chép dữ liệu)."""
+    __slots__ = ('type', 'timestamp', 'data_size', 'offset', 'end', 'is_keyframe', 'is_sequence_header')
+
+    def __init__(self, tag_type, timestamp, data_size, offset, end, is_keyframe, is_sequence_header):
+        self.type = tag_type
+        self.timestamp = timestamp
+        self.data_size = data_size
+        self.offset = offset
+        self.end = end
+        self.is_keyframe = is_keyframe
+        self.is_sequence_header = is_sequence_header
+
+def parse_flv_header(buf, offset=0):
+    """Trả về vị trí tag đầu tiên sau header FLV, None nếu chưa đủ dữ liệu.
+
+    Ném ValueError nếu dữ liệu không phải FLV.
+    """
+    if len(buf) - offset < FLV_HEADER_SIZE:
+        return None
+    if bytes(buf[offset:offset + 3]) != FLV_SIGNATURE:
+        raise ValueError("Dữ liệu không phải FLV")
+    header_size = struct.unpack_from('>I', buf, offset + 5)[0]
+    first_tag = offset + header_size + PREVIOUS_TAG_SIZE
+    if len(buf) < first_tag:
+        return None
+    return first_tag
+
+def read_tag_header(buf, offset):
+    """Giải mã header tag FLV tại offset (cần TAG_HEADER_SIZE + 2 byte, hoặc tới hết tag).
+
+    Trả về (tag_type, data_size, timestamp, is_keyframe, is_sequence_header).
+    """
+    tag_type = buf[offset] & 0x1F
+    data_size = (buf[offset + 1] << 16) | (buf[offset + 2] << 8) | buf[offset + 3]
+    timestamp = (buf[offset + 7] << 24) | (buf[offset + 4] << 16) | (buf[offset + 5] << 8) | buf[offset + 6]
+
+    body = offset + TAG_HEADER_SIZE
+    is_keyframe = False
+    is_sequence_header = False
+    if tag_type == TAG_VIDEO and data_size >= 1:
+        is_keyframe = (buf[body] >> 4) == VIDEO_FRAME_KEY
+        if data_size >= 2 and (buf[body] & 0x0F) in VIDEO_CODECS_WITH_PACKET_TYPE:
+            is_sequence_header = buf[body + 1] == 0
+    elif tag_type == TAG_AUDIO and data_size >= 2:
+        is_sequence_header = (buf[body] >> 4) == AUDIO_CODEC_AAC and buf[body + 1] == 0
+    return tag_type, data_size, timestamp, is_keyframe, is_sequence_header
+
+def iter_tags(buf, offset=0):
+    """Duyệt các tag FLV hoàn chỉnh trong buf bắt đầu từ offset.
+
+    Dừng ở tag cuối bị cắt dở; tag.end của tag cuối cùng là vị trí cần đọc tiếp.
+    """
+    length = len(buf)
+    while offset + TAG_HEADER_SIZE <= length:
+        data_size = (buf[offset + 1] << 16) | (buf[offset + 2] << 8) | buf[offset + 3]
+        end = offset + TAG_HEADER_SIZE + data_size + PREVIOUS_TAG_SIZE
+        if end > length:
+            return
+        tag_type, data_size, timestamp, is_keyframe, is_sequence_header = read_tag_header(buf, offset)
+        yield FlvTag(tag_type, timestamp, data_size, offset, end, is_keyframe, is_sequence_header)
+        offset = end
+
+STREAM_NAMES = {TAG_VIDEO: 'video', TAG_AUDIO: 'audio', TAG_SCRIPT: 'script'}
+
+class FlvStats:
+    """Thống kê một stream FLV chỉ từ header các tag, không đọc phần dữ liệu.
+
+    feed() nhận dữ liệu theo từng phần (lúc đang ghi) hoặc một memoryview của cả
+    file (mmap); chỉ header tag bị cắt ngang giữa hai lần gọi là được giữ lại.
+    """
+    HEADER_PEEK = TAG_HEADER_SIZE + 2
+
+    def __init__(self, gap_threshold_ms=1000):
+        self.gap_threshold_ms = gap_threshold_ms
+        self.is_flv = None
+        self.header = bytearray()
+        self.carry = bytearray()
+        self.skip = 0
+        self.offset = 0
+        self.tag_count = 0
+        self.bytes = {}
+        self.first_ts = {}
+        self.last_ts = {}
+        self.gaps = []
+        self.keyframes = []
+
+    def feed(self, data):
+        if self.is_flv is False:
+            return
+        view = memoryview(data)
+        position = 0
+        if self.is_flv is None:
+            position = self._feed_header(view)
+            if position is None:
+                return
+        length = len(view)
+        while position < length:
+            if self.skip:
+                taken = min(self.skip, length - position)
+                self.skip -= taken
+                position += taken
+                self.offset += taken
+                continue
+            missing = self.HEADER_PEEK - len(self.carry)
+            if length - position < missing:
+                self.carry += view[position:]
+                self.offset += length - position
+                return
+            if self.carry:
+                header = self.carry + view[position:position + missing]
+                tag_offset = self.offset - len(self.carry)
+                self.carry = bytearray()
+            else:
+                header = view[position:position + self.HEADER_PEEK]
+                tag_offset = self.offset
+            position += missing
+            self.offset += missing
+            self._add_tag(tag_offset, *read_tag_header(header, 0))
+            self.skip = TAG_HEADER_SIZE + header[1] * 65536 + header[2] * 256 + header[3] + PREVIOUS_TAG_SIZE - self.HEADER_PEEK
+
+    def _feed_header(self, view):
+        """Gom header FLV; trả về số byte của view đã dùng, None nếu cần thêm dữ liệu hoặc không phải FLV."""
+        start = len(self.header)
+        self.header += view[:max(FLV_HEADER_SIZE + PREVIOUS_TAG_SIZE - start, 0)]
+        try:
+            first_tag = parse_flv_header(self.header)
+        except ValueError:
+            self.is_flv = False
+            return None
+        if first_tag is None:
+            if len(self.header) < FLV_HEADER_SIZE + PREVIOUS_TAG_SIZE:
+                return None
+            # Header dài hơn 9 byte chuẩn: phần còn lại được bỏ qua như thân tag
+            first_tag = struct.unpack_from('>I', self.header, 5)[0] + PREVIOUS_TAG_SIZE
+        self.is_flv = True
+        self.offset = len(self.header)
+        self.skip = first_tag - self.offset
+        return self.offset - start
+
+    def _add_tag(self, offset, tag_type, data_size, timestamp, is_keyframe, is_sequence_header):
+        self.tag_count += 1
+        self.bytes[tag_type] = self.bytes.get(tag_type, 0) + TAG_HEADER_SIZE + data_size + PREVIOUS_TAG_SIZE
+        # Sequence header được lặp lại ở đầu mỗi segment với timestamp cũ, không tính vào thời lượng
+        if tag_type not in (TAG_AUDIO, TAG_VIDEO) or is_sequence_header:
+            return
+        last = self.last_ts.get(tag_type)
+        if last is None:
+            self.first_ts[tag_type] = timestamp
+        elif timestamp < last or timestamp - last > self.gap_threshold_ms:
+            self.gaps.append((STREAM_NAMES[tag_type], last, timestamp))
+        self.last_ts[tag_type] = timestamp
+        if tag_type == TAG_VIDEO and is_keyframe and not is_sequence_header:
+            self.keyframes.append((timestamp, offset))
+
+    @property
+    def duration(self):
+        """Thời lượng (giây) của stream dài nhất."""
+        spans = [self.last_ts[t] - self.first_ts[t] for t in self.last_ts]
+        return max(spans) / 1000 if spans else 0.0
+
+    def bitrates(self):
+        """Bitrate trung bình (bit/s) của từng stream."""
+        duration = self.duration
+        if not duration:
+            return {}
+        return {STREAM_NAMES[t]: int(self.bytes.get(t, 0) * 8 / duration) for t in (TAG_VIDEO, TAG_AUDIO) if t in self.bytes}
+
+    def is_valid(self):
+        """File có header FLV và ít nhất một keyframe video hoặc dữ liệu audio."""
+        return bool(self.is_flv and (self.keyframes or self.bytes.get(TAG_AUDIO)))
+
+    def summary(self):
+        return {
+            'duration': round(self.duration, 3),
+            'tags': self.tag_count,
+            'bitrates': self.bitrates(),
+            'keyframes': len(self.keyframes),
+            'gaps': [{'stream': stream, 'from': start, 'to': end} for stream, start, end in self.gaps],
+        }
+
+def keyframe_index_path(path):
+    return f"{path}.idx.json"
+
+def write_keyframe_index(path, stats):
+    """Ghi file chỉ mục keyframe (timestamp ms, vị trí byte) đi kèm file FLV."""
+    index = dict(stats.summary(), keyframes=stats.keyframes)
+    tmp_path = keyframe_index_path(path) + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, keyframe_index_path(path))
+
+def scan_flv_file(path, gap_threshold_ms=1000):
+    """Đọc một lượt header các tag của file FLV có sẵn (qua mmap) và trả về FlvStats."""
+    stats = FlvStats(gap_threshold_ms)
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return stats
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                stats.feed(view)
+            finally:
+                view.release()
+    return stats
@@ -6,9 +6,141 @@ from tkinter import ttk, scrolledtext, filedialog
 import sys
 import os
 from ui_utils import ToolTip, center_dialog
-from config import README_CONTENT
+from config import README_CONTENT, VISIBLE_ROWS
 from logger_setup import logger
 
+# Nhóm trạng thái để lọc/sắp xếp, theo tiền tố của dòng trạng thái (thứ tự = thứ tự khi sắp xếp)
+ROW_CATEGORIES = (
+    ("Đang ghi", ("Đang ghi hình", "Kết nối lại", "Đang xử lý", "Đang dừng", "Đang hủy")),
+    ("Chờ live", ("Chờ live", "Kiểm tra live", "Lấy RoomID", "Đang live")),
+    ("Lỗi", ("Lỗi", "Đã hủy", "Đã dừng/Lỗi", "Ổ đĩa")),
+)
+IDLE_CATEGORY = "Rảnh"
+STATUS_FILTERS = ("Tất cả",) + tuple(name for name, _ in ROW_CATEGORIES) + (IDLE_CATEGORY,)
+SORT_OPTIONS = ("Thứ tự thêm", "Username", "Trạng thái")
+
+def row_category(model):
+    for name, prefixes in ROW_CATEGORIES:
+        if model.status.startswith(prefixes):
+            return name
+    return IDLE_CATEGORY
+
+def format_stats(rate, size):
+    """Tốc độ (byte/giây) và dung lượng (byte) dạng ngắn gọn để hiển thị trên hàng."""
+    size_text = f"{size / 1024 ** 3:.2f} GB" if size >= 1024 ** 3 else f"{size / 1024 ** 2:.1f} MB"
+    return f"{rate / 1024:.0f} KB/s · {size_text}"
+
+class RowSlot:
+    """
+    Một bộ widget của danh sách hàng. Số slot cố định (VISIBLE_ROWS), mỗi slot được gắn
+    vào UserRowModel đang nằm ở vị trí của nó khi cuộn/lọc; dữ liệu luôn nằm trong model.
+    """
+    def __init__(self, view, index):
+        self.view = view
+        self.controller = view.controller
+        self.row_id = None
+        self.shown_input = None
+        self.shown_duration = None
+        parent = view.list_frame
+
+        action_button_frame = tk.Frame(parent)
+        action_button_frame.grid(row=index, column=0, padx=(0, 5), pady=2, sticky="w")
+        self.add_button = tk.Button(action_button_frame, text="➕", command=self.controller.add_user_row, width=2)
+        self.add_button.pack(side=tk.LEFT)
+        ToolTip(self.add_button, "Thêm user mới")
+        self.remove_button = tk.Button(action_button_frame, text="➖", command=lambda: self.controller.remove_user_row(self.row_id), width=2)
+        self.remove_button.pack(side=tk.LEFT, padx=2)
+        ToolTip(self.remove_button, "Xóa hàng / Hủy ghi hình (không lưu file)")
+
+        self.url_entry = tk.Entry(parent, width=30)
+        self.url_entry.grid(row=index, column=1, padx=(0, 5), pady=2, sticky="ew")
+        ToolTip(self.url_entry, "Nhập username hoặc link rồi nhấn nút ▶")
+
+        controls_frame = tk.Frame(parent)
+        controls_frame.grid(row=index, column=2, padx=(0, 5), pady=2, sticky="w")
+        self.start_button = tk.Button(controls_frame, text="▶", command=lambda: self.controller.start_recording(self.row_id), width=2)
+        self.start_button.pack(side=tk.LEFT)
+        ToolTip(self.start_button, "Bắt đầu ghi hình")
+        self.stop_button = tk.Button(controls_frame, text="■", command=lambda: self.controller.stop_recording(self.row_id), width=2, state="disabled")
+        self.stop_button.pack(side=tk.LEFT, padx=2)
+        ToolTip(self.stop_button, "Dừng ghi hình & lưu file")
+
+        options_frame = tk.Frame(parent)
+        options_frame.grid(row=index, column=3, padx=(0, 5), pady=2, sticky="w")
+
+        self.duration_entry = tk.Entry(options_frame, width=10)
+        self.duration_entry.pack(side=tk.LEFT, padx=2)
+        ToolTip(self.duration_entry, "Thời gian ghi (giây), để trống nếu không giới hạn")
+
+        self.convert_var = tk.BooleanVar(value=True)
+        self.convert_check = tk.Checkbutton(options_frame, variable=self.convert_var, command=self.on_convert_toggle)
+        self.convert_check.pack(side=tk.LEFT)
+        ToolTip(self.convert_check, "Chuyển file video sang MP3 sau khi ghi hình")
+
+        self.status_label = tk.Label(parent, text="Chờ", width=20, anchor="w", fg="grey")
+        self.status_label.grid(row=index, column=4, padx=(5, 0), pady=2, sticky="w")
+
+        self.stats_label = tk.Label(parent, text="", width=20, anchor="e", fg="grey")
+        self.stats_label.grid(row=index, column=5, padx=(5, 0), pady=2, sticky="e")
+        ToolTip(self.stats_label, "Tốc độ nhận stream và dung lượng đã ghi")
+
+        self.url_entry.bind("<FocusOut>", lambda e: self.commit())
+        self.duration_entry.bind("<FocusOut>", lambda e: self.commit())
+
+        self.widgets = [action_button_frame, self.url_entry, controls_frame, options_frame, self.status_label, self.stats_label]
+        for widget in self.widgets + action_button_frame.winfo_children() + controls_frame.winfo_children() + options_frame.winfo_children():
+            view.bind_mousewheel(widget)
+
+    def commit(self):
+        """Lưu nội dung đang nhập dở vào model (trước khi slot được gắn sang hàng khác)."""
+        model = self.controller.user_rows.get(self.row_id)
+        if not model or model.recorder: return
+        model.duration_text = self.duration_entry.get().strip()
+        self.shown_duration = model.duration_text
+        self.controller.handle_url_entry_focus_out(self.row_id, self.url_entry.get())
+
+    def on_convert_toggle(self):
+        model = self.controller.user_rows.get(self.row_id)
+        if model: model.convert_to_mp3 = self.convert_var.get()
+
+    @staticmethod
+    def _set_entry(entry, text):
+        entry.config(state='normal')
+        entry.delete(0, tk.END)
+        entry.insert(0, text)
+
+    def show(self, model, add_enabled=True):
+        if model.id != self.row_id:
+            self.row_id = model.id
+            self.shown_input = self.shown_duration = None
+        is_recording = model.recorder is not None
+
+        # Chỉ ghi đè ô nhập khi model đổi (chuẩn hóa, xóa, gắn hàng khác) để không mất con trỏ đang gõ
+        if self.shown_input != model.input_text:
+            self._set_entry(self.url_entry, model.input_text)
+            self.shown_input = model.input_text
+        if self.shown_duration != model.duration_text:
+            self._set_entry(self.duration_entry, model.duration_text)
+            self.shown_duration = model.duration_text
+        self.convert_var.set(model.convert_to_mp3)
+
+        self.url_entry.config(state='disabled' if is_recording else 'normal')
+        self.start_button.config(state='disabled' if is_recording else 'normal')
+        self.stop_button.config(state='normal' if is_recording else 'disabled')
+        self.duration_entry.config(state='disabled' if is_recording else 'normal')
+        self.convert_check.config(state='disabled' if is_recording else 'normal')
+        self.add_button.config(state='normal' if add_enabled else 'disabled')
+
+        self.status_label.config(text=model.status, fg=model.status_color)
+        self.stats_label.config(text=model.stats_text)
+        for widget in self.widgets:
+            widget.grid()
+
+    def hide(self):
+        self.row_id = None
+        for widget in self.widgets:
+            widget.grid_remove()
+
 class GUIView:
     def __init__(self, root, controller):
         self.root = root
@@ -17,7 +149,12 @@ class GUIView:
         self.dialog_result = None
         self.initial_height = 150
         self.row_height = 40
-        self.WINDOW_WIDTH = 850
+        self.WINDOW_WIDTH = 1000
+        self.slots = []
+        self.visible_ids = []    # row_id sau khi lọc/sắp xếp, theo thứ tự hiển thị
+        self.first_index = 0     # Vị trí trong visible_ids của slot đầu tiên
+        self.add_enabled = True
+        self.relayout_pending = False
 
         self.root.title("Recording TikTok Live v1.3.0")
         self.root.resizable(False, False)
@@ -66,9 +203,35 @@ class GUIView:
         self.output_dir_entry.insert(0, default_output_path)
         self.output_dir_entry.pack(side=tk.LEFT, fill="x", expand=True)
 
+        filter_frame = tk.Frame(self.root, padx=10)
+        filter_frame.pack(padx=10, pady=(5, 0), fill="x")
+        tk.Label(filter_frame, text="Lọc:").pack(side=tk.LEFT)
+        self.filter_var = tk.StringVar()
+        filter_entry = tk.Entry(filter_frame, textvariable=self.filter_var, width=20)
+        filter_entry.pack(side=tk.LEFT, padx=(2, 10))
+        ToolTip(filter_entry, "Chỉ hiện các user có tên chứa chuỗi này")
+        tk.Label(filter_frame, text="Trạng thái:").pack(side=tk.LEFT)
+        self.status_filter = ttk.Combobox(filter_frame, values=STATUS_FILTERS, state="readonly", width=10)
+        self.status_filter.current(0)
+        self.status_filter.pack(side=tk.LEFT, padx=(2, 10))
+        tk.Label(filter_frame, text="Sắp xếp:").pack(side=tk.LEFT)
+        self.sort_option = ttk.Combobox(filter_frame, values=SORT_OPTIONS, state="readonly", width=12)
+        self.sort_option.current(0)
+        self.sort_option.pack(side=tk.LEFT, padx=2)
+        self.row_count_label = tk.Label(filter_frame, text="", fg="grey")
+        self.row_count_label.pack(side=tk.RIGHT)
+        self.filter_var.trace_add("write", lambda *args: self.rows_changed())
+        self.status_filter.bind("<<ComboboxSelected>>", lambda e: self.rows_changed())
+        self.sort_option.bind("<<ComboboxSelected>>", lambda e: self.rows_changed())
+
         self.main_frame = tk.Frame(self.root, borderwidth=2, relief="groove", padx=10, pady=5)
-        self.main_frame.pack(padx=10, pady=(10, 0), fill="both", expand=True)
-        self.main_frame.grid_columnconfigure(1, weight=1)
+        self.main_frame.pack(padx=10, pady=(5, 0), fill="both", expand=True)
+        self.scrollbar = ttk.Scrollbar(self.main_frame, orient="vertical", command=self.on_scroll)
+        self.scrollbar.pack(side=tk.RIGHT, fill="y")
+        self.list_frame = tk.Frame(self.main_frame)
+        self.list_frame.pack(side=tk.LEFT, fill="both", expand=True)
+        self.list_frame.grid_columnconfigure(1, weight=1)
+        self.bind_mousewheel(self.list_frame)
 
         status_frame_container = tk.Frame(self.root, borderwidth=2, relief="groove")
         status_frame_container.pack(padx=10, pady=(5, 10), fill="x", side="bottom")
@@ -90,71 +253,114 @@ class GUIView:
         self.mp3_button.pack(side=tk.LEFT, padx=(5, 0))
         ToolTip(self.mp3_button, "Mở cửa sổ chuyển đổi file sang MP3")
 
-    def add_user_row_to_gui(self, row_id, current_row_count):
-        row_index = current_row_count
-        
-        action_button_frame = tk.Frame(self.main_frame)
-        action_button_frame.grid(row=row_index, column=0, padx=(0, 5), pady=2, sticky="w")
-        add_button = tk.Button(action_button_frame, text="➕", command=self.controller.add_user_row, width=2)
-        add_button.pack(side=tk.LEFT)
-        ToolTip(add_button, "Thêm user mới")
-        remove_button = tk.Button(action_button_frame, text="➖", command=lambda: self.controller.remove_user_row(row_id), width=2)
-        remove_button.pack(side=tk.LEFT, padx=2)
-        ToolTip(remove_button, "Xóa hàng / Hủy ghi hình (không lưu file)")
-        
-        url_entry = tk.Entry(self.main_frame, width=30)
-        url_entry.grid(row=row_index, column=1, padx=(0, 5), pady=2, sticky="ew")
-        ToolTip(url_entry, "Nhập username hoặc link rồi nhấn nút ▶")
-        
-        controls_frame = tk.Frame(self.main_frame)
-        controls_frame.grid(row=row_index, column=2, padx=(0, 5), pady=2, sticky="w")
-        start_button = tk.Button(controls_frame, text="▶", command=lambda: self.controller.start_recording(row_id), width=2)
-        start_button.pack(side=tk.LEFT)
-        ToolTip(start_button, "Bắt đầu ghi hình")
-        stop_button = tk.Button(controls_frame, text="■", command=lambda: self.controller.stop_recording(row_id), width=2, state="disabled")
-        stop_button.pack(side=tk.LEFT, padx=2)
-        ToolTip(stop_button, "Dừng ghi hình & lưu file")
-
-        options_frame = tk.Frame(self.main_frame)
-        options_frame.grid(row=row_index, column=3, padx=(0, 5), pady=2, sticky="w")
-
-        duration_entry = tk.Entry(options_frame, width=10)
-        duration_entry.pack(side=tk.LEFT, padx=2)
-        ToolTip(duration_entry, "Thời gian ghi (giây), để trống nếu không giới hạn")
-        
-        convert_var = tk.BooleanVar(value=True)
-        convert_check = tk.Checkbutton(options_frame, variable=convert_var)
-        convert_check.pack(side=tk.LEFT)
-        ToolTip(convert_check, "Chuyển file video sang MP3 sau khi ghi hình")
-        
-        status_label = tk.Label(self.main_frame, text="Chờ", width=20, anchor="w", fg="grey")
-        status_label.grid(row=row_index, column=4, padx=(5, 0), pady=2, sticky="w")
+    def bind_mousewheel(self, widget):
+        widget.bind("<MouseWheel>", lambda e: self.scroll_rows(-1 if e.delta > 0 else 1))
+        widget.bind("<Button-4>", lambda e: self.scroll_rows(-1))
+        widget.bind("<Button-5>", lambda e: self.scroll_rows(1))
+
+    def _visible_row_ids(self):
+        """Danh sách row_id sau khi áp dụng ô lọc, bộ lọc trạng thái và cách sắp xếp."""
+        models = list(self.controller.user_rows.values())
+        text = self.filter_var.get().strip().lower().lstrip('@')
+        if text:
+            models = [model for model in models if text in model.input_text.lower()]
+        status_filter = self.status_filter.get()
+        if status_filter != STATUS_FILTERS[0]:
+            models = [model for model in models if row_category(model) == status_filter]
+        sort_option = self.sort_option.get()
+        if sort_option == "Username":
+            models.sort(key=lambda model: (not model.input_text, model.input_text.lower()))
+        elif sort_option == "Trạng thái":
+            order = {name: index for index, name in enumerate(STATUS_FILTERS[1:])}
+            models.sort(key=lambda model: order[row_category(model)])
+        return [model.id for model in models]
+
+    def _filters_active(self):
+        return bool(self.filter_var.get().strip()) or self.status_filter.get() != STATUS_FILTERS[0]
+
+    def rows_changed(self, scroll_to=None):
+        """Tính lại danh sách hiển thị sau khi thêm/xóa hàng hoặc đổi bộ lọc; scroll_to: cuộn tới hàng này."""
+        self.relayout_pending = False
+        if scroll_to is not None and self._filters_active():
+            # Hàng mới (chưa có tên) luôn bị lọc mất: bỏ lọc để người dùng thấy hàng vừa thêm
+            self.filter_var.set("")
+            self.status_filter.current(0)
+        self.visible_ids = self._visible_row_ids()
+        total = len(self.controller.user_rows)
+        self.row_count_label.config(text=f"{len(self.visible_ids)}/{total} hàng")
+
+        needed = min(total, VISIBLE_ROWS)
+        while len(self.slots) < needed:
+            self.slots.append(RowSlot(self, len(self.slots)))
+        self.update_window_size(needed)
+
+        if scroll_to in self.visible_ids:
+            index = self.visible_ids.index(scroll_to)
+            if not self.first_index <= index < self.first_index + len(self.slots):
+                self.first_index = index - len(self.slots) + 1
+        self.render()
+
+    def scroll_rows(self, step):
+        self.first_index += step
+        self.render()
+
+    def on_scroll(self, action, value, unit=None):
+        if action == "moveto":
+            self.first_index = round(float(value) * len(self.visible_ids))
+        elif unit == "pages":
+            self.first_index += int(value) * len(self.slots)
+        else:
+            self.first_index += int(value)
+        self.render()
+
+    def render(self):
+        """Gắn các slot vào những hàng đang nằm trong vùng nhìn thấy."""
+        max_first = max(0, len(self.visible_ids) - len(self.slots))
+        self.first_index = min(max(0, self.first_index), max_first)
+        for slot in self.slots:
+            slot.commit()
+        for offset, slot in enumerate(self.slots):
+            index = self.first_index + offset
+            model = self.controller.user_rows.get(self.visible_ids[index]) if index < len(self.visible_ids) else None
+            if model:
+                slot.show(model, self.add_enabled)
+            else:
+                slot.hide()
+        total = len(self.visible_ids)
+        if total > len(self.slots):
+            self.scrollbar.set(self.first_index / total, (self.first_index + len(self.slots)) / total)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def refresh_row(self, row_id):
+        """Vẽ lại hàng nếu nó đang hiển thị; khi lọc/sắp xếp theo trạng thái thì xếp lại danh sách."""
+        model = self.controller.user_rows.get(row_id)
+        if not model: return
+        for slot in self.slots:
+            if slot.row_id == row_id:
+                slot.show(model, self.add_enabled)
+                break
+        if (self.status_filter.get() != STATUS_FILTERS[0] or self.sort_option.get() == "Trạng thái") and not self.relayout_pending:
+            # Gộp nhiều lần đổi trạng thái thành một lần xếp lại
+            self.relayout_pending = True
+            self.root.after_idle(self.rows_changed)
+
+    def commit_row(self, row_id):
+        """Lưu nội dung đang nhập dở của hàng (nếu đang hiển thị) vào model."""
+        for slot in self.slots:
+            if slot.row_id == row_id:
+                slot.commit()
+
+    def set_add_enabled(self, enabled):
+        if enabled == self.add_enabled: return
+        self.add_enabled = enabled
+        for slot in self.slots:
+            if slot.row_id is not None:
+                slot.add_button.config(state='normal' if enabled else 'disabled')
 
-        url_entry.bind("<FocusOut>", lambda e, rid=row_id: self.controller.handle_url_entry_focus_out(rid, e.widget))
-        
-        return {
-            'row_id': row_id, 'add_button': add_button, 'remove_button': remove_button,
-            'url_entry': url_entry, 'start_button': start_button, 'stop_button': stop_button,
-            'convert_var': convert_var, 'convert_check': convert_check,
-            'duration_entry': duration_entry,
-            'status_label': status_label,
-            'widgets': [action_button_frame, url_entry, controls_frame, options_frame, status_label]
-        }
-        
-    def remove_user_row_from_gui(self, row_id):
-        user_row_model = self.controller.user_rows.get(row_id)
-        if user_row_model:
-            for widget in user_row_model.widgets['widgets']:
-                if widget and widget.winfo_exists():
-                    widget.destroy()
-
-    def update_status_label(self, status_label, text, color):
-        if status_label and status_label.winfo_exists():
-            status_label.config(text=text, fg=color)
-    
     def update_window_size(self, num_rows):
         status_frame_height = 50
-        header_height = 80
+        header_height = 110
         new_height = header_height + num_rows * self.row_height + status_frame_height
         self.root.geometry(f"{self.WINDOW_WIDTH}x{max(self.initial_height, new_height)}")
 
@@ -167,24 +373,6 @@ class GUIView:
         self.output_dir_entry.insert(0, text)
         self.output_dir_entry.config(foreground=color)
 
-    def set_widget_state(self, widget, state):
-        if widget and widget.winfo_exists():
-            widget.config(state=state)
-
-    def update_ui_for_state(self, row_id, state):
-        model = self.controller.user_rows.get(row_id)
-        if not model: return
-
-        widgets = model.widgets
-        is_recording = state == 'recording'
-
-        self.set_widget_state(widgets.get('url_entry'), 'disabled' if is_recording else 'normal')
-        self.set_widget_state(widgets.get('start_button'), 'disabled' if is_recording else 'normal')
-        self.set_widget_state(widgets.get('stop_button'), 'normal' if is_recording else 'disabled')
-
-        self.set_widget_state(widgets.get('duration_entry'), 'disabled' if is_recording else 'normal')
-        self.set_widget_state(widgets.get('convert_check'), 'disabled' if is_recording else 'normal')
-
     def show_messagebox(self, msg_type, title, message):
         if self.active_dialog and self.active_dialog.winfo_exists(): return None
         self.dialog_result = None
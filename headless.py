@@ -0,0 +1,184 @@
+"""Chạy recorder không giao diện (server Linux/Windows), không import tkinter.
+
+Cách dùng:
+    python headless.py watchlist.json
+
+File watchlist (JSON):
+    {
+        "output_dir": "/srv/recordings",
+        "convert_to_mp3": false,
+        "duration": null,
+        "cookies": {"sessionid": "..."},
+        "users": ["user1", {"user": "user2", "duration": 3600, "convert_to_mp3": true}]
+    }
+
+Mỗi user được theo dõi liên tục: sau khi một phiên live kết thúc, user được đưa
+lại vào lịch chờ. Lỗi tạm thời khi lấy RoomID được thử lại với thời gian chờ tăng
+dần; chỉ user không tồn tại mới bị bỏ khỏi danh sách theo dõi. SIGTERM/SIGINT dừng
+mọi phiên đang ghi (vẫn lưu file) và chờ hậu xử lý xong rồi mới thoát.
+"""
+
+import startup_timing
+import argparse
+import json
+import os
+import re
+import signal
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from logger_setup import logger
+from config import COOKIES
+from rec_logic import TikTokRecorder, TikTokAPI, close_http_clients
+from live_poller import PollScheduler, poll_delay, future_error
+from post_processor import get_post_processor
+from ffmpeg_locator import get_ffmpeg_path
+from metrics import start_metrics_exporter
+from storage import shutdown_storage_manager
+startup_timing.mark("import")
+
+USERNAME_RE = re.compile(r'^@?([a-zA-Z0-9_.-]+)$')
+
+def load_watchlist(path):
+    """Đọc file watchlist, trả về (settings, danh sách cấu hình từng user)."""
+    with open(path, 'r', encoding='utf-8') as f:
+        settings = json.load(f)
+    users = []
+    for item in settings.get('users', []):
+        entry = {'user': item} if isinstance(item, str) else dict(item)
+        match = USERNAME_RE.match(str(entry.get('user', '')).strip())
+        if not match:
+            logger.warning(f"Bỏ qua user không hợp lệ trong watchlist: {entry.get('user')!r}")
+            continue
+        entry['user'] = match.group(1)
+        entry.setdefault('duration', settings.get('duration'))
+        entry.setdefault('convert_to_mp3', settings.get('convert_to_mp3', False))
+        users.append(entry)
+    return settings, users
+
+class HeadlessDaemon:
+    def __init__(self, settings, users):
+        self.cookies = settings.get('cookies') or COOKIES
+        self.output_dir = settings.get('output_dir')
+        self.users = users
+        self.is_running = True
+        self.lock = threading.Lock()
+        self.recorders = {}
+        self.statuses = {}
+        self.idle = threading.Condition(self.lock)
+
+        self.capture_pool = ThreadPoolExecutor(max_workers=max(1, len(users)), thread_name_prefix="Capture")
+        self.scheduler = PollScheduler(TikTokAPI(self.cookies), capture_executor=self.capture_pool)
+        self.post_processor = get_post_processor()
+        self.metrics_exporter = None
+
+    def _update_status(self, user, message, color):
+        self.statuses[user] = message
+
+    def start(self):
+        logger.info(f"Bắt đầu theo dõi {len(self.users)} user ở chế độ không giao diện")
+        self.metrics_exporter = start_metrics_exporter()
+        for entry in self.users:
+            self._watch(entry)
+
+    def _watch(self, entry, delay=0):
+        recorder = TikTokRecorder(
+            user=entry['user'], cookies=self.cookies, duration=entry.get('duration'),
+            convert_to_mp3=entry.get('convert_to_mp3', False), recording_id=entry['user'],
+            custom_output_dir=self.output_dir, status_callback=self._update_status
+        )
+        with self.lock:
+            if not self.is_running: return
+            self.recorders[entry['user']] = recorder
+            # Đưa vào lịch chờ khi vẫn giữ khóa: stop() chạy sau đó chắc chắn thấy và đánh thức được recorder này
+            future = self.scheduler.submit(recorder, delay)
+        future.add_done_callback(lambda f: self._on_finished(entry, recorder, future_error(f)))
+
+    def _on_finished(self, entry, recorder, error):
+        user = entry['user']
+        if error is not None:
+            logger.error(f"Phiên ghi hình của {user} kết thúc với lỗi: {error}")
+        with self.lock:
+            if self.recorders.get(user) is recorder:
+                del self.recorders[user]
+            self.idle.notify_all()
+            if not self.is_running: return
+        if recorder.room_id is None:
+            if recorder.user_not_found():
+                logger.error(f"Không tìm thấy user {user}, ngừng theo dõi user này.")
+                return
+            entry['resolve_failures'] = failures = entry.get('resolve_failures', 0) + 1
+            delay = poll_delay(failures - 1, policy="exponential")
+            logger.warning(f"Không lấy được RoomID của {user}, thử lại sau {delay / 60:.1f} phút.")
+            self._watch(entry, delay)
+            return
+        entry['resolve_failures'] = 0
+        # Tiếp tục chờ phiên live kế tiếp; chờ một nhịp để không kiểm tra dồn dập ngay khi live vừa tắt
+        self._watch(entry, poll_delay(0))
+
+    def stop(self):
+        """Dừng & lưu mọi phiên đang ghi; có thể gọi từ signal handler."""
+        with self.lock:
+            if not self.is_running: return
+            self.is_running = False
+            recorders = list(self.recorders.values())
+        logger.info(f"Nhận tín hiệu dừng, đang dừng {len(recorders)} recorder...")
+        for recorder in recorders:
+            recorder.stop()
+
+    def wait_closed(self):
+        """Chờ mọi phiên ghi và hàng đợi hậu xử lý kết thúc rồi giải phóng tài nguyên."""
+        with self.lock:
+            while self.recorders:
+                self.idle.wait()
+        self.scheduler.shutdown(wait=True)
+        self.capture_pool.shutdown(wait=True)
+        logger.info("Đang chờ hàng đợi hậu xử lý hoàn tất...")
+        self.post_processor.shutdown(wait=True)
+        if self.metrics_exporter: self.metrics_exporter.stop()
+        shutdown_storage_manager()
+        close_http_clients()
+        logger.info("Đã dừng chế độ không giao diện")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TikTok Live Recorder (không giao diện)")
+    parser.add_argument('watchlist', help="File JSON chứa danh sách user và cấu hình")
+    parser.add_argument('--output-dir', help="Thư mục lưu file (ghi đè output_dir trong watchlist)")
+    args = parser.parse_args(argv)
+
+    try:
+        settings, users = load_watchlist(args.watchlist)
+    except (OSError, ValueError) as e:
+        logger.critical(f"Không đọc được watchlist {args.watchlist}: {e}")
+        return 1
+    if args.output_dir:
+        settings['output_dir'] = os.path.normpath(args.output_dir)
+    if not users:
+        logger.critical("Watchlist không có user hợp lệ nào.")
+        return 1
+    try:
+        get_ffmpeg_path()
+    except (FileNotFoundError, PermissionError):
+        return 1
+    startup_timing.mark("ffmpeg")
+
+    daemon = HeadlessDaemon(settings, users)
+    stop_requested = threading.Event()
+    def handle_signal(signum, frame):
+        stop_requested.set()
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    daemon.start()
+    startup_timing.mark("khởi động recorder")
+    startup_timing.report(logger)
+    # Chờ có timeout để signal handler được chạy kịp thời trên luồng chính
+    while not stop_requested.wait(1):
+        pass
+    daemon.stop()
+    daemon.wait_closed()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
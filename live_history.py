@@ -0,0 +1,114 @@
+import os
+import sys
+import json
+import time
+import threading
+
+from logger_setup import logger
+from config import (
+    LIVE_HISTORY_FILE, LIVE_HISTORY_MAX_ENTRIES, LIVE_PREDICT_MIN_SAMPLES, LIVE_PREDICT_THRESHOLD,
+    LIVE_PREDICT_LEAD
+)
+
+class LiveHistory:
+    """Lịch sử thời điểm bắt đầu live của từng user, lưu trên đĩa.
+
+    Mô hình dự đoán là histogram theo (thứ trong tuần, giờ): một khung giờ được
+    coi là "hay live" khi tỉ lệ số lần live rơi vào đó (cộng một phần các giờ
+    lân cận và cùng giờ ở các ngày khác) vượt LIVE_PREDICT_THRESHOLD.
+    """
+    def __init__(self, path=None):
+        if path is None:
+            if hasattr(sys, '_MEIPASS'):
+                base_path = os.path.dirname(sys.executable)
+            else:
+                base_path = os.path.dirname(os.path.abspath(__file__))
+            path = os.path.join(base_path, LIVE_HISTORY_FILE)
+        self.path = os.path.normpath(path)
+        self.lock = threading.Lock()
+        self.starts = self._load()
+        self.histograms = {}
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                starts = json.load(f)
+            if isinstance(starts, dict):
+                return starts
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Không đọc được lịch sử live, tạo mới: {e}")
+        return {}
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.starts, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Không ghi được lịch sử live: {e}")
+
+    def record_start(self, user, started_at=None):
+        with self.lock:
+            starts = self.starts.setdefault(user, [])
+            starts.append(int(started_at or time.time()))
+            del starts[:-LIVE_HISTORY_MAX_ENTRIES]
+            self.histograms.pop(user, None)
+            self._save()
+
+    def _histogram(self, user):
+        with self.lock:
+            histogram = self.histograms.get(user)
+            if histogram is None:
+                starts = self.starts.get(user, [])
+                histogram = [[0] * 24 for _ in range(7)]
+                for started_at in starts:
+                    local = time.localtime(started_at)
+                    histogram[local.tm_wday][local.tm_hour] += 1
+                self.histograms[user] = histogram
+            return histogram
+
+    def has_model(self, user):
+        return LIVE_PREDICT_MIN_SAMPLES > 0 and len(self.starts.get(user, ())) >= LIVE_PREDICT_MIN_SAMPLES
+
+    def score(self, user, when):
+        """Mức độ user thường live vào khung giờ chứa thời điểm when (0..1)."""
+        total = len(self.starts.get(user, ()))
+        if not total:
+            return 0.0
+        histogram = self._histogram(user)
+        local = time.localtime(when)
+        day, hour = local.tm_wday, local.tm_hour
+        same_day = histogram[day]
+        weight = same_day[hour] + 0.5 * (same_day[(hour - 1) % 24] + same_day[(hour + 1) % 24])
+        weight += 0.25 * sum(histogram[other][hour] for other in range(7) if other != day)
+        return weight / total
+
+    def in_window(self, user, when=None):
+        """Đang ở (hoặc sắp tới trong LIVE_PREDICT_LEAD giây) khung giờ user hay live."""
+        when = when or time.time()
+        return (self.score(user, when) >= LIVE_PREDICT_THRESHOLD
+                or self.score(user, when + LIVE_PREDICT_LEAD) >= LIVE_PREDICT_THRESHOLD)
+
+    def seconds_until_window(self, user, limit, step=300):
+        """Số giây tới khung dự đoán kế tiếp, tối đa limit."""
+        now = time.time()
+        for offset in range(step, int(limit) + 1, step):
+            if self.in_window(user, now + offset):
+                return offset
+        return limit
+
+_live_history = None
+_live_history_lock = threading.Lock()
+
+def get_live_history():
+    """Trả về lịch sử live dùng chung, hoặc None nếu đã tắt dự đoán (LIVE_PREDICT_MIN_SAMPLES <= 0)."""
+    global _live_history
+    if LIVE_PREDICT_MIN_SAMPLES <= 0:
+        return None
+    with _live_history_lock:
+        if _live_history is None:
+            _live_history = LiveHistory()
+        return _live_history
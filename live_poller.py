@@ -0,0 +1,289 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+
+from logger_setup import logger
+from config import (
+    CHECK_ALIVE_BATCH_SIZE, CHECK_ALIVE_BATCH_WINDOW, POLL_BACKOFF_POLICY, POLL_BACKOFF_STEPS,
+    POLL_BACKOFF_MIN, POLL_BACKOFF_MAX, POLL_JITTER, POLL_ERROR_DELAY, POLL_WORKERS, CAPTURE_SLOT_RETRY,
+    LIVE_PREDICT_INTERVAL, LIVE_PREDICT_OUTSIDE_MAX
+)
+from live_history import get_live_history
+from metrics import get_metrics
+
+def future_error(future):
+    """Lỗi của future đã xong (None nếu thành công); future bị hủy trả về CancelledError thay vì ném ra."""
+    if future.cancelled():
+        return CancelledError()
+    return future.exception()
+
+def poll_delay(attempt, policy=POLL_BACKOFF_POLICY, jitter=POLL_JITTER):
+    """Thời gian chờ (giây) sau lần kiểm tra thứ attempt (tính từ 0) không thấy live."""
+    if policy == "fixed":
+        delay = POLL_BACKOFF_MIN
+    elif policy == "exponential":
+        delay = min(POLL_BACKOFF_MIN * 2 ** attempt, POLL_BACKOFF_MAX)
+    else:
+        delay = POLL_BACKOFF_STEPS[min(attempt, len(POLL_BACKOFF_STEPS) - 1)]
+    if jitter:
+        delay *= random.uniform(1 - jitter, 1 + jitter)
+    return delay
+
+def next_poll_delay(user, attempt):
+    """Như poll_delay nhưng theo lịch sử live của user: dày trong khung dự đoán, thưa ngoài khung."""
+    history = get_live_history()
+    if history is None or not history.has_model(user):
+        return poll_delay(attempt)
+    if history.in_window(user):
+        delay = LIVE_PREDICT_INTERVAL
+    else:
+        # Ngủ tới đầu khung dự đoán kế tiếp nhưng không quá LIVE_PREDICT_OUTSIDE_MAX
+        delay = max(history.seconds_until_window(user, LIVE_PREDICT_OUTSIDE_MAX), LIVE_PREDICT_INTERVAL)
+    if POLL_JITTER:
+        delay *= random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+    return delay
+
+def record_live_start(user):
+    """Ghi nhận thời điểm user chuyển từ không live sang live (chỉ khi đã thấy user offline trước đó)."""
+    history = get_live_history()
+    if history is not None:
+        history.record_start(user)
+
+class PollEntry:
+    """Trạng thái chờ live của một recorder trong PollScheduler."""
+    __slots__ = ('recorder', 'future', 'attempt', 'resolved', 'due', 'scheduled')
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+        self.future = Future()
+        self.attempt = 0
+        self.resolved = False
+        self.due = 0.0
+        self.scheduled = False
+
+class PollScheduler:
+    """Bộ lập lịch kiểm tra live dùng chung cho mọi recorder đang chờ.
+
+    Heap giữ thời điểm kiểm tra kế tiếp của từng user, một luồng duy nhất ngủ tới
+    mốc gần nhất. Các lần kiểm tra đến hạn gần nhau được gom thành request
+    check_alive theo lô và chạy trên một pool nhỏ; recorder chỉ chiếm một luồng
+    của capture_executor khi user thực sự live. max_captures giới hạn số user ghi
+    hình cùng lúc: user live khi đã đủ suất được kiểm tra lại sau CAPTURE_SLOT_RETRY.
+    """
+    def __init__(self, api, capture_executor, workers=POLL_WORKERS, batch_size=CHECK_ALIVE_BATCH_SIZE,
+                 batch_window=CHECK_ALIVE_BATCH_WINDOW, max_captures=None):
+        self.api = api
+        self.capture_executor = capture_executor
+        self.max_captures = max_captures
+        self.capturing = 0
+        self.batch_size = max(1, batch_size)
+        self.batch_window = batch_window
+        self.check_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="PollCheck")
+
+        self.condition = threading.Condition()
+        self.heap = []
+        self.counter = itertools.count()
+        self.entries = {}    # recorder -> PollEntry
+        self.is_running = True
+        self.thread = threading.Thread(target=self._run, name="PollScheduler", daemon=True)
+        self.thread.start()
+        get_metrics().register_collector('poll_scheduler', self.collect_metrics)
+
+    def submit(self, recorder, delay=0):
+        """Đưa recorder vào lịch chờ live (kiểm tra lần đầu sau delay giây); Future hoàn tất khi phiên ghi hình (nếu có) kết thúc."""
+        entry = PollEntry(recorder)
+        recorder.scheduler = self
+        with self.condition:
+            self.entries[recorder] = entry
+            self._schedule(entry, delay)
+        return entry.future
+
+    def wake(self, recorder):
+        """Kiểm tra lại recorder ngay (vd. khi Dừng/Hủy trong lúc đang chờ)."""
+        with self.condition:
+            entry = self.entries.get(recorder)
+            if entry and entry.scheduled:
+                self._schedule(entry, 0)
+
+    def waiting_count(self):
+        with self.condition:
+            return sum(1 for entry in self.entries.values() if entry.scheduled)
+
+    def collect_metrics(self):
+        with self.condition:
+            waiting = sum(1 for entry in self.entries.values() if entry.scheduled)
+            total = len(self.entries)
+            next_due = max(0.0, self.heap[0][0] - time.monotonic()) if self.heap else None
+        samples = [
+            ('poll_waiting_users', {}, waiting),
+            # Entry không còn trong lịch chờ là đang kiểm tra hoặc đang chiếm luồng ghi hình
+            ('poll_active_users', {}, total - waiting),
+            ('poll_capturing_users', {}, self.capturing),
+        ]
+        if next_due is not None:
+            samples.append(('poll_next_check_seconds', {}, round(next_due, 1)))
+        return samples
+
+    def _schedule(self, entry, delay):
+        entry.due = time.monotonic() + delay
+        entry.scheduled = True
+        heapq.heappush(self.heap, (entry.due, next(self.counter), entry))
+        self.condition.notify()
+
+    def _reschedule(self, entry, delay):
+        with self.condition:
+            if entry.recorder.stop_event.is_set() or not self.is_running:
+                self._finish(entry)
+            else:
+                self._schedule(entry, delay)
+
+    def _finish(self, entry, error=None):
+        with self.condition:
+            self.entries.pop(entry.recorder, None)
+            entry.scheduled = False
+        if entry.future.done(): return
+        if error is None:
+            entry.future.set_result(None)
+        else:
+            entry.future.set_exception(error)
+
+    def _pop_due(self):
+        """Chờ tới mốc gần nhất rồi lấy mọi entry đến hạn (kể cả trong batch_window tới)."""
+        with self.condition:
+            while self.is_running:
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+                due, _, entry = self.heap[0]
+                if not entry.scheduled or due != entry.due:
+                    heapq.heappop(self.heap)
+                    continue
+                remaining = due - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            if not self.is_running:
+                return None
+
+            horizon = time.monotonic() + self.batch_window
+            batch = []
+            while self.heap and self.heap[0][0] <= horizon:
+                due, _, entry = heapq.heappop(self.heap)
+                if not entry.scheduled or due != entry.due: continue
+                entry.scheduled = False
+                batch.append(entry)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._pop_due()
+            if batch is None: return
+            if batch:
+                self.check_pool.submit(self._check_batch, batch)
+
+    def _check_batch(self, batch):
+        ready = []
+        for entry in batch:
+            recorder = entry.recorder
+            if recorder.stop_event.is_set():
+                self._finish(entry)
+                continue
+            try:
+                if not entry.resolved:
+                    if not recorder.prepare():
+                        self._finish(entry)
+                        continue
+                    entry.resolved = True
+                elif entry.attempt:
+                    recorder._refresh_room_id_if_expired()
+            except Exception as e:
+                logger.error(f"Lỗi trong vòng lặp chờ của {recorder.user}: {e}")
+                recorder._update_status("Lỗi, đang thử lại...", "red")
+                self._reschedule(entry, POLL_ERROR_DELAY)
+                continue
+            recorder._update_status("Kiểm tra live...", "blue")
+            ready.append(entry)
+        if not ready: return
+
+        room_ids = sorted({str(entry.recorder.room_id) for entry in ready})
+        started_at = time.monotonic()
+        results = self._poll(room_ids)
+        poll_seconds = round(time.monotonic() - started_at, 3)
+        for entry in ready:
+            recorder = entry.recorder
+            if recorder.stop_event.is_set():
+                self._finish(entry)
+            elif results.get(str(recorder.room_id)):
+                recorder._event('poll', live=True, attempt=entry.attempt, seconds=poll_seconds, batch=len(room_ids))
+                self._start_capture(entry)
+            else:
+                wait_time = next_poll_delay(recorder.user, entry.attempt)
+                recorder._event('poll', live=False, attempt=entry.attempt, seconds=poll_seconds, batch=len(room_ids),
+                                next_delay=round(wait_time, 1))
+                entry.attempt += 1
+                logger.info(f"User {recorder.user} không live, chờ {wait_time / 60:.1f} phút.")
+                recorder._update_status(f"Chờ live ({wait_time / 60:.1f}p)...", "orange")
+                self._reschedule(entry, wait_time)
+
+    def _start_capture(self, entry):
+        recorder = entry.recorder
+        with self.condition:
+            slot_free = not self.max_captures or self.capturing < self.max_captures
+            if slot_free: self.capturing += 1
+        if not slot_free:
+            logger.info(f"User {recorder.user} đang livestream nhưng đã đủ {self.max_captures} user ghi hình, chờ suất trống.")
+            recorder._update_status("Đang live, chờ suất ghi hình...", "orange")
+            self._reschedule(entry, CAPTURE_SLOT_RETRY)
+            return
+        logger.info(f"User {recorder.user} đang livestream. Bắt đầu ghi hình.")
+        recorder._update_status("Đang ghi hình...", "green")
+        recorder._on_go_live(entry.attempt + 1)
+        if entry.attempt:
+            record_live_start(recorder.user)
+        try:
+            future = self.capture_executor.submit(recorder.start_recording)
+        except RuntimeError as e:
+            self._release_capture()
+            self._finish(entry, e)
+            return
+        future.add_done_callback(lambda f: self._on_capture_done(entry, f))
+
+    def _release_capture(self):
+        with self.condition:
+            self.capturing -= 1
+
+    def _on_capture_done(self, entry, future):
+        self._release_capture()
+        self._finish(entry, future_error(future))
+
+    def _poll(self, room_ids):
+        results = {}
+        metrics = get_metrics()
+        metrics.inc('poll_rooms_checked_total', len(room_ids))
+        for start in range(0, len(room_ids), self.batch_size):
+            chunk = room_ids[start:start + self.batch_size]
+            try:
+                with metrics.timer('poll_batch_seconds'):
+                    results.update(self.api.check_rooms_alive(chunk))
+            except Exception as e:
+                logger.warning(f"Lỗi check_alive cho {len(chunk)} room, chuyển sang kiểm tra từng room: {e}")
+                for room_id in chunk:
+                    results[room_id] = self.api.is_room_alive(room_id)
+        logger.debug(f"Đã kiểm tra live {len(room_ids)} room bằng {(len(room_ids) - 1) // self.batch_size + 1} request")
+        return results
+
+    def shutdown(self, wait=True):
+        """Dừng lập lịch; các recorder còn đang chờ được kết thúc, phiên đang ghi không bị ảnh hưởng."""
+        with self.condition:
+            self.is_running = False
+            waiting = [entry for entry in self.entries.values() if entry.scheduled]
+            self.condition.notify_all()
+        get_metrics().unregister_collector('poll_scheduler')
+        for entry in waiting:
+            self._finish(entry)
+        self.check_pool.shutdown(wait=wait)
+        if wait:
+            self.thread.join()
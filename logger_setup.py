@@ -1,20 +1,27 @@
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+from collections import OrderedDict
+import queue
 import sys
 import os
 import re
 
-class SensitiveInfoFilter(logging.Filter):
-    def __init__(self):
-        super().__init__()
+from config import LOG_DEDUP_SIZE
 
+# Các đoạn bị xóa khỏi log, gộp thành một regex biên dịch sẵn (một lần quét cho mỗi bản ghi)
+SENSITIVE_RE = re.compile(
+    r'Output/[^/]+/'
+    r'|sessionid giống mặc định|số lượng mục: \d+'
+    r'|\(PID: \d+\)'
+    r'|mã trạng thái: \d+'
+    r'|Khởi tạo [^\s]+|Đã đọc file [^\s]+|API TikTok|Cấu trúc API|icon\.ico|biểu tượng'
+)
+
+class SensitiveInfoFilter(logging.Filter):
     def filter(self, record):
         if hasattr(record, 'msg') and isinstance(record.msg, str):
-            record.msg = re.sub(r'Output/[^/]+/', '', record.msg)
-            record.msg = re.sub(r'sessionid giống mặc định|số lượng mục: \d+', '', record.msg)
-            record.msg = re.sub(r'\(PID: \d+\)', '', record.msg)
-            record.msg = re.sub(r'mã trạng thái: \d+', '', record.msg)
-            record.msg = re.sub(r'Khởi tạo [^\s]+|Đã đọc file [^\s]+|API TikTok|Cấu trúc API|icon\.ico|biểu tượng', '', record.msg)
+            record.msg = SENSITIVE_RE.sub('', record.msg)
         return True
 
 class MaxLevelFilter(logging.Filter):
@@ -39,25 +46,31 @@ class PathShortenerFilter(logging.Filter):
         return True
 
 class ProductionFilter(logging.Filter):
-    def __init__(self, logged_messages):
+    ALLOWED_KEYWORDS_RE = re.compile('|'.join(map(re.escape, [
+        'FFmpeg', 'ghi hình', 'dừng', 'Hoàn tất', 'chuyển đổi', 'thành công',
+        'Lỗi', 'lỗi', 'thất bại', 'Không thể', 'không tìm thấy', 'Cảnh báo',
+        'bị chặn', 'hết thời gian', 'quá tải', 'rỗng', 'xóa', 'đóng'
+    ])))
+
+    def __init__(self, max_size=LOG_DEDUP_SIZE):
         super().__init__()
-        self.logged_messages = logged_messages
-        self.allowed_keywords = [
-            'FFmpeg', 'ghi hình', 'dừng', 'Hoàn tất', 'chuyển đổi', 'thành công',
-            'Lỗi', 'lỗi', 'thất bại', 'Không thể', 'không tìm thấy', 'Cảnh báo',
-            'bị chặn', 'hết thời gian', 'quá tải', 'rỗng', 'xóa', 'đóng'
-        ]
+        # Chỉ nhớ max_size thông điệp gần nhất để bộ nhớ không tăng theo thời gian chạy
+        self.logged_messages = OrderedDict()
+        self.max_size = max_size
 
     def filter(self, record):
         if record.levelno < logging.INFO:
             return False
         if hasattr(record, 'msg') and isinstance(record.msg, str):
-            if not any(keyword in record.msg for keyword in self.allowed_keywords):
+            if not self.ALLOWED_KEYWORDS_RE.search(record.msg):
                 return False
             message_key = (record.msg, record.levelno)
             if message_key in self.logged_messages:
+                self.logged_messages.move_to_end(message_key)
                 return False
-            self.logged_messages.add(message_key)
+            self.logged_messages[message_key] = None
+            if len(self.logged_messages) > self.max_size:
+                self.logged_messages.popitem(last=False)
         return True
 
 class LoggerManager:
@@ -67,36 +80,32 @@ class LoggerManager:
             cls._instance = super(LoggerManager, cls).__new__(cls)
             cls._instance.logger = None
             cls._instance.is_production = hasattr(sys, '_MEIPASS')
-            cls._instance.logged_messages = set()
+            cls._instance.listener = None
             cls._instance.setup_logger()
         return cls._instance
 
     def setup_logger(self):
         if self.logger is None:
             self.logger = logging.getLogger('TikTokRecorder')
-            self.logger.setLevel(logging.DEBUG)
+            # Bản đóng gói chỉ ghi từ INFO: bản ghi DEBUG bị loại ngay tại logger, không tốn gì cho luồng gọi
+            self.logger.setLevel(logging.INFO if self.is_production else logging.DEBUG)
+            handlers = []
 
             if self.is_production:
                 base_path = os.path.dirname(sys.executable)
             else:
                 base_path = os.path.dirname(os.path.abspath(__file__))
             self.base_path = base_path
+            # Ghi nối tiếp, không xóa log cũ khi import: RotatingFileHandler tự xoay vòng theo kích thước
             log_path = os.path.normpath(os.path.join(base_path, 'recording.txt'))
 
-            if os.path.exists(log_path):
-                try:
-                    os.remove(log_path)
-                except Exception as e:
-                    if not self.is_production:
-                        print(f"[ERROR] Không thể xóa file log cũ: {e}")
-
             try:
                 file_handler = RotatingFileHandler(
                     log_path, maxBytes=5*1024*1024, backupCount=3, encoding='utf-8'
                 )
                 if self.is_production:
                     file_handler.setLevel(logging.INFO)
-                    file_handler.addFilter(ProductionFilter(self.logged_messages))
+                    file_handler.addFilter(ProductionFilter())
                 else:
                     file_handler.setLevel(logging.DEBUG)
                 file_format = '%(asctime)s [%(levelname)s] %(message)s'
@@ -105,7 +114,7 @@ class LoggerManager:
                 file_handler.setFormatter(file_formatter)
                 file_handler.addFilter(PathShortenerFilter(self.base_path))
                 file_handler.addFilter(SensitiveInfoFilter())
-                self.logger.addHandler(file_handler)
+                handlers.append(file_handler)
             except Exception as e:
                 if not self.is_production:
                     print(f"[ERROR] Không thể tạo file log: {str(e)}")
@@ -117,7 +126,20 @@ class LoggerManager:
                 console_datefmt = '%H:%M:%S'
                 console_formatter = logging.Formatter(console_format, console_datefmt)
                 console_handler.setFormatter(console_formatter)
-                self.logger.addHandler(console_handler)
+                handlers.append(console_handler)
+
+            # Luồng gọi log chỉ đưa bản ghi vào hàng đợi; lọc, định dạng và ghi file chạy trên luồng nền
+            log_queue = queue.SimpleQueue()
+            self.logger.addHandler(QueueHandler(log_queue))
+            self.listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+            self.listener.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        """Ghi nốt các bản ghi còn trong hàng đợi rồi dừng luồng ghi log."""
+        if self.listener:
+            self.listener.stop()
+            self.listener = None
 
     def get_logger(self):
         return self.logger
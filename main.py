@@ -1,7 +1,11 @@
+import startup_timing
 import tkinter as tk
+import tkinter.messagebox
+startup_timing.mark("tkinter")
 from app_controller import AppController
 from logger_setup import logger
-import tkinter.messagebox
+from ffmpeg_locator import get_ffmpeg_path
+startup_timing.mark("import")
 
 def main():
     """
@@ -10,9 +14,14 @@ def main():
     """
     try:
         logger.info("Khởi tạo ứng dụng TikTok Recorder")
+        get_ffmpeg_path()
+        startup_timing.mark("ffmpeg")
         root = tk.Tk()
         app = AppController(root)
         root.protocol("WM_DELETE_WINDOW", app.on_closing)
+        startup_timing.mark("giao diện")
+        # Báo cáo sau khi cửa sổ đã vẽ xong lần đầu
+        root.after_idle(startup_timing.report, logger)
         root.mainloop()
         logger.info("Ứng dụng đã đóng thành công")
     except Exception as e:
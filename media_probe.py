@@ -0,0 +1,137 @@
+import os
+import re
+import subprocess
+import threading
+from collections import OrderedDict
+
+from logger_setup import logger
+from config import PROBE_CACHE_SIZE, PROBE_KEYFRAME_SCAN_BYTES
+from flv_utils import FLV_SIGNATURE, parse_flv_header, iter_tags, TAG_VIDEO
+from ffmpeg_locator import NO_WINDOW_FLAGS, get_ffmpeg_path
+
+DURATION_RE = re.compile(r"Duration: (?:(\d+):(\d+):(\d+(?:\.\d+)?)|N/A)(?:, start: [-\d.]+)?, bitrate: (?:(\d+) kb/s|N/A)")
+INPUT_RE = re.compile(r"Input #0, ([\w,]+), from")
+STREAM_RE = re.compile(r"Stream #0:(\d+)[^:]*: (Video|Audio|Data|Subtitle): (\w+)(.*)")
+STREAM_BITRATE_RE = re.compile(r"(\d+) kb/s")
+STREAM_FPS_RE = re.compile(r"([\d.]+) fps")
+
+class MediaInfo:
+    """Thông tin container của một file media (chỉ đọc header, không giải mã)."""
+    __slots__ = ('path', 'format_name', 'duration', 'bit_rate', 'streams', 'keyframe_interval')
+
+    def __init__(self, path, format_name=None, duration=None, bit_rate=None, streams=None, keyframe_interval=None):
+        self.path = path
+        self.format_name = format_name
+        self.duration = duration
+        self.bit_rate = bit_rate
+        self.streams = streams or []
+        self.keyframe_interval = keyframe_interval
+
+    @property
+    def has_audio(self):
+        return any(stream['type'] == 'audio' for stream in self.streams)
+
+    @property
+    def has_video(self):
+        return any(stream['type'] == 'video' for stream in self.streams)
+
+    def __repr__(self):
+        codecs = ", ".join(f"{stream['type']}:{stream['codec']}" for stream in self.streams)
+        return f"MediaInfo({os.path.basename(self.path)}, {self.format_name}, {self.duration}s, {codecs})"
+
+def parse_ffmpeg_header(path, text):
+    """Dựng MediaInfo từ phần mô tả input mà FFmpeg in ra stderr."""
+    info = MediaInfo(path)
+    match = INPUT_RE.search(text)
+    if match:
+        info.format_name = match.group(1)
+    match = DURATION_RE.search(text)
+    if match:
+        if match.group(1) is not None:
+            hours, minutes, seconds = match.group(1, 2, 3)
+            info.duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+        if match.group(4):
+            info.bit_rate = int(match.group(4)) * 1000
+    for line in text.splitlines():
+        match = STREAM_RE.search(line)
+        if not match: continue
+        index, stream_type, codec, details = match.groups()
+        bitrate = STREAM_BITRATE_RE.search(details)
+        fps = STREAM_FPS_RE.search(details)
+        info.streams.append({
+            'index': int(index),
+            'type': stream_type.lower(),
+            'codec': codec,
+            'bit_rate': int(bitrate.group(1)) * 1000 if bitrate else None,
+            'fps': float(fps.group(1)) if fps else None,
+        })
+    return info
+
+def estimate_flv_keyframe_interval(path, max_bytes=PROBE_KEYFRAME_SCAN_BYTES):
+    """Khoảng cách trung bình (giây) giữa các keyframe trong phần đầu file FLV, None nếu không xác định."""
+    try:
+        with open(path, 'rb') as f:
+            buf = f.read(max_bytes)
+    except OSError:
+        return None
+    if not buf.startswith(FLV_SIGNATURE):
+        return None
+    try:
+        position = parse_flv_header(buf)
+    except ValueError:
+        return None
+    if position is None:
+        return None
+    keyframes = [tag.timestamp for tag in iter_tags(buf, position)
+                 if tag.type == TAG_VIDEO and tag.is_keyframe and not tag.is_sequence_header]
+    if len(keyframes) < 2:
+        return None
+    return (keyframes[-1] - keyframes[0]) / (len(keyframes) - 1) / 1000
+
+def _run_probe(path):
+    ffmpeg_path = get_ffmpeg_path()
+    # Không có output: FFmpeg chỉ mở container, in thông tin stream rồi thoát
+    cmd = [ffmpeg_path, "-hide_banner", "-nostdin", "-i", path]
+    process = subprocess.run(
+        cmd, capture_output=True, timeout=30,
+        creationflags=NO_WINDOW_FLAGS
+    )
+    text = process.stderr.decode('utf-8', errors='ignore')
+    if "Input #0" not in text:
+        raise ValueError(text.strip().splitlines()[-1] if text.strip() else "FFmpeg không đọc được file")
+    info = parse_ffmpeg_header(path, text)
+    if info.has_video:
+        info.keyframe_interval = estimate_flv_keyframe_interval(path)
+    return info
+
+_probe_cache = OrderedDict()
+_probe_cache_lock = threading.Lock()
+
+def probe_media(path):
+    """Trả về MediaInfo của file, None nếu không đọc được.
+
+    Kết quả được cache theo (đường dẫn, kích thước, mtime) nên gọi lại trên file
+    chưa thay đổi không tốn thêm tiến trình FFmpeg nào.
+    """
+    path = os.path.normpath(path)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    with _probe_cache_lock:
+        if key in _probe_cache:
+            _probe_cache.move_to_end(key)
+            return _probe_cache[key]
+
+    try:
+        info = _run_probe(path)
+    except (OSError, ValueError, subprocess.SubprocessError) as e:
+        logger.warning(f"Không đọc được thông tin media của {os.path.basename(path)}: {e}")
+        info = None
+
+    with _probe_cache_lock:
+        _probe_cache[key] = info
+        while len(_probe_cache) > PROBE_CACHE_SIZE:
+            _probe_cache.popitem(last=False)
+    return info
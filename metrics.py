@@ -0,0 +1,224 @@
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+from logger_setup import logger
+from config import METRICS_PORT, METRICS_FILE, METRICS_INTERVAL
+
+PREFIX = "tiktok_"
+
+class Metrics:
+    """Bộ đếm và thời gian đo dùng chung cho cả tiến trình.
+
+    Bộ đếm/thời gian được cộng dồn tại chỗ (chi phí một lần lấy lock). Các giá trị
+    tức thời (bộ đệm ghi, hàng đợi, pool kết nối...) do collector của từng thành
+    phần trả về khi có người đọc số liệu, nên không tốn gì khi không ai theo dõi.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}      # (tên, nhãn) -> giá trị
+        self.timings = {}       # (tên, nhãn) -> [số lần, tổng giây, lâu nhất]
+        self.collectors = {}    # khóa -> hàm trả về list (tên, nhãn dict, giá trị)
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            timing = self.timings.get(key)
+            if timing is None:
+                self.timings[key] = [1, seconds, seconds]
+            else:
+                timing[0] += 1
+                timing[1] += seconds
+                timing[2] = max(timing[2], seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Đo thời gian khối lệnh; lỗi thoát khỏi khối được đếm vào <name>_errors_total."""
+        started_at = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.inc(f"{name}_errors_total", **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started_at, **labels)
+
+    def register_collector(self, key, collector):
+        with self.lock:
+            self.collectors[key] = collector
+
+    def unregister_collector(self, key):
+        with self.lock:
+            self.collectors.pop(key, None)
+
+    def samples(self):
+        """Toàn bộ số liệu hiện tại dạng list (tên, nhãn dict, giá trị)."""
+        with self.lock:
+            counters = list(self.counters.items())
+            timings = [(key, list(timing)) for key, timing in self.timings.items()]
+            collectors = list(self.collectors.items())
+
+        samples = [(name, dict(labels), value) for (name, labels), value in counters]
+        for (name, labels), (count, total, longest) in timings:
+            labels = dict(labels)
+            samples.append((f"{name}_count", labels, count))
+            samples.append((f"{name}_sum", labels, round(total, 6)))
+            samples.append((f"{name}_max", labels, round(longest, 6)))
+        for key, collector in collectors:
+            try:
+                samples.extend(collector())
+            except Exception as e:
+                logger.debug(f"Lỗi khi đọc số liệu từ {key}: {e}")
+        samples.sort(key=lambda sample: sample[0])
+        return samples
+
+    def to_prometheus(self):
+        lines = []
+        for name, labels, value in self.samples():
+            if labels:
+                label_text = ",".join(f'{label}="{_escape(value_)}"' for label, value_ in sorted(labels.items()))
+                lines.append(f"{PREFIX}{name}{{{label_text}}} {value}")
+            else:
+                lines.append(f"{PREFIX}{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def to_json(self):
+        grouped = {}
+        for name, labels, value in self.samples():
+            grouped.setdefault(name, []).append({'labels': labels, 'value': value})
+        return {'time': int(time.time()), 'metrics': grouped}
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class RateTracker:
+    """Tốc độ (đơn vị/giây) của một bộ đếm tăng dần, tính giữa hai lần đọc cách nhau ít nhất min_interval."""
+    __slots__ = ('min_interval', 'last_time', 'last_value', 'rate')
+
+    def __init__(self, min_interval=1.0):
+        self.min_interval = min_interval
+        self.last_time = None
+        self.last_value = 0
+        self.rate = 0.0
+
+    def update(self, value):
+        now = time.monotonic()
+        if self.last_time is None:
+            self.last_time, self.last_value = now, value
+        elif now - self.last_time >= self.min_interval:
+            self.rate = (value - self.last_value) / (now - self.last_time)
+            self.last_time, self.last_value = now, value
+        return self.rate
+
+class MetricsExporter:
+    """Xuất số liệu qua HTTP trên localhost (/metrics, /metrics.json) và/hoặc ghi định kỳ ra file JSON."""
+    def __init__(self, metrics, port=METRICS_PORT, file_path=METRICS_FILE, interval=METRICS_INTERVAL):
+        self.metrics = metrics
+        self.port = port
+        self.file_path = file_path
+        self.interval = interval
+        self.server = None
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def start(self):
+        if self.port:
+            self._start_server()
+        if self.file_path:
+            if not os.path.isabs(self.file_path):
+                if hasattr(sys, '_MEIPASS'):
+                    base_path = os.path.dirname(sys.executable)
+                else:
+                    base_path = os.path.dirname(os.path.abspath(__file__))
+                self.file_path = os.path.join(base_path, self.file_path)
+            self.file_path = os.path.normpath(self.file_path)
+            thread = threading.Thread(target=self._write_loop, name="MetricsFile", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+            logger.info(f"Ghi số liệu theo dõi mỗi {self.interval}s vào {self.file_path}")
+
+    def _start_server(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, content_type = metrics.to_prometheus().encode('utf-8'), "text/plain; version=0.0.4; charset=utf-8"
+                elif self.path == "/metrics.json":
+                    body, content_type = json.dumps(metrics.to_json()).encode('utf-8'), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self.server = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+        except OSError as e:
+            logger.error(f"Không thể mở cổng số liệu {self.port}: {e}")
+            return
+        self.server.daemon_threads = True
+        thread = threading.Thread(target=self.server.serve_forever, name="MetricsHTTP", daemon=True)
+        thread.start()
+        self.threads.append(thread)
+        logger.info(f"Số liệu theo dõi tại http://127.0.0.1:{self.port}/metrics")
+
+    def _write_loop(self):
+        while not self.stop_event.wait(self.interval):
+            self.write_file()
+
+    def write_file(self):
+        tmp_path = f"{self.file_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.metrics.to_json(), f, ensure_ascii=False)
+            os.replace(tmp_path, self.file_path)
+        except OSError as e:
+            logger.warning(f"Không ghi được file số liệu: {e}")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.file_path:
+            # Lần ghi cuối phản ánh trạng thái lúc đóng
+            self.write_file()
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+def get_metrics():
+    """Trả về bộ số liệu dùng chung cho cả tiến trình."""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+        return _metrics
+
+def start_metrics_exporter():
+    """Khởi động xuất số liệu nếu được bật trong config (METRICS_PORT / METRICS_FILE), ngược lại trả về None."""
+    if not METRICS_PORT and not METRICS_FILE:
+        return None
+    exporter = MetricsExporter(get_metrics())
+    exporter.start()
+    return exporter
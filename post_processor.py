@@ -0,0 +1,189 @@
+import os
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+
+from logger_setup import logger
+from config import POST_PROCESS_WORKERS
+from metrics import get_metrics
+
+PRIORITY_REMUX = 0
+PRIORITY_MP3 = 1
+PRIORITY_MANUAL = 2
+
+class PostProcessor:
+    """Hàng đợi hậu xử lý (FFmpeg) có ưu tiên, dùng chung cho mọi recorder.
+
+    Số job chạy đồng thời bị giới hạn bởi số worker nên khi nhiều live kết thúc
+    cùng lúc, FFmpeg không tranh CPU/đĩa với các recorder đang ghi. Job có
+    priority nhỏ hơn chạy trước (remux -> MP3 -> chuyển đổi thủ công).
+    """
+    def __init__(self, workers=POST_PROCESS_WORKERS):
+        if not workers:
+            # Remux chủ yếu tốn I/O, encode MP3 tốn một nhân: dùng nửa số nhân, chừa phần còn lại cho việc ghi
+            workers = max(1, (os.cpu_count() or 2) // 2)
+        self.workers = workers
+        self.heap = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.is_running = True
+
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.total_run = 0.0
+        self.max_wait = 0.0
+
+        self.threads = []
+        for index in range(workers):
+            thread = threading.Thread(target=self._worker, name=f"PostProcess-{index + 1}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logger.info(f"Đã khởi động hàng đợi hậu xử lý với {workers} worker")
+        get_metrics().register_collector('post_processor', self.collect_metrics)
+
+    def submit(self, priority, fn, *args, **kwargs):
+        """Đưa job vào hàng đợi, trả về concurrent.futures.Future của job."""
+        with self.condition:
+            if not self.is_running:
+                raise RuntimeError("Hàng đợi hậu xử lý đã đóng")
+        return self._push(priority, fn, args, kwargs)
+
+    def submit_followup(self, priority, fn, *args, **kwargs):
+        """Như submit nhưng dùng cho job nối tiếp tạo ra từ bên trong một job đang chạy.
+
+        Vẫn nhận sau shutdown(): worker đang chạy job hiện tại sẽ lấy nó trước khi thoát, nên
+        bước MP3 không bị mất khi đóng ứng dụng trong lúc hàng đợi còn đang xử lý.
+        """
+        return self._push(priority, fn, args, kwargs)
+
+    def _push(self, priority, fn, args, kwargs):
+        future = Future()
+        with self.condition:
+            heapq.heappush(self.heap, (priority, next(self.counter), time.monotonic(), future, fn, args, kwargs))
+            self.condition.notify()
+        return future
+
+    def submit_after(self, futures, priority, fn, *args, **kwargs):
+        """Chỉ đưa job vào hàng đợi khi mọi future trong futures đã xong.
+
+        Job phụ thuộc không giữ worker trong lúc chờ nên không thể chặn chính các job nó đang chờ.
+        """
+        result = Future()
+        remaining = len(futures)
+        lock = threading.Lock()
+
+        def forward(job_future):
+            if job_future.cancelled():
+                result.cancel()
+            elif job_future.exception() is not None:
+                result.set_exception(job_future.exception())
+            else:
+                result.set_result(job_future.result())
+
+        def on_done(_):
+            nonlocal remaining
+            with lock:
+                remaining -= 1
+                if remaining: return
+            if result.cancelled(): return
+            # Vẫn nhận job nối tiếp sau shutdown(): worker vừa chạy xong job phụ thuộc sẽ lấy nó
+            self._push(priority, fn, args, kwargs).add_done_callback(forward)
+
+        if not futures:
+            return self.submit(priority, fn, *args, **kwargs)
+        for future in futures:
+            future.add_done_callback(on_done)
+        return result
+
+    def _worker(self):
+        while True:
+            with self.condition:
+                while self.is_running and not self.heap:
+                    self.condition.wait()
+                if not self.heap:
+                    return
+                _, _, queued_at, future, fn, args, kwargs = heapq.heappop(self.heap)
+                if not future.set_running_or_notify_cancel():
+                    continue
+                wait_time = time.monotonic() - queued_at
+                self.running += 1
+
+            started_at = time.monotonic()
+            error = None
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                error = e
+            run_time = time.monotonic() - started_at
+
+            with self.condition:
+                self.running -= 1
+                if error is None: self.completed += 1
+                else: self.failed += 1
+                self.total_wait += wait_time
+                self.total_run += run_time
+                self.max_wait = max(self.max_wait, wait_time)
+                queued = len(self.heap)
+            job = getattr(fn, '__name__', 'job')
+            metrics = get_metrics()
+            metrics.observe('postprocess_job_seconds', run_time, job=job)
+            metrics.observe('postprocess_wait_seconds', wait_time, job=job)
+            if error is not None:
+                metrics.inc('postprocess_job_errors_total', job=job)
+            logger.debug(
+                f"Xong job hậu xử lý {getattr(fn, '__name__', fn)}: chờ {wait_time:.1f}s, "
+                f"chạy {run_time:.1f}s, còn {queued} job trong hàng đợi"
+            )
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def stats(self):
+        with self.condition:
+            finished = self.completed + self.failed
+            return {
+                'workers': self.workers,
+                'queued': len(self.heap),
+                'running': self.running,
+                'completed': self.completed,
+                'failed': self.failed,
+                'avg_wait': self.total_wait / finished if finished else 0.0,
+                'avg_run': self.total_run / finished if finished else 0.0,
+                'max_wait': self.max_wait,
+            }
+
+    def collect_metrics(self):
+        with self.condition:
+            queued, running = len(self.heap), self.running
+        return [
+            ('postprocess_queue_depth', {}, queued),
+            ('postprocess_running_jobs', {}, running),
+            ('postprocess_workers', {}, self.workers),
+            ('postprocess_utilization', {}, round(running / self.workers, 3)),
+        ]
+
+    def shutdown(self, wait=True):
+        """Không nhận job mới; các job đã xếp hàng vẫn được chạy hết."""
+        with self.condition:
+            self.is_running = False
+            self.condition.notify_all()
+        if wait:
+            for thread in self.threads:
+                thread.join()
+        logger.info("Đã đóng hàng đợi hậu xử lý")
+
+_post_processor = None
+_post_processor_lock = threading.Lock()
+
+def get_post_processor():
+    """Trả về hàng đợi hậu xử lý dùng chung cho cả tiến trình."""
+    global _post_processor
+    with _post_processor_lock:
+        if _post_processor is None:
+            _post_processor = PostProcessor()
+        return _post_processor
@@ -2,113 +2,95 @@ import os
 import sys
 import time
 import json
-import re
 import logging
 import subprocess
-import psutil
 import threading
+import uuid
 from enum import Enum, IntEnum
 from contextlib import contextmanager, nullcontext, suppress
-from requests import RequestException, Session
-from tenacity import retry, stop_after_attempt, wait_exponential
 
 from logger_setup import logger
-from config import TIKTOK_CONFIG
+from config import (
+    TIKTOK_CONFIG, SEGMENT_DURATION_MINUTES, SEGMENT_SIZE_MB, SEGMENT_CONCAT_AT_END, LIVE_REMUX, FFMPEG_LOW_PRIORITY,
+    FLV_KEYFRAME_INDEX, FLV_GAP_THRESHOLD_MS, RECONNECT_ATTEMPTS, RECONNECT_DELAY,
+    HTTP_POOL_HOSTS, HTTP_POOL_SIZE, HTTP_STREAM_POOL_SIZE, POLL_ERROR_DELAY, STREAM_READ_SIZE
+)
+from room_cache import get_room_id_cache
+from stream_writer import BufferedStreamWriter, FileSink, SegmentedSink, FFmpegPipeSink, FlvIndexingSink
+from flv_utils import scan_flv_file, write_keyframe_index, keyframe_index_path
+from post_processor import get_post_processor, PRIORITY_REMUX, PRIORITY_MP3
+from media_probe import probe_media
+from live_poller import next_poll_delay, record_live_start
+from ffmpeg_locator import NO_WINDOW_FLAGS, get_ffmpeg_path, has_ffmpeg_encoder
+from metrics import get_metrics, RateTracker
+from event_log import log_event
+from storage import get_storage_manager, ADMIT_REFUSE, ADMIT_LOW
 
-def setup_ffmpeg():
-    """Thiết lập FFmpeg và trả về đường dẫn tới ffmpeg.exe."""
-    import shutil
-
-    ffmpeg_path = None
-    base_path = None
-
-    if not hasattr(sys, '_MEIPASS'):
-        base_path = os.path.dirname(os.path.abspath(__file__))
-        ffmpeg_dir = os.path.join(base_path, 'ffmpeg')
-        ffmpeg_path = os.path.join(ffmpeg_dir, 'ffmpeg.exe')
-        if os.path.exists(ffmpeg_path):
-            logger.info(f"Đã tìm thấy FFmpeg trong thư mục ffmpeg")
-        else:
-            logger.warning(f"Không tìm thấy ffmpeg.exe trong {ffmpeg_dir}, thử tìm trong PATH")
-            ffmpeg_path = shutil.which("ffmpeg")
-            if ffmpeg_path:
-                logger.info(f"Đã tìm thấy FFmpeg trong PATH")
-            else:
-                logger.warning("Không tìm thấy FFmpeg trong PATH")
-    else:
-        base_path = sys._MEIPASS
-        ffmpeg_dir = os.path.join(base_path, 'ffmpeg')
-        ffmpeg_path = os.path.join(ffmpeg_dir, 'ffmpeg.exe')
-        if os.path.exists(ffmpeg_path):
-            logger.info(f"Đã tìm thấy FFmpeg trong thư mục chương trình")
-        else:
-            logger.warning(f"Không tìm thấy ffmpeg.exe, thử tìm trong PATH")
-            ffmpeg_path = shutil.which("ffmpeg")
-            if ffmpeg_path:
-                logger.info(f"Đã tìm thấy FFmpeg trong PATH")
-            else:
-                logger.warning("Không tìm thấy FFmpeg trong PATH")
-
-    if not ffmpeg_path:
-        error_msg = (
-            "Không tìm thấy FFmpeg. Vui lòng tải và đặt 'ffmpeg.exe' vào thư mục 'ffmpeg' "
-            "cùng cấp với chương trình, hoặc thêm vào biến môi trường PATH."
-        )
-        logger.error(error_msg)
-        raise FileNotFoundError(error_msg)
-
-    ffmpeg_path = os.path.normpath(ffmpeg_path)
-
-    if not os.access(ffmpeg_path, os.X_OK):
-        error_msg = f"Không có quyền thực thi FFmpeg tại {ffmpeg_path}."
-        logger.error(error_msg)
-        raise PermissionError(error_msg)
-
-    os.environ["FFMPEG_PATH"] = ffmpeg_path
-    return ffmpeg_path
-
-def run_ffmpeg(input_file, output_file, args, recording_id='N/A'):
-    ffmpeg_path = os.environ.get("FFMPEG_PATH")
-    if not ffmpeg_path:
-        raise FileNotFoundError("Đường dẫn FFmpeg chưa được thiết lập.")
-        
-    cmd = [ffmpeg_path, "-i", input_file] + args + ["-y", output_file]
+def run_ffmpeg(input_file, output_file, args, recording_id='N/A', input_args=None, extra_outputs=None):
+    """Chạy FFmpeg; extra_outputs là danh sách (args, output_file) xuất thêm trong cùng một lần đọc nguồn."""
+    ffmpeg_path = get_ffmpeg_path()
+    outputs = [(args, output_file)] + list(extra_outputs or [])
+    cmd = [ffmpeg_path] + (input_args or []) + ["-i", input_file]
+    for output_args, path in outputs:
+        cmd += output_args + ["-y", path]
     
     try:
         process = subprocess.Popen(
             cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-            creationflags=subprocess.CREATE_NO_WINDOW, text=True, encoding='utf-8', errors='ignore'
+            creationflags=NO_WINDOW_FLAGS, text=True, encoding='utf-8', errors='ignore'
         )
+        if FFMPEG_LOW_PRIORITY:
+            lower_process_priority(process.pid)
         stdout, stderr = process.communicate()
         if process.returncode != 0:
             error_msg = stderr if stderr else "Lỗi không xác định"
             logger.error(f"Lỗi FFmpeg: {error_msg.strip()}", extra={'recording_id': recording_id})
             raise Exception(f"Lỗi FFmpeg: {error_msg.strip()}")
-        logger.info(f"Chuyển đổi file {os.path.basename(output_file)} thành công", extra={'recording_id': recording_id})
+        output_names = ", ".join(os.path.basename(path) for _, path in outputs)
+        logger.info(f"Chuyển đổi file {output_names} thành công", extra={'recording_id': recording_id})
         return process.pid
     except Exception as e:
         logger.error(f"Lỗi chạy FFmpeg: {e}", extra={'recording_id': recording_id})
         raise
 
-def check_audio_stream(file):
-    ffmpeg_path = os.environ.get("FFMPEG_PATH")
+def _file_size(path):
     try:
-        cmd = [ffmpeg_path, "-i", file, "-hide_banner", "-v", "quiet", "-f", "null", "-"]
-        process = subprocess.run(cmd, capture_output=True, timeout=10)
-        return "Audio:" in process.stderr.decode('utf-8', errors='ignore')
-    except Exception:
-        return False
+        return os.path.getsize(path)
+    except OSError:
+        return 0
 
-def check_video_stream(file):
-    ffmpeg_path = os.environ.get("FFMPEG_PATH")
+@contextmanager
+def ffmpeg_stage(name, recording_id, input_files, output_file, **fields):
+    """Ghi sự kiện <name>_start/<name>_end (thời gian chạy, kích thước vào/ra) quanh một lần chạy FFmpeg."""
+    log_event(f"{name}_start", recording_id, files=len(input_files), bytes=sum(map(_file_size, input_files)), **fields)
+    started_at = time.monotonic()
+    ok = False
     try:
-        cmd = [ffmpeg_path, "-i", file, "-hide_banner", "-v", "quiet", "-f", "null", "-"]
-        process = subprocess.run(cmd, capture_output=True, timeout=10)
-        return "Video:" in process.stderr.decode('utf-8', errors='ignore')
-    except Exception:
-        return False
+        yield
+        ok = True
+    finally:
+        log_event(f"{name}_end", recording_id, ok=ok, seconds=round(time.monotonic() - started_at, 3),
+                  bytes=_file_size(output_file), **fields)
+
+def lower_process_priority(pid):
+    """Hạ độ ưu tiên CPU của tiến trình để các luồng ghi hình luôn được ưu tiên."""
+    import psutil
+    try:
+        proc = psutil.Process(pid)
+        proc.nice(psutil.BELOW_NORMAL_PRIORITY_CLASS if sys.platform == 'win32' else 10)
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+        pass
+
+def check_audio_stream(file):
+    info = probe_media(file)
+    return bool(info and info.has_audio)
+
+def check_video_stream(file):
+    info = probe_media(file)
+    return bool(info and info.has_video)
 
 def stop_ffmpeg_processes(pid_list):
+    import psutil
     for pid in pid_list[:]:
         try:
             if psutil.pid_exists(pid):
@@ -123,9 +105,6 @@ def stop_ffmpeg_processes(pid_list):
         except Exception as e:
             logger.error(f"Lỗi khi dừng FFmpeg (PID: {pid}): {e}")
 
-setup_ffmpeg()
-
-
 class TimeOut(IntEnum):
     ONE_MINUTE = 60
     AUTOMATIC_MODE = 5
@@ -140,6 +119,10 @@ class Mode(IntEnum):
     MANUAL = 0
     AUTOMATIC = 1
 
+class RoomStatus(IntEnum):
+    LIVE = 2
+    ENDED = 4
+
 class TikTokError(Enum):
     def __str__(self):
         return str(self.value)
@@ -157,21 +140,54 @@ class TikTokException(Exception): pass
 class UserLiveException(Exception): pass
 class LiveNotFound(Exception): pass
 class RecordingException(Exception): pass
+class StreamDisconnected(RecordingException): pass
+
 
+MP3_ARGS = ["-vn", "-acodec", "mp3", "-ab", "128k"]
+MP3_ENCODERS = ("libmp3lame", "libshine", "mp3_mf")
 
 class VideoManagement:
     @staticmethod
-    def convert_flv_to_mp4(file, ffmpeg_lock=None, ffmpeg_pids=None, recording_id='N/A'):
+    def mp3_supported():
+        """Bản FFmpeg hiện tại có encoder MP3 hay không (kết quả được cache cùng đường dẫn FFmpeg)."""
+        return any(has_ffmpeg_encoder(name) for name in MP3_ENCODERS)
+
+    @staticmethod
+    def mp3_outputs(mp4_file):
+        """Output MP3 đi kèm để xuất cùng lần chạy FFmpeg tạo ra mp4_file."""
+        return [(MP3_ARGS, os.path.splitext(mp4_file)[0] + '.mp3')]
+
+    @staticmethod
+    def convert_flv_to_mp4(file, ffmpeg_lock=None, ffmpeg_pids=None, recording_id='N/A', with_mp3=False):
         file = os.path.normpath(file)
         logger.info(f"Bắt đầu chuyển đổi FLV sang MP4: {os.path.basename(file)}", extra={'recording_id': recording_id})
         try:
             output_file = os.path.normpath(file.replace('_flv.mp4', '.mp4'))
-            with ffmpeg_lock if ffmpeg_lock else nullcontext():
-                pid = run_ffmpeg(file, output_file, ["-c", "copy"], recording_id=recording_id)
+            if with_mp3 and not VideoManagement.mp3_supported():
+                logger.warning("FFmpeg không có encoder MP3, bỏ qua MP3", extra={'recording_id': recording_id})
+                with_mp3 = False
+            info = probe_media(file) if with_mp3 else None
+            if info is not None and not info.has_audio:
+                logger.warning(f"File {os.path.basename(file)} không có âm thanh, bỏ qua MP3", extra={'recording_id': recording_id})
+                with_mp3 = False
+            with ffmpeg_lock if ffmpeg_lock else nullcontext(), \
+                    ffmpeg_stage('remux', recording_id, [file], output_file, with_mp3=with_mp3):
+                if with_mp3:
+                    # Demux nguồn một lần, xuất đồng thời MP4 (copy) và MP3
+                    try:
+                        pid = run_ffmpeg(file, output_file, ["-c", "copy"], recording_id=recording_id,
+                                         extra_outputs=VideoManagement.mp3_outputs(output_file))
+                    except Exception:
+                        logger.warning("Không xuất được MP3 cùng lúc (có thể không có audio), chỉ chuyển sang MP4", extra={'recording_id': recording_id})
+                        pid = run_ffmpeg(file, output_file, ["-c", "copy"], recording_id=recording_id)
+                else:
+                    pid = run_ffmpeg(file, output_file, ["-c", "copy"], recording_id=recording_id)
                 if ffmpeg_pids is not None:
                     with threading.Lock():
                         ffmpeg_pids.append(pid)
             os.remove(file)
+            with suppress(OSError):
+                os.remove(keyframe_index_path(file))
         except Exception as e:
             logger.error(f"Lỗi chuyển đổi MP4: {e}", extra={'recording_id': recording_id})
         finally:
@@ -185,9 +201,16 @@ class VideoManagement:
         try:
             if output_file is None:
                 output_file = os.path.normpath(file.replace('.mp4', '.mp3'))
+            if not VideoManagement.mp3_supported():
+                logger.error("FFmpeg không có encoder MP3, không thể chuyển đổi")
+                return
+            info = probe_media(file)
+            if info is not None and not info.has_audio:
+                logger.warning(f"File {os.path.basename(file)} không có âm thanh, bỏ qua chuyển đổi MP3")
+                return
 
             with ffmpeg_lock if ffmpeg_lock else nullcontext():
-                pid = run_ffmpeg(file, output_file, ["-vn", "-acodec", "mp3", "-ab", "128k"], recording_id=recording_id)
+                pid = run_ffmpeg(file, output_file, MP3_ARGS, recording_id=recording_id)
                 if ffmpeg_pids is not None:
                     with threading.Lock():
                         ffmpeg_pids.append(pid)
@@ -197,95 +220,308 @@ class VideoManagement:
             if ffmpeg_pids:
                 stop_ffmpeg_processes(ffmpeg_pids)
 
+    @staticmethod
+    def concat_files(files, output_file, recording_id='N/A', with_mp3=False):
+        """Ghép nối tiếp các file cùng codec thành một file bằng concat demuxer (-c copy, không nén lại)."""
+        output_file = os.path.normpath(output_file)
+        list_file = f"{os.path.splitext(output_file)[0]}_concat.txt"
+        logger.info(f"Bắt đầu ghép {len(files)} file thành {os.path.basename(output_file)}", extra={'recording_id': recording_id})
+        try:
+            with open(list_file, 'w', encoding='utf-8') as f:
+                for path in files:
+                    escaped = os.path.abspath(path).replace('\\', '/').replace("'", "'\\''")
+                    f.write(f"file '{escaped}'\n")
+            with ffmpeg_stage('concat', recording_id, files, output_file, with_mp3=with_mp3):
+                run_ffmpeg(list_file, output_file, ["-c", "copy"], recording_id=recording_id,
+                           input_args=["-f", "concat", "-safe", "0"],
+                           extra_outputs=VideoManagement.mp3_outputs(output_file) if with_mp3 else None)
+            return True
+        except Exception as e:
+            logger.error(f"Lỗi ghép file: {e}", extra={'recording_id': recording_id})
+            return False
+        finally:
+            with suppress(OSError):
+                os.remove(list_file)
+
+# Các mức chất lượng trong flv_pull_url, từ cao xuống thấp
+STREAM_QUALITIES = ('FULL_HD1', 'HD1', 'SD1', 'SD2')
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36",
+    "Accept-Language": "en-US,en;q=0.9,vi;q=0.8",
+    "Referer": "https://www.tiktok.com/",
+}
+
+ROOM_ID_PATHS = (
+    ('LiveRoom', 'liveRoomUserInfo', 'user', 'roomId'),
+    ('RoomFeed', 'detail', 'liveRoom', 'roomId'),
+)
+
+class SigiStateReader:
+    """Tìm khối SIGI_STATE trong HTML nhận dần từng phần.
+
+    Phần HTML trước thẻ script bị bỏ ngay, feed() trả về nội dung JSON khi thẻ đã đóng.
+    """
+    START = b'<script id="SIGI_STATE" type="application/json">'
+    END = b'</script>'
+    CHUNK_SIZE = 16 * 1024
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.started = False
+        self.scan_from = 0
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        if not self.started:
+            index = self.buffer.find(self.START)
+            if index < 0:
+                # Giữ lại phần đuôi phòng khi thẻ mở bị cắt giữa hai chunk
+                del self.buffer[:-len(self.START)]
+                return None
+            del self.buffer[:index + len(self.START)]
+            self.started = True
+        index = self.buffer.find(self.END, self.scan_from)
+        if index < 0:
+            self.scan_from = max(0, len(self.buffer) - len(self.END))
+            return None
+        return bytes(self.buffer[:index])
+
 class HttpClient:
-    def __init__(self, cookies=None):
-        self.session = Session()
-        self.session.trust_env = False
-        self.session.verify = True
-        self.session.headers.update({
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36",
-            "Accept-Language": "en-US,en;q=0.9,vi;q=0.8",
-            "Referer": "https://www.tiktok.com/",
-        })
+    """Client HTTP dùng chung: một pool kết nối cho API TikTok và một pool riêng để kéo stream từ CDN.
+
+    Các kết nối keep-alive được tái sử dụng giữa mọi recorder, tránh bắt tay TLS lại ở mỗi lần kiểm tra.
+    """
+    def __init__(self, cookies=None, pool_size=HTTP_POOL_SIZE, stream_pool_size=HTTP_STREAM_POOL_SIZE):
+        self.session = self._create_session(cookies, pool_size)
+        self.stream_session = self._create_session(cookies, stream_pool_size)
+
+    @staticmethod
+    def _create_session(cookies, pool_size):
+        from requests import Session
+        from requests.adapters import HTTPAdapter
+        session = Session()
+        session.trust_env = False
+        session.verify = True
+        session.headers.update(DEFAULT_HEADERS)
         if cookies:
-            self.session.cookies.update(cookies)
+            session.cookies.update(cookies)
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def connection_stats(self):
+        """Số kết nối theo từng host: đã mở, đang rảnh trong pool và số request đã gửi."""
+        stats = {}
+        for name, session in (('api', self.session), ('stream', self.stream_session)):
+            adapters = {id(adapter): adapter for adapter in session.adapters.values()}.values()
+            for adapter in adapters:
+                pools = adapter.poolmanager.pools
+                for key in list(pools.keys()):
+                    pool = pools.get(key)
+                    if pool is None: continue
+                    idle = sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0
+                    stats[f"{name}:{pool.host}"] = {
+                        'opened': pool.num_connections, 'idle': idle, 'requests': pool.num_requests
+                    }
+        return stats
 
     def close_session(self):
         if self.session:
             self.session.close()
+        if self.stream_session:
+            self.stream_session.close()
+
+_http_clients = {}
+_http_clients_lock = threading.Lock()
+
+def get_http_client(cookies=None):
+    """Trả về HttpClient dùng chung cho cả tiến trình (mỗi bộ cookies một client)."""
+    key = tuple(sorted((name, value) for name, value in (cookies or {}).items() if value))
+    with _http_clients_lock:
+        client = _http_clients.get(key)
+        if client is None:
+            client = HttpClient(cookies)
+            _http_clients[key] = client
+            get_metrics().register_collector('http_pools', collect_http_pool_metrics)
+        return client
+
+def collect_http_pool_metrics():
+    """Số kết nối đã mở/đang rảnh và số request của từng pool HTTP (theo host)."""
+    with _http_clients_lock:
+        clients = list(_http_clients.values())
+    samples = []
+    for client in clients:
+        for pool, stats in client.connection_stats().items():
+            samples.append(('http_pool_connections_opened_total', {'pool': pool}, stats['opened']))
+            samples.append(('http_pool_connections_idle', {'pool': pool}, stats['idle']))
+            samples.append(('http_pool_requests_total', {'pool': pool}, stats['requests']))
+    return samples
+
+def close_http_clients():
+    with _http_clients_lock:
+        for client in _http_clients.values():
+            logger.debug(f"Thống kê kết nối HTTP trước khi đóng: {client.connection_stats()}")
+            client.close_session()
+        _http_clients.clear()
 
 class TikTokAPI:
-    def __init__(self, cookies):
+    def __init__(self, cookies, room_cache=None):
         self.config = TIKTOK_CONFIG
-        self.http_client = HttpClient(cookies)
+        self.cookies = cookies
+        self.room_cache = room_cache
+
+    @property
+    def http_client(self):
+        # Tạo (và import requests) ở request đầu tiên thay vì lúc khởi động
+        return get_http_client(self.cookies)
 
-    def get_room_id_from_user(self, user: str) -> str:
+    def get_room_id_from_user(self, user: str, use_cache=True) -> str:
+        if self.room_cache and use_cache:
+            room_id = self.room_cache.get(user)
+            if room_id:
+                logger.debug(f"Dùng RoomID đã cache cho {user}: {room_id}")
+                return room_id
+        from requests import RequestException
         try:
             url = f"{self.config['api_endpoints']['base_url']}/@{user}/live"
-            response = self.http_client.session.get(url, timeout=10)
-            response.raise_for_status()
+            reader = SigiStateReader()
+            sigi_state = None
+            with get_metrics().timer('api_request_seconds', endpoint='live_page'), \
+                    self.http_client.session.get(url, stream=True, timeout=10) as response:
+                response.raise_for_status()
+                # Dừng tải ngay khi khối SIGI_STATE đã đóng, phần HTML còn lại bị bỏ qua
+                for chunk in response.iter_content(chunk_size=SigiStateReader.CHUNK_SIZE):
+                    sigi_state = reader.feed(chunk)
+                    if sigi_state is not None: break
 
-            content = response.text
-            match = re.search(r'<script id="SIGI_STATE" type="application/json">(.*?)</script>', content)
-            if not match:
-                raise UserLiveException(TikTokError.API_CHANGED)
-
-            data = json.loads(match.group(1))
-            
-            room_id = None
-            if 'LiveRoom' in data and 'liveRoomUserInfo' in data['LiveRoom']:
-                room_id = data['LiveRoom']['liveRoomUserInfo'].get('user', {}).get('roomId')
-            
-            if not room_id and 'RoomFeed' in data and 'liveRoom' in data['RoomFeed']['detail']:
-                 room_id = data['RoomFeed']['detail']['liveRoom'].get('roomId')
-            
+            room_id = self.extract_room_id(sigi_state) if sigi_state is not None else None
             if not room_id:
-                 logger.warning(f"Không tìm thấy RoomID cho {user} trong SIGI_STATE.")
-                 raise UserLiveException(TikTokError.ROOM_ID_ERROR)
-            
-            return str(room_id)
-        
+                logger.warning(f"Không tìm thấy RoomID cho {user} trong SIGI_STATE, thử API user_detail.")
+                room_id = self.get_room_id_from_user_detail(user, sigi_state is None)
+            if self.room_cache: self.room_cache.set(user, room_id)
+            return room_id
         except RequestException as e:
-            if e.response and e.response.status_code == 404:
+            if e.response is not None and e.response.status_code == 404:
                 raise UserLiveException(TikTokError.USERNAME_NOT_FOUND)
             logger.error(f"Lỗi mạng khi lấy RoomID từ {user}: {e}")
             raise TikTokException(f"Lỗi mạng: {e}")
-        except (json.JSONDecodeError, KeyError) as e:
-            logger.error(f"Lỗi phân tích cú pháp JSON hoặc Key cho {user}: {e}")
-            raise UserLiveException(TikTokError.API_CHANGED)
 
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=5))
+    def get_room_id_from_user_detail(self, user, sigi_missing=False):
+        url = f"{self.config['api_endpoints']['base_url']}{self.config['api_endpoints']['user_detail'].format(user=user)}"
+        from requests import RequestException
+        try:
+            with get_metrics().timer('api_request_seconds', endpoint='user_detail'):
+                response = self.http_client.session.get(url, timeout=10)
+                response.raise_for_status()
+            payload = response.json()
+        except (RequestException, ValueError) as e:
+            logger.error(f"Lỗi khi lấy RoomID từ user_detail cho {user}: {e}")
+            payload = {}
+        return self.parse_user_detail_room_id(user, payload, sigi_missing)
+
+    @staticmethod
+    def parse_user_detail_room_id(user, payload, sigi_missing=False):
+        room_id = ((payload.get('userInfo') or {}).get('user') or {}).get('roomId')
+        if not room_id:
+            logger.warning(f"Không tìm thấy RoomID cho {user} trong SIGI_STATE và user_detail.")
+            raise UserLiveException(TikTokError.API_CHANGED if sigi_missing else TikTokError.ROOM_ID_ERROR)
+        return str(room_id)
+
+    @staticmethod
+    def extract_room_id(sigi_state):
+        """Đọc RoomID từ SIGI_STATE, chỉ giải mã các nhánh JSON chứa roomId thay vì toàn bộ khối."""
+        text = sigi_state.decode('utf-8', errors='ignore')
+        decoder = json.JSONDecoder()
+        for path in ROOM_ID_PATHS:
+            # Tìm lần lượt hai khóa đầu của đường dẫn rồi chỉ giải mã đối tượng con tương ứng
+            pos = 0
+            for key in path[:2]:
+                pos = text.find(f'"{key}":', pos)
+                if pos < 0: break
+                pos += len(key) + 3
+            if pos < 0: continue
+            while pos < len(text) and text[pos].isspace(): pos += 1
+            try:
+                node, _ = decoder.raw_decode(text, pos)
+            except json.JSONDecodeError:
+                continue
+            for key in path[2:]:
+                node = node.get(key) if isinstance(node, dict) else None
+            if node:
+                return str(node)
+        return None
+
     def is_room_alive(self, room_id: str):
         if not room_id: return False
         try:
             url = f"{self.config['api_endpoints']['webcast_url']}{self.config['api_endpoints']['room_info'].format(room_id=room_id)}"
-            response = self.http_client.session.get(url, timeout=5)
+            with get_metrics().timer('api_request_seconds', endpoint='room_info'):
+                response = self.http_client.session.get(url, timeout=5)
             if response.status_code != 200: return False
-            data = response.json()
-            return data.get('data', {}).get('status', 0) == 2
+            data = self.handle_room_info(self.room_cache, room_id, response.json())
+            return data.get('status', 0) == RoomStatus.LIVE
         except Exception:
             return False
 
-    def get_live_url(self, room_id: str):
+    @staticmethod
+    def handle_room_info(room_cache, room_id, payload):
+        """Trả về phần 'data' của room_info; hủy cache RoomID nếu room không tồn tại hoặc đã kết thúc."""
+        data = payload.get('data') or {}
+        if room_cache and (payload.get('status_code', 0) != 0 or not data or data.get('status') == RoomStatus.ENDED):
+            room_cache.invalidate_room(room_id)
+        return data
+
+    def check_rooms_alive(self, room_ids):
+        """Kiểm tra trạng thái live của nhiều room trong một request check_alive.
+
+        Trả về dict {room_id: bool}. Lỗi mạng/JSON được ném ra để phía gọi tự xử lý.
+        """
+        room_ids = [str(room_id) for room_id in room_ids if room_id]
+        if not room_ids: return {}
+        url = f"{self.config['api_endpoints']['webcast_url']}{self.config['api_endpoints']['check_alive'].format(room_id=','.join(room_ids))}"
+        with get_metrics().timer('api_request_seconds', endpoint='check_alive'):
+            response = self.http_client.session.get(url, timeout=5)
+            response.raise_for_status()
+        data = response.json()
+        if data.get('status_code', 0) != 0:
+            raise TikTokException(f"check_alive trả về status_code {data.get('status_code')}")
+
+        results = {room_id: False for room_id in room_ids}
+        for item in data.get('data') or []:
+            room_id = str(item.get('room_id_str') or item.get('room_id', ''))
+            if room_id in results:
+                results[room_id] = bool(item.get('alive'))
+        return results
+
+    def get_live_url(self, room_id: str, low_quality=False):
+        from requests import RequestException
         try:
             url = f"{self.config['api_endpoints']['webcast_url']}{self.config['api_endpoints']['room_info'].format(room_id=room_id)}"
-            response = self.http_client.session.get(url, timeout=10)
-            data = response.json().get('data', {})
+            with get_metrics().timer('api_request_seconds', endpoint='room_info'):
+                response = self.http_client.session.get(url, timeout=10)
+            return self.parse_live_url(self.handle_room_info(self.room_cache, room_id, response.json()), low_quality)
+        except (RequestException, json.JSONDecodeError):
+            raise LiveNotFound(TikTokError.RETRIEVE_LIVE_URL)
 
-            if data.get('status', 0) != 2:
-                raise LiveNotFound(TikTokError.USER_NOT_CURRENTLY_LIVE)
+    @staticmethod
+    def parse_live_url(data, low_quality=False):
+        """Chọn URL FLV chất lượng cao nhất (hoặc thấp nhất có thể nếu low_quality) từ phần 'data' của room_info."""
+        if data.get('status', 0) != RoomStatus.LIVE:
+            raise LiveNotFound(TikTokError.USER_NOT_CURRENTLY_LIVE)
 
-            stream_data = data.get('stream_url', {}).get('flv_pull_url', {})
-            live_url = stream_data.get('FULL_HD1') or stream_data.get('HD1') or stream_data.get('SD1') or stream_data.get('SD2')
-            
-            if not live_url:
-                raise LiveNotFound(TikTokError.RETRIEVE_LIVE_URL)
-            return live_url
-        except (RequestException, json.JSONDecodeError):
+        stream_data = data.get('stream_url', {}).get('flv_pull_url', {})
+        qualities = reversed(STREAM_QUALITIES) if low_quality else STREAM_QUALITIES
+        live_url = next((stream_data[quality] for quality in qualities if stream_data.get(quality)), None)
+        
+        if not live_url:
             raise LiveNotFound(TikTokError.RETRIEVE_LIVE_URL)
+        return live_url
 
 class TikTokRecorder:
-    def __init__(self, user, cookies=None, duration=None, convert_to_mp3=False, recording_id='N/A', custom_output_dir=None, status_callback=None):
+    def __init__(self, user, cookies=None, duration=None, convert_to_mp3=False, recording_id='N/A', custom_output_dir=None, status_callback=None,
+                 segment_minutes=SEGMENT_DURATION_MINUTES, segment_mb=SEGMENT_SIZE_MB, live_remux=LIVE_REMUX):
         from config import COOKIES
         self.user = user
         self.cookies = cookies or COOKIES
@@ -294,110 +530,541 @@ class TikTokRecorder:
         self.recording_id = recording_id
         self.custom_output_dir = custom_output_dir
         self.status_callback = status_callback
+        self.scheduler = None
+        self.segment_duration = segment_minutes * 60 if segment_minutes else None
+        self.segment_size = segment_mb * 1024 * 1024 if segment_mb else None
+        self.segments = []
+        self.live_remux = live_remux
         
-        self.tiktok = TikTokAPI(self.cookies)
+        self.tiktok = self._create_api()
         self.room_id = None
         self.stop_event = threading.Event()
+        self.wake_event = threading.Event()
         self.cancellation_requested = False
+        self.session_basepath = None
         self.output_filepath = None
+        self.stream_writer = None
         self.final_video_path = None # <-- THÊM THUỘC TÍNH MỚI
+        self.post_process_future = None
+        self.flv_stats = {}
+        self.piece_count = 0
+        self.deadline = None
+        self.stream_gaps = []
+        self.bytes_received = 0
+        self.bytes_written = 0
+        self.last_chunk_at = None
+        self.byte_rate = RateTracker()
+        # Mốc thời gian cho nhật ký sự kiện; session_id phân biệt các phiên của cùng recording_id
+        self.session_id = uuid.uuid4().hex[:12]
+        self.low_quality = False
+        self.reconnect_failures = 0
+        self.resolve_error = None
+        self.watch_started_at = time.monotonic()
+        self.go_live_at = None
+        self.piece_started_at = None
 
         logger.info(f"Khởi tạo recorder cho user: {self.user}")
 
+    def _create_api(self):
+        return TikTokAPI(self.cookies, room_cache=get_room_id_cache())
+
+    def _refresh_room_id_if_expired(self):
+        """Lấy lại RoomID khi cache đã hết hạn hoặc bị hủy (room cũ đã kết thúc)."""
+        room_cache = self.tiktok.room_cache
+        if not room_cache or room_cache.get(self.user) is not None:
+            return False
+        room_id = self.tiktok.get_room_id_from_user(self.user)
+        if room_id == self.room_id:
+            return False
+        logger.info(f"RoomID của {self.user} đã thay đổi: {self.room_id} -> {room_id}")
+        self.room_id = room_id
+        return True
+
     def _update_status(self, message, color):
         if self.status_callback:
             self.status_callback(self.recording_id, message, color)
 
-    def run(self):
+    def _event(self, event, **fields):
+        log_event(event, self.recording_id, session_id=self.session_id, user=self.user, **fields)
+
+    def _on_go_live(self, polls):
+        self.go_live_at = time.monotonic()
+        self._event('go_live', room_id=self.room_id, polls=polls, waited=round(self.go_live_at - self.watch_started_at, 3))
+
+    def _on_first_byte(self, size):
+        """Gọi ngay sau lần đọc đầu tiên có dữ liệu của một phần (không chờ đầy block); size là số byte của lần đọc đó."""
+        fields = {'piece': len(self.stream_gaps), 'since_request': round(time.monotonic() - self.piece_started_at, 3), 'bytes': size}
+        if self.go_live_at is not None:
+            fields['since_go_live'] = round(time.monotonic() - self.go_live_at, 3)
+        self._event('first_byte', **fields)
+
+    def _on_stopped(self, error=None):
+        if error is not None:
+            reason = 'error'
+        elif self.cancellation_requested:
+            reason = 'cancelled'
+        elif self.stop_event.is_set():
+            reason = 'stopped'
+        elif self.deadline and time.monotonic() > self.deadline:
+            reason = 'duration'
+        else:
+            reason = 'live_ended'
+        fields = {'reason': reason, 'bytes_received': self.bytes_received, 'bytes_written': self.bytes_written,
+                  'reconnects': len(self.stream_gaps), 'low_quality': self.low_quality}
+        if self.go_live_at is not None:
+            fields['seconds'] = round(time.monotonic() - self.go_live_at, 3)
+        if error is not None:
+            fields['error'] = str(error)
+        self._event('stop', **fields)
+
+    def prepare(self):
+        """Lấy RoomID trước khi bắt đầu chờ live; trả về False nếu không thể tiếp tục."""
+        self.watch_started_at = started_at = time.monotonic()
         try:
             self._update_status("Lấy RoomID...", "blue")
             self.room_id = self.tiktok.get_room_id_from_user(self.user)
+            self._event('resolve', room_id=self.room_id, seconds=round(time.monotonic() - started_at, 3))
+            return True
         except (UserLiveException, TikTokException) as e:
             logger.error(f"Lỗi khi lấy RoomID cho {self.user}: {e}")
+            self.resolve_error = e
+            self._event('resolve', error=str(e), seconds=round(time.monotonic() - started_at, 3))
             self._update_status(f"Lỗi: {e}", "red")
-            return
-            
-        wait_intervals = [120, 300, 600, 900]
-        interval_index = 0
+            return False
+
+    def user_not_found(self):
+        """True nếu lần lấy RoomID gần nhất thất bại vì user không tồn tại (khác lỗi mạng tạm thời)."""
+        error = self.resolve_error
+        return isinstance(error, UserLiveException) and error.args[:1] == (TikTokError.USERNAME_NOT_FOUND,)
+
+    def run(self):
+        """Chờ live và ghi hình ngay trên luồng hiện tại (dùng PollScheduler.submit để không giữ luồng khi chờ)."""
+        if self.prepare():
+            self._wait_and_record()
+
+    def _wait(self, seconds):
+        # wake_event được set khi Dừng/Hủy
+        self.wake_event.wait(seconds)
+        self.wake_event.clear()
+
+    def _wait_and_record(self):
+        attempt = 0
         
         while not self.stop_event.is_set():
             try:
+                if attempt:
+                    self._refresh_room_id_if_expired()
                 self._update_status("Kiểm tra live...", "blue")
+                checked_at = time.monotonic()
                 is_live = self.tiktok.is_room_alive(self.room_id)
+                poll_seconds = round(time.monotonic() - checked_at, 3)
                 if is_live:
+                    self._event('poll', live=True, attempt=attempt, seconds=poll_seconds)
                     logger.info(f"User {self.user} đang livestream. Bắt đầu ghi hình.")
                     self._update_status("Đang ghi hình...", "green")
+                    self._on_go_live(attempt + 1)
+                    if attempt:
+                        record_live_start(self.user)
                     self.start_recording()
                     break 
                 else:
-                    wait_time = wait_intervals[min(interval_index, len(wait_intervals) - 1)]
+                    wait_time = next_poll_delay(self.user, attempt)
+                    self._event('poll', live=False, attempt=attempt, seconds=poll_seconds, next_delay=round(wait_time, 1))
                     wait_time_minutes = wait_time / 60
                     logger.info(f"User {self.user} không live, chờ {wait_time_minutes:.1f} phút.")
                     self._update_status(f"Chờ live ({wait_time_minutes:.1f}p)...", "orange")
-                    interval_index += 1
-                    self.stop_event.wait(wait_time)
+                    attempt += 1
+                    self._wait(wait_time)
             except Exception as e:
                 logger.error(f"Lỗi trong vòng lặp chờ của {self.user}: {e}")
                 self._update_status("Lỗi, đang thử lại...", "red")
-                self.stop_event.wait(300)
+                self._wait(POLL_ERROR_DELAY)
+
+    def _admit(self, user_dir):
+        """Kiểm tra dung lượng trống trước khi ghi; chọn chất lượng thấp hơn nếu ổ đĩa sắp đầy."""
+        admission = get_storage_manager().admit(user_dir, self.user)
+        if admission == ADMIT_REFUSE:
+            self._update_status("Ổ đĩa sắp đầy", "red")
+            raise RecordingException("Ổ đĩa sắp đầy, không bắt đầu ghi hình")
+        self.low_quality = admission == ADMIT_LOW
 
     def start_recording(self):
+        error = None
+        storage = get_storage_manager()
         try:
-            live_url = self.tiktok.get_live_url(self.room_id)
-            self.output_filepath = os.path.join(
-                self.get_user_dir(),
-                f"TK_{self.user}_{time.strftime('%Y%m%d_%H%M%S')}_flv.mp4"
+            user_dir = self.get_user_dir()
+            self._admit(user_dir)
+            live_url = self.tiktok.get_live_url(self.room_id, low_quality=self.low_quality)
+            self.session_basepath = os.path.join(
+                user_dir,
+                f"TK_{self.user}_{time.strftime('%Y%m%d_%H%M%S')}"
             )
+            # Chế độ remux trực tiếp ghi thẳng ra MP4, ngược lại ghi FLV thô rồi remux khi kết thúc
+            self.output_filepath = self.session_basepath + self._raw_suffix()
+            self.deadline = time.monotonic() + self.duration if self.duration else None
             logger.info(f"Bắt đầu ghi hình @{self.user}. Lưu vào: {os.path.basename(self.output_filepath)}")
-            self.fetch_stream(live_url, self.output_filepath)
+            self._track_metrics()
+            storage.register(self, self.output_filepath)
+            # Số lần thử kết nối lại liên tiếp không nhận được byte nào, dùng chung qua các lần mất stream
+            self.reconnect_failures = 0
+            while True:
+                received_before = self.bytes_received
+                try:
+                    if not self.fetch_stream(live_url, self.output_filepath):
+                        break
+                    reason = "stream kết thúc"
+                except StreamDisconnected as e:
+                    reason = str(e)
+                if self.bytes_received > received_before:
+                    self.reconnect_failures = 0
+                lost_at = time.monotonic()
+                get_metrics().inc('stream_disconnects_total')
+                live_url = self._reconnect(reason)
+                if not live_url:
+                    break
+                gap = time.monotonic() - lost_at
+                self.stream_gaps.append({'at': time.strftime('%H:%M:%S'), 'seconds': round(gap, 1), 'reason': reason})
+                logger.warning(f"Đã kết nối lại stream của @{self.user} sau {gap:.1f}s gián đoạn ({reason}).", extra={'recording_id': self.recording_id})
+                self._event('reconnect', gap=round(gap, 3), reason=reason, piece=len(self.stream_gaps))
+                self.output_filepath = self._start_new_piece(self.output_filepath)
         except LiveNotFound as e:
+            error = e
             logger.warning(f"Không thể bắt đầu ghi hình cho {self.user}: {e}")
+        except BaseException as e:
+            error = e
+            raise
         finally:
+            self._untrack_metrics()
+            storage.unregister(self)
+            self._on_stopped(error)
             if self.cancellation_requested:
                 logger.warning(f"Hủy bỏ được yêu cầu, xóa file tạm cho {self.user}.")
-                if self.output_filepath and os.path.exists(self.output_filepath):
-                    with suppress(OSError):
-                        os.remove(self.output_filepath)
-                        logger.info(f"Đã xóa thành công file tạm.")
+                self._discard_recording()
             else:
                 self.process_recorded_file(self.output_filepath)
 
+    def _reconnect(self, reason):
+        """Sau khi mất stream: nếu room vẫn live thì trả về URL mới để ghi tiếp vào cùng phiên, ngược lại None.
+
+        Mỗi lần thử (kể cả khi lấy được URL nhưng kết nối không nhận được dữ liệu) trừ vào cùng một
+        giới hạn RECONNECT_ATTEMPTS; giới hạn chỉ được đặt lại khi một phần ghi thực sự nhận được dữ liệu.
+        """
+        while self.reconnect_failures < RECONNECT_ATTEMPTS:
+            self.reconnect_failures += 1
+            attempt = self.reconnect_failures
+            delay = RECONNECT_DELAY * 2 ** (attempt - 1)
+            if self.stop_event.is_set() or (self.deadline and time.monotonic() > self.deadline):
+                return None
+            logger.info(f"Mất stream của @{self.user} ({reason}), thử kết nối lại lần {attempt}/{RECONNECT_ATTEMPTS}...")
+            self._update_status(f"Kết nối lại ({attempt}/{RECONNECT_ATTEMPTS})...", "orange")
+            self._wait(delay)
+            if self.stop_event.is_set():
+                return None
+            if not self.tiktok.is_room_alive(self.room_id):
+                logger.info(f"Room của @{self.user} không còn live, kết thúc phiên ghi hình.")
+                return None
+            try:
+                live_url = self.tiktok.get_live_url(self.room_id, low_quality=self.low_quality)
+            except (LiveNotFound, TikTokException) as e:
+                logger.warning(f"Chưa lấy được URL stream mới của @{self.user}: {e}")
+                continue
+            self._update_status("Đang ghi hình...", "green")
+            return live_url
+        logger.warning(f"Đã thử kết nối lại {RECONNECT_ATTEMPTS} lần mà không nhận được dữ liệu stream của @{self.user}, kết thúc phiên ghi hình.")
+        return None
+
+    def _next_piece_path(self):
+        self.piece_count += 1
+        return f"{self.session_basepath}_part{self.piece_count:03d}{self._raw_suffix()}"
+
+    def _start_new_piece(self, previous_path):
+        """Đưa phần vừa ghi vào hàng đợi như một segment và trả về đường dẫn cho phần tiếp theo.
+
+        Ở chế độ segment, SegmentedSink đã tự đóng và xếp hàng segment cuối khi đóng kết nối.
+        """
+        if not os.path.exists(previous_path):
+            return previous_path
+        if not self.is_segmented():
+            if not self.segments:
+                # Phần đầu tiên mang tên file cuối cùng: đổi tên để không trùng với file ghép
+                piece_path = self._next_piece_path()
+                os.replace(previous_path, piece_path)
+                with suppress(OSError):
+                    os.replace(keyframe_index_path(previous_path), keyframe_index_path(piece_path))
+                if previous_path in self.flv_stats:
+                    self.flv_stats[piece_path] = self.flv_stats.pop(previous_path)
+                previous_path = piece_path
+            self._on_segment_closed(previous_path)
+        return self._next_piece_path()
+
+    def _concat_at_end(self):
+        # Các phần sinh ra do kết nối lại luôn được ghép; segment chủ động thì theo cấu hình
+        return SEGMENT_CONCAT_AT_END or not self.is_segmented()
+
+    def _discard_recording(self):
+        paths = [self.output_filepath]
+        for segment_path, future in self.segments:
+            future.cancel()
+            with suppress(Exception):
+                paths.append(future.result())
+            paths.append(segment_path)
+        paths += [keyframe_index_path(path) for path in paths if path]
+        for path in paths:
+            if path and os.path.exists(path):
+                with suppress(OSError):
+                    os.remove(path)
+                    logger.info(f"Đã xóa thành công file tạm.")
+
+    def is_segmented(self):
+        return bool(self.segment_duration or self.segment_size)
+
+    def _raw_suffix(self):
+        return '.mp4' if self.live_remux else '_flv.mp4'
+
+    def _create_sink(self, output_file):
+        if self.live_remux:
+            sink_factory = FFmpegPipeSink
+        elif FLV_KEYFRAME_INDEX:
+            sink_factory = lambda path: FlvIndexingSink(path, on_closed=self._on_flv_closed)
+        else:
+            sink_factory = FileSink
+        if not self.is_segmented():
+            return sink_factory(output_file)
+        return SegmentedSink(
+            lambda index: self._next_piece_path(),
+            max_duration=self.segment_duration, max_size=self.segment_size,
+            on_segment_closed=self._on_segment_closed, sink_factory=sink_factory
+        )
+
+    def _on_flv_closed(self, path, stats):
+        self.flv_stats[path] = stats
+
+    def _has_media(self, path):
+        """Kiểm tra file ghi được có dữ liệu hình/tiếng thật hay không (thay cho ngưỡng kích thước)."""
+        if self.live_remux:
+            return os.path.getsize(path) > 1024
+        stats = self.flv_stats.get(path)
+        if stats is None:
+            # File không được phân tích khi ghi (vd. engine asyncio): đọc một lượt header qua mmap
+            try:
+                stats = scan_flv_file(path, FLV_GAP_THRESHOLD_MS)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Không phân tích được file {os.path.basename(path)}: {e}")
+                return os.path.getsize(path) > 1024
+            if stats.is_flv and FLV_KEYFRAME_INDEX:
+                with suppress(OSError):
+                    write_keyframe_index(path, stats)
+        if stats.is_flv is False:
+            return os.path.getsize(path) > 1024
+        summary = stats.summary()
+        logger.info(
+            f"File {os.path.basename(path)} của @{self.user}: {summary['duration']:.0f}s, "
+            f"{summary['keyframes']} keyframe, bitrate {summary['bitrates']}, {len(summary['gaps'])} gián đoạn",
+            extra={'recording_id': self.recording_id}
+        )
+        return stats.is_valid()
+
+    def _on_segment_closed(self, segment_path):
+        # Gọi từ luồng ghi: chỉ đưa segment vào hàng đợi xử lý, không chặn việc ghi segment tiếp theo
+        logger.info(f"Đã đóng segment {os.path.basename(segment_path)} của @{self.user}")
+        future = get_post_processor().submit(PRIORITY_REMUX, self._process_segment, segment_path)
+        self.segments.append((segment_path, future))
+
+    def _process_segment(self, segment_path):
+        if self.cancellation_requested or not os.path.exists(segment_path):
+            return None
+        if not self._has_media(segment_path):
+            for path in (segment_path, keyframe_index_path(segment_path)):
+                with suppress(OSError): os.remove(path)
+            return None
+        with_mp3 = self.convert_to_mp3 and not self._concat_at_end()
+        if self.live_remux:
+            mp4_file = segment_path
+            if with_mp3:
+                self._submit_mp3(mp4_file)
+        else:
+            mp4_file = segment_path.replace('_flv.mp4', '.mp4')
+            VideoManagement.convert_flv_to_mp4(segment_path, recording_id=self.recording_id, with_mp3=with_mp3)
+        return mp4_file if os.path.exists(mp4_file) else None
+
+    def _finish_segments(self):
+        mp4_files = []
+        for _, future in self.segments:
+            with suppress(Exception):
+                mp4_file = future.result()
+                if mp4_file: mp4_files.append(mp4_file)
+        if not mp4_files:
+            logger.warning(f"Không có segment hợp lệ nào của @{self.user}.")
+            return
+
+        if self.stream_gaps:
+            total_gap = sum(gap['seconds'] for gap in self.stream_gaps)
+            logger.info(f"Phiên ghi của @{self.user} bị gián đoạn {len(self.stream_gaps)} lần (tổng {total_gap:.1f}s): {self.stream_gaps}", extra={'recording_id': self.recording_id})
+        if self._concat_at_end():
+            final_file = self.session_basepath + '.mp4'
+            if len(mp4_files) == 1:
+                os.replace(mp4_files[0], final_file)
+                mp4_files = [final_file]
+                if self.convert_to_mp3:
+                    self._submit_mp3(final_file)
+            elif VideoManagement.concat_files(mp4_files, final_file, recording_id=self.recording_id, with_mp3=self.convert_to_mp3):
+                for mp4_file in mp4_files:
+                    with suppress(OSError): os.remove(mp4_file)
+                mp4_files = [final_file]
+            elif self.convert_to_mp3:
+                for mp4_file in mp4_files:
+                    self._submit_mp3(mp4_file)
+        self.final_video_path = mp4_files[-1]
+
     def fetch_stream(self, live_url, output_file):
-        start_time = time.time()
+        """Ghi stream vào output_file; trả về True nếu phía máy chủ đóng stream (có thể cần kết nối lại)."""
+        from requests import RequestException
+        from urllib3.exceptions import HTTPError as Urllib3HTTPError
+        writer = None
+        ended = None
+        received_before = self.bytes_received
+        self.piece_started_at = time.monotonic()
         try:
-            with self.tiktok.http_client.session.get(live_url, stream=True, timeout=10) as response:
+            with self.tiktok.http_client.stream_session.get(live_url, stream=True, timeout=10) as response:
                 response.raise_for_status()
-                with open(output_file, "wb") as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if self.stop_event.is_set():
-                            break
-                        if self.duration and (time.time() - start_time) > self.duration:
-                            logger.info(f"Đã đạt thời gian ghi hình {self.duration}s. Dừng lại.")
-                            break
-                        f.write(chunk)
-        except RequestException as e:
-            raise RecordingException(f"Lỗi kết nối khi tải stream: {e}")
+                response.raw.decode_content = True
+                writer = BufferedStreamWriter(self._create_sink(output_file), name=self.user)
+                self.stream_writer = writer
+                ended = self._receive_stream(response.raw, writer)
+        except (RequestException, Urllib3HTTPError) as e:
+            raise StreamDisconnected(f"Lỗi kết nối khi tải stream: {e}")
+        finally:
+            if writer:
+                writer.close()
+                self.stream_writer = None
+                self.bytes_written += writer.bytes_written
+            self._event(
+                'piece_end', piece=len(self.stream_gaps), seconds=round(time.monotonic() - self.piece_started_at, 3),
+                bytes_received=self.bytes_received - received_before,
+                bytes_written=writer.bytes_written if writer else 0, server_closed=bool(ended)
+            )
+            if writer and writer.error:
+                raise RecordingException(f"Lỗi ghi file ghi hình: {writer.error}")
+        return ended
+
+    def _receive_stream(self, raw, writer):
+        """Đọc stream theo từng phần đã có sẵn trên socket vào các block của ring buffer, luồng ghi riêng đưa xuống đĩa.
+
+        Mỗi lần đọc tối đa STREAM_READ_SIZE và không chờ đầy block, nên Dừng và last_chunk_at phản hồi
+        theo từng gói nhận được kể cả với stream bitrate thấp.
+        Trả về True nếu stream bị đóng từ phía máy chủ, False nếu dừng theo yêu cầu hoặc hết thời gian.
+        """
+        deadline = self.deadline
+        first_byte = True
+        # urllib3 2.x: read1 trả về ngay phần dữ liệu có sẵn thay vì chờ đủ amt byte
+        read_chunk = getattr(raw, 'read1', None) or raw.read
+        while not self.stop_event.is_set():
+            block = writer.acquire()
+            view = memoryview(block)
+            filled = 0
+            read = 1
+            while filled < len(block) and not self.stop_event.is_set():
+                data = read_chunk(min(STREAM_READ_SIZE, len(block) - filled))
+                read = len(data)
+                if not read: break
+                if first_byte:
+                    first_byte = False
+                    self._on_first_byte(read)
+                view[filled:filled + read] = data
+                filled += read
+                self.bytes_received += read
+                self.last_chunk_at = time.monotonic()
+                if deadline and time.monotonic() > deadline: break
+            view.release()
+            writer.commit(block, filled)
+            if not read:
+                logger.info(f"Stream của {self.user} đã kết thúc.")
+                return True
+            if deadline and time.monotonic() > deadline:
+                logger.info(f"Đã đạt thời gian ghi hình {self.duration}s. Dừng lại.")
+                break
+        return False
+
+    def get_buffer_stats(self):
+        """Mức đầy của bộ đệm ghi (để theo dõi back-pressure), hoặc None nếu chưa ghi hình."""
+        writer = self.stream_writer
+        return writer.stats() if writer else None
+
+    def get_bytes_written(self):
+        """Tổng số byte của phiên đã xuống đĩa, kể cả phần của bộ đệm ghi đang mở."""
+        buffer_stats = self.get_buffer_stats()
+        return self.bytes_written + (buffer_stats['bytes_written'] if buffer_stats else 0)
+
+    def _track_metrics(self):
+        get_metrics().register_collector(('recorder', id(self)), self.collect_metrics)
+
+    def _untrack_metrics(self):
+        get_metrics().unregister_collector(('recorder', id(self)))
+
+    def collect_metrics(self):
+        """Số liệu của phiên đang ghi: byte nhận từ mạng/đã xuống đĩa, tốc độ, độ trễ chunk, số lần kết nối lại."""
+        labels = {'user': self.user}
+        buffer_stats = self.get_buffer_stats()
+        samples = [
+            ('recording_bytes_received_total', labels, self.bytes_received),
+            ('recording_bytes_written_total', labels, self.get_bytes_written()),
+            ('recording_bytes_per_second', labels, round(self.byte_rate.update(self.bytes_received))),
+            ('recording_reconnects_total', labels, len(self.stream_gaps)),
+        ]
+        if self.last_chunk_at is not None:
+            samples.append(('recording_seconds_since_last_chunk', labels, round(time.monotonic() - self.last_chunk_at, 3)))
+        if buffer_stats:
+            samples.append(('recording_buffer_fill_ratio', labels, round(buffer_stats['fill_ratio'], 3)))
+            samples.append(('recording_buffer_stalls_total', labels, buffer_stats['stalls']))
+        return samples
 
     def process_recorded_file(self, file_path):
-        if file_path and os.path.exists(file_path):
-            if os.path.getsize(file_path) > 1024:
-                mp4_file = file_path.replace('_flv.mp4', '.mp4')
-                VideoManagement.convert_flv_to_mp4(file_path, recording_id=self.recording_id)
+        """Đưa file vừa ghi vào hàng đợi hậu xử lý và trả về ngay, luồng ghi hình được giải phóng.
+
+        Kết quả (final_video_path) có khi self.post_process_future hoàn tất.
+        """
+        if self.segments and not self.is_segmented() and file_path:
+            # Phần cuối của phiên đã kết nối lại: xử lý như segment rồi ghép với các phần trước
+            self._start_new_piece(file_path)
+        if self.segments:
+            futures = [future for _, future in self.segments]
+            self.post_process_future = get_post_processor().submit_after(futures, PRIORITY_REMUX, self._finish_segments)
+        elif file_path and os.path.exists(file_path):
+            self.post_process_future = get_post_processor().submit(PRIORITY_REMUX, self._process_file, file_path)
+
+    def _submit_mp3(self, mp4_file):
+        get_post_processor().submit_followup(PRIORITY_MP3, VideoManagement.convert_mp4_to_mp3, mp4_file, recording_id=self.recording_id)
+
+    def _process_file(self, file_path):
+        if os.path.exists(file_path):
+            if self._has_media(file_path):
+                if self.live_remux:
+                    mp4_file = file_path
+                    if self.convert_to_mp3:
+                        self._submit_mp3(mp4_file)
+                else:
+                    mp4_file = file_path.replace('_flv.mp4', '.mp4')
+                    VideoManagement.convert_flv_to_mp4(file_path, recording_id=self.recording_id, with_mp3=self.convert_to_mp3)
                 self.final_video_path = mp4_file # <-- LƯU LẠI ĐƯỜNG DẪN MP4
-                if self.convert_to_mp3 and os.path.exists(mp4_file):
-                    VideoManagement.convert_mp4_to_mp3(mp4_file, recording_id=self.recording_id)
             else:
-                os.remove(file_path)
-                logger.warning(f"File ghi hình của @{self.user} rỗng hoặc quá nhỏ, đã xóa.")
+                for path in (file_path, keyframe_index_path(file_path)):
+                    with suppress(OSError): os.remove(path)
+                logger.warning(f"File ghi hình của @{self.user} không có dữ liệu hình/tiếng hợp lệ, đã xóa.")
         
     def stop(self):
         logger.info(f"Đã gửi tín hiệu Dừng & Lưu cho recorder của {self.user}")
         self.stop_event.set()
+        self.wake_event.set()
+        if self.scheduler:
+            self.scheduler.wake(self)
 
     def cancel(self):
         logger.warning(f"Đã gửi tín hiệu Hủy & Xóa cho recorder của {self.user}")
         self.cancellation_requested = True
         self.stop_event.set()
+        self.wake_event.set()
+        if self.scheduler:
+            self.scheduler.wake(self)
 
     def get_user_dir(self):
         if hasattr(sys, '_MEIPASS'):
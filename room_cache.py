@@ -0,0 +1,91 @@
+import os
+import sys
+import json
+import time
+import threading
+
+from logger_setup import logger
+from config import ROOM_ID_CACHE_TTL, ROOM_ID_CACHE_FILE
+
+class RoomIdCache:
+    """Cache username -> RoomID lưu trên đĩa, có TTL.
+
+    Tránh phải tải lại trang /@user/live mỗi lần khởi động hoặc thêm lại user.
+    """
+    def __init__(self, path=None, ttl=ROOM_ID_CACHE_TTL):
+        if path is None:
+            if hasattr(sys, '_MEIPASS'):
+                base_path = os.path.dirname(sys.executable)
+            else:
+                base_path = os.path.dirname(os.path.abspath(__file__))
+            path = os.path.join(base_path, ROOM_ID_CACHE_FILE)
+        self.path = os.path.normpath(path)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            if isinstance(entries, dict):
+                return entries
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Không đọc được cache RoomID, tạo mới: {e}")
+        return {}
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Không ghi được cache RoomID: {e}")
+
+    def get(self, user):
+        with self.lock:
+            entry = self.entries.get(user)
+            if not entry: return None
+            if time.time() - entry.get('resolved_at', 0) > self.ttl:
+                del self.entries[user]
+                self._save()
+                return None
+            return entry.get('room_id')
+
+    def set(self, user, room_id):
+        with self.lock:
+            self.entries[user] = {'room_id': str(room_id), 'resolved_at': time.time()}
+            self._save()
+
+    def invalidate(self, user):
+        with self.lock:
+            if self.entries.pop(user, None) is not None:
+                self._save()
+
+    def invalidate_room(self, room_id):
+        """Xóa mọi user đang trỏ tới room_id (room không tồn tại hoặc đã kết thúc)."""
+        room_id = str(room_id)
+        with self.lock:
+            users = [user for user, entry in self.entries.items() if entry.get('room_id') == room_id]
+            for user in users:
+                del self.entries[user]
+            if users:
+                self._save()
+                logger.debug(f"Đã hủy cache RoomID {room_id} của: {', '.join(users)}")
+            return users
+
+_room_id_cache = None
+_room_id_cache_lock = threading.Lock()
+
+def get_room_id_cache():
+    """Trả về cache RoomID dùng chung cho cả tiến trình, hoặc None nếu đã tắt (TTL <= 0)."""
+    global _room_id_cache
+    if ROOM_ID_CACHE_TTL <= 0:
+        return None
+    with _room_id_cache_lock:
+        if _room_id_cache is None:
+            _room_id_cache = RoomIdCache()
+        return _room_id_cache
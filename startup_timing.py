@@ -0,0 +1,25 @@
+import time
+
+_started_at = time.perf_counter()
+_marks = []
+
+def mark(name):
+    """Ghi lại mốc thời gian của một bước khởi động (tính từ lúc import module này)."""
+    _marks.append((name, time.perf_counter()))
+
+def report(logger):
+    """Ghi thời gian từng bước khởi động vào log để so sánh giữa các phiên bản."""
+    parts = []
+    previous = _started_at
+    for name, at in _marks:
+        parts.append(f"{name} {(at - previous) * 1000:.0f}ms")
+        previous = at
+    total = (previous - _started_at) * 1000
+    try:
+        # Thời gian trước khi Python chạy tới đây (giải nén bản đóng gói, khởi tạo trình thông dịch)
+        import psutil
+        before = (time.time() - psutil.Process().create_time()) * 1000 - (time.perf_counter() - _started_at) * 1000
+        parts.insert(0, f"trình thông dịch {max(before, 0):.0f}ms")
+    except Exception:
+        pass
+    logger.info(f"Hoàn tất khởi động sau {total:.0f}ms: {', '.join(parts)}")
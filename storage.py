@@ -0,0 +1,246 @@
+import os
+import shutil
+import threading
+import time
+
+from logger_setup import logger
+from config import (
+    STORAGE_MIN_FREE_MB, STORAGE_CRITICAL_MB, STORAGE_LOW_HOURS, STORAGE_DEFAULT_BITRATE_KBPS,
+    STORAGE_CHECK_INTERVAL, RETENTION_MAX_AGE_DAYS, RETENTION_MAX_USER_GB, RETENTION_KEEP_MP3_ONLY,
+    RETENTION_INTERVAL_MINUTES, RETENTION_MIN_AGE_MINUTES
+)
+from metrics import get_metrics
+
+# Kết quả kiểm tra trước khi bắt đầu ghi hình
+ADMIT_OK = "ok"
+ADMIT_LOW = "low"          # Còn chỗ nhưng sắp đầy: ghi ở chất lượng thấp hơn
+ADMIT_REFUSE = "refuse"    # Dưới mức tối thiểu: không bắt đầu phiên mới
+
+MB = 1024 * 1024
+RETENTION_EXTENSIONS = ('.mp4', '.mp3', '.flv', '.idx.json')
+
+class ActiveStream:
+    """Tốc độ ghi ước lượng của một phiên đang ghi, lấy mẫu bởi luồng theo dõi của StorageManager."""
+    __slots__ = ('recorder', 'path', 'device', 'started_at', 'last_bytes', 'last_time', 'rate')
+
+    def __init__(self, recorder, path):
+        self.recorder = recorder
+        # File output chưa tồn tại lúc đăng ký (và đổi tên thành _partNNN khi ghi nhiều phần), nên theo dõi thư mục chứa nó
+        self.path = os.path.dirname(os.path.abspath(path))
+        self.device = _device_of(self.path)
+        self.started_at = time.monotonic()
+        self.last_bytes = recorder.bytes_received
+        self.last_time = self.started_at
+        self.rate = 0.0
+
+    def sample(self, now):
+        received = self.recorder.bytes_received
+        if now > self.last_time:
+            self.rate = (received - self.last_bytes) / (now - self.last_time)
+        self.last_bytes, self.last_time = received, now
+
+class StorageManager:
+    """Theo dõi dung lượng trống của thư mục lưu trong lúc ghi hình.
+
+    Ước lượng tốc độ ghi của từng phiên để dự đoán thời gian tới khi đầy đĩa: phiên mới
+    bị từ chối dưới STORAGE_MIN_FREE_MB hoặc chuyển sang chất lượng thấp khi dự đoán đầy
+    trong STORAGE_LOW_HOURS. Khi dung lượng xuống dưới STORAGE_CRITICAL_MB, phiên bắt đầu
+    gần nhất được dừng (vẫn lưu file) để các phiên còn lại không cùng bị hỏng. Luồng nền
+    cũng dọn thư mục Output/<user> theo chính sách lưu giữ trong config.
+    """
+    def __init__(self, check_interval=STORAGE_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.streams = {}      # recorder -> ActiveStream
+        self.user_dirs = {}    # Thư mục user đã ghi hình -> user, chỉ các thư mục này được dọn theo chính sách lưu giữ
+        self.last_prune = time.monotonic()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="StorageManager", daemon=True)
+        self.thread.start()
+        get_metrics().register_collector('storage', self.collect_metrics)
+
+    @staticmethod
+    def free_bytes(path):
+        try:
+            return shutil.disk_usage(path).free
+        except OSError as e:
+            logger.warning(f"Không đọc được dung lượng trống của {path}: {e}")
+            return None
+
+    def _write_rate(self, path, extra_streams=0):
+        """Tổng tốc độ ghi (byte/giây) vào ổ đĩa chứa path, tính thêm extra_streams phiên sắp bắt đầu."""
+        device = _device_of(path)
+        with self.lock:
+            rates = [stream.rate for stream in self.streams.values() if stream.device == device]
+        estimate = max(rates) if rates else STORAGE_DEFAULT_BITRATE_KBPS * 1000 / 8
+        return sum(rates) + extra_streams * estimate
+
+    def seconds_until_full(self, path, extra_streams=0):
+        free = self.free_bytes(path)
+        rate = self._write_rate(path, extra_streams)
+        if free is None or rate <= 0:
+            return None
+        return max(0.0, free - STORAGE_CRITICAL_MB * MB) / rate
+
+    def admit(self, path, user=None):
+        """Kiểm tra trước khi bắt đầu ghi vào thư mục path của user: ADMIT_OK, ADMIT_LOW hoặc ADMIT_REFUSE."""
+        if user:
+            with self.lock:
+                self.user_dirs[os.path.normpath(path)] = user
+        free = self.free_bytes(path)
+        if free is None:
+            return ADMIT_OK
+        if free < STORAGE_MIN_FREE_MB * MB:
+            logger.error(f"Ổ đĩa chỉ còn {free / MB:.0f} MB trống (tối thiểu {STORAGE_MIN_FREE_MB} MB), không bắt đầu ghi hình mới.")
+            get_metrics().inc('storage_admission_total', result=ADMIT_REFUSE)
+            return ADMIT_REFUSE
+        remaining = self.seconds_until_full(path, extra_streams=1)
+        if remaining is not None and remaining < STORAGE_LOW_HOURS * 3600:
+            logger.warning(f"Dự đoán ổ đĩa đầy sau {remaining / 60:.0f} phút, ghi phiên mới ở chất lượng thấp hơn.")
+            get_metrics().inc('storage_admission_total', result=ADMIT_LOW)
+            return ADMIT_LOW
+        get_metrics().inc('storage_admission_total', result=ADMIT_OK)
+        return ADMIT_OK
+
+    def register(self, recorder, path):
+        with self.lock:
+            self.streams[recorder] = ActiveStream(recorder, path)
+
+    def unregister(self, recorder):
+        with self.lock:
+            self.streams.pop(recorder, None)
+
+    def collect_metrics(self):
+        with self.lock:
+            paths = {stream.device: stream.path for stream in self.streams.values()}
+        samples = []
+        for device, path in paths.items():
+            free = self.free_bytes(path)
+            if free is not None:
+                samples.append(('storage_free_bytes', {'device': device}, free))
+            remaining = self.seconds_until_full(path)
+            if remaining is not None:
+                samples.append(('storage_seconds_until_full', {'device': device}, round(remaining)))
+        return samples
+
+    def _run(self):
+        while not self.stop_event.wait(self.check_interval):
+            try:
+                self._check_streams()
+                if RETENTION_INTERVAL_MINUTES and time.monotonic() - self.last_prune >= RETENTION_INTERVAL_MINUTES * 60:
+                    self.last_prune = time.monotonic()
+                    self.prune()
+            except Exception as e:
+                logger.error(f"Lỗi trong luồng theo dõi dung lượng: {e}")
+
+    def _check_streams(self):
+        now = time.monotonic()
+        with self.lock:
+            streams = list(self.streams.values())
+        for stream in streams:
+            stream.sample(now)
+        by_device = {}
+        for stream in streams:
+            by_device.setdefault(stream.device, []).append(stream)
+        for device_streams in by_device.values():
+            free = self.free_bytes(device_streams[0].path)
+            if free is None or free >= STORAGE_CRITICAL_MB * MB:
+                continue
+            # Dừng phiên mới nhất trước, mỗi lần kiểm tra một phiên, cho tới khi dung lượng ổn định
+            newest = max((stream for stream in device_streams if not stream.recorder.stop_event.is_set()),
+                         key=lambda stream: stream.started_at, default=None)
+            if newest:
+                logger.error(f"Ổ đĩa chỉ còn {free / MB:.0f} MB trống, dừng và lưu phiên ghi hình của {newest.recorder.user}.")
+                get_metrics().inc('storage_forced_stops_total')
+                newest.recorder.stop()
+
+    def prune(self):
+        """Dọn các thư mục user theo chính sách lưu giữ (tuổi file, dung lượng mỗi user, chỉ giữ MP3).
+
+        Chỉ xét file do recorder tạo (TK_<user>_*) trong các thư mục đã qua admit(), không đụng tới
+        file khác của người dùng trong thư mục đầu ra tùy chỉnh.
+        """
+        if not (RETENTION_MAX_AGE_DAYS or RETENTION_MAX_USER_GB or RETENTION_KEEP_MP3_ONLY):
+            return
+        with self.lock:
+            active = [stream.recorder.session_basepath for stream in self.streams.values() if stream.recorder.session_basepath]
+            user_dirs = list(self.user_dirs.items())
+        removed = freed = 0
+        for user_dir, user in user_dirs:
+            count, size = self._prune_user_dir(user_dir, user, active)
+            removed += count
+            freed += size
+        if removed:
+            logger.info(f"Chính sách lưu giữ: đã xóa {removed} file, giải phóng {freed / MB:.0f} MB.")
+            get_metrics().inc('storage_pruned_files_total', removed)
+
+    def _prune_user_dir(self, user_dir, user, active):
+        now = time.time()
+        prefix = f"TK_{user}_"
+        files = []
+        try:
+            for entry in os.scandir(user_dir):
+                if not entry.is_file() or not entry.name.startswith(prefix) or not entry.name.endswith(RETENTION_EXTENSIONS): continue
+                if any(entry.path.startswith(basepath) for basepath in active): continue
+                stat = entry.stat()
+                # Không đụng tới file vừa ghi/đang hậu xử lý
+                if now - stat.st_mtime < RETENTION_MIN_AGE_MINUTES * 60: continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError as e:
+            logger.warning(f"Không đọc được thư mục {user_dir}: {e}")
+            return 0, 0
+        files.sort()
+
+        doomed = set()
+        if RETENTION_MAX_AGE_DAYS:
+            doomed.update(path for mtime, _, path in files if now - mtime > RETENTION_MAX_AGE_DAYS * 86400)
+        if RETENTION_KEEP_MP3_ONLY:
+            names = {path for _, _, path in files}
+            doomed.update(path for path in names if path.endswith('.mp4') and os.path.splitext(path)[0] + '.mp3' in names)
+        if RETENTION_MAX_USER_GB:
+            total = sum(size for _, size, path in files if path not in doomed)
+            for _, size, path in files:
+                if total <= RETENTION_MAX_USER_GB * 1024 * MB: break
+                if path not in doomed:
+                    doomed.add(path)
+                    total -= size
+
+        removed = freed = 0
+        sizes = {path: size for _, size, path in files}
+        for path in doomed:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Không xóa được {os.path.basename(path)}: {e}")
+                continue
+            removed += 1
+            freed += sizes[path]
+        return removed, freed
+
+    def shutdown(self):
+        self.stop_event.set()
+        get_metrics().unregister_collector('storage')
+
+def _device_of(path):
+    """Khóa nhận diện ổ đĩa chứa thư mục path (st_dev), hoặc chính path nếu không đọc được."""
+    try:
+        return str(os.stat(path).st_dev)
+    except OSError:
+        return path
+
+_storage_manager = None
+_storage_manager_lock = threading.Lock()
+
+def get_storage_manager():
+    global _storage_manager
+    with _storage_manager_lock:
+        if _storage_manager is None:
+            _storage_manager = StorageManager()
+        return _storage_manager
+
+def shutdown_storage_manager():
+    global _storage_manager
+    with _storage_manager_lock:
+        if _storage_manager is not None:
+            _storage_manager.shutdown()
+            _storage_manager = None
@@ -0,0 +1,294 @@
+import os
+import queue
+import subprocess
+import threading
+import time
+from collections import deque
+
+from logger_setup import logger
+from config import STREAM_BUFFER_SIZE, STREAM_BLOCK_SIZE, STREAM_BUFFER_WARN_RATIO, FLV_GAP_THRESHOLD_MS
+from flv_utils import parse_flv_header, iter_tags, TAG_SCRIPT, FlvStats, write_keyframe_index
+from ffmpeg_locator import NO_WINDOW_FLAGS, get_ffmpeg_path
+
+class FileSink:
+    """Đích ghi đơn giản: toàn bộ dữ liệu vào một file trên đĩa."""
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "wb", buffering=0)
+
+    def write(self, data):
+        self.file.write(data)
+
+    def close(self):
+        self.file.close()
+
+class FlvIndexingSink(FileSink):
+    """FileSink đồng thời đọc header các tag FLV để thống kê và lập chỉ mục keyframe.
+
+    Khi đóng, chỉ mục được ghi ra file .idx.json và on_closed(path, stats) được gọi.
+    """
+    def __init__(self, path, on_closed=None):
+        super().__init__(path)
+        self.stats = FlvStats(FLV_GAP_THRESHOLD_MS)
+        self.on_closed = on_closed
+
+    def write(self, data):
+        self.file.write(data)
+        self.stats.feed(data)
+
+    def close(self):
+        super().close()
+        if self.stats.is_flv:
+            try:
+                write_keyframe_index(self.path, self.stats)
+            except OSError as e:
+                logger.warning(f"Không ghi được chỉ mục keyframe cho {os.path.basename(self.path)}: {e}")
+        if self.on_closed:
+            self.on_closed(self.path, self.stats)
+
+class FFmpegPipeSink:
+    """Đẩy stream FLV vào stdin của một tiến trình FFmpeg chạy suốt phiên, xuất thẳng MP4 phân mảnh.
+
+    File MP4 xem được ngay trong lúc ghi và không cần bước remux sau khi dừng.
+    """
+    def __init__(self, path):
+        self.path = path
+        ffmpeg_path = get_ffmpeg_path()
+        cmd = [
+            ffmpeg_path, "-hide_banner", "-loglevel", "error",
+            "-f", "flv", "-i", "pipe:0",
+            "-c", "copy", "-f", "mp4", "-movflags", "+frag_keyframe+empty_moov+default_base_moof",
+            "-y", path
+        ]
+        self.process = subprocess.Popen(
+            cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, bufsize=0,
+            creationflags=NO_WINDOW_FLAGS
+        )
+        self.stderr_tail = deque(maxlen=20)
+        self.stderr_thread = threading.Thread(target=self._drain_stderr, daemon=True)
+        self.stderr_thread.start()
+
+    def _drain_stderr(self):
+        for line in self.process.stderr:
+            self.stderr_tail.append(line.decode('utf-8', errors='ignore').strip())
+
+    def write(self, data):
+        try:
+            self.process.stdin.write(data)
+        except OSError as e:
+            raise OSError(f"FFmpeg đã dừng khi đang ghi: {' | '.join(self.stderr_tail) or e}")
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        returncode = self.process.wait()
+        self.stderr_thread.join(timeout=5)
+        if returncode != 0:
+            raise OSError(f"FFmpeg kết thúc với mã {returncode}: {' | '.join(self.stderr_tail)}")
+
+class SegmentedSink:
+    """Ghi stream FLV thành nhiều segment, chỉ cắt tại keyframe video.
+
+    Mỗi segment mới được mở đầu bằng header FLV, tag metadata và các sequence
+    header đã gặp nên có thể remux độc lập. on_segment_closed(path) được gọi ngay
+    khi một segment đóng lại (kể cả segment cuối khi close()).
+    """
+    def __init__(self, path_factory, max_duration=None, max_size=None, on_segment_closed=None, sink_factory=FileSink):
+        self.path_factory = path_factory
+        self.max_duration_ms = max_duration * 1000 if max_duration else None
+        self.max_size = max_size
+        self.on_segment_closed = on_segment_closed
+        self.sink_factory = sink_factory
+
+        self.segment_paths = []
+        self.current = None
+        self.segment_bytes = 0
+        self.segment_start_ts = None
+        self.carry = bytearray()
+        self.flv_header = None
+        self.script_tag = None
+        self.sequence_headers = {}
+        self.passthrough = False
+
+    def _open_segment(self):
+        path = self.path_factory(len(self.segment_paths) + 1)
+        self.current = self.sink_factory(path)
+        self.segment_paths.append(path)
+        self.segment_bytes = 0
+        self.segment_start_ts = None
+        prefix = [self.flv_header] if self.flv_header else []
+        if self.segment_paths[1:]:
+            if self.script_tag: prefix.append(self.script_tag)
+            prefix.extend(self.sequence_headers.values())
+        for data in prefix:
+            self._write_current(data)
+
+    def _close_segment(self):
+        if self.current is None: return
+        self.current.close()
+        self.current = None
+        if self.on_segment_closed:
+            self.on_segment_closed(self.segment_paths[-1])
+
+    def _write_current(self, data):
+        self.current.write(data)
+        self.segment_bytes += len(data)
+
+    def _should_rotate(self, timestamp):
+        if self.segment_start_ts is None: return False
+        if self.max_duration_ms and timestamp - self.segment_start_ts >= self.max_duration_ms: return True
+        return bool(self.max_size and self.segment_bytes >= self.max_size)
+
+    def write(self, data):
+        if self.passthrough:
+            self._write_current(data)
+            return
+        if self.carry:
+            self.carry += data
+            buf = self.carry
+        else:
+            buf = data
+
+        position = 0
+        if self.flv_header is None:
+            try:
+                position = parse_flv_header(buf)
+            except ValueError:
+                logger.warning("Stream không phải FLV, ghi liên tục vào một file không chia segment")
+                self.passthrough = True
+                if self.current is None: self._open_segment()
+                self._write_current(buf)
+                self.carry = bytearray()
+                return
+            if position is None:
+                self.carry = bytearray(buf)
+                return
+            self.flv_header = bytes(buf[:position])
+            self._open_segment()
+            self.segment_bytes = 0
+
+        run_start = position
+        for tag in iter_tags(buf, position):
+            if tag.type == TAG_SCRIPT and self.script_tag is None:
+                self.script_tag = bytes(buf[tag.offset:tag.end])
+            elif tag.is_sequence_header:
+                self.sequence_headers[tag.type] = bytes(buf[tag.offset:tag.end])
+            elif tag.is_keyframe and self._should_rotate(tag.timestamp):
+                self._write_current(buf[run_start:tag.offset])
+                self._close_segment()
+                self._open_segment()
+                run_start = tag.offset
+            if self.segment_start_ts is None:
+                self.segment_start_ts = tag.timestamp
+            position = tag.end
+
+        if position > run_start:
+            self._write_current(buf[run_start:position])
+        self.carry = bytearray(buf[position:])
+
+    def close(self):
+        if self.carry and self.current is not None:
+            # Tag cuối bị cắt dở vẫn được ghi để không mất dữ liệu, FFmpeg sẽ bỏ qua phần hỏng
+            self._write_current(self.carry)
+            self.carry = bytearray()
+        self._close_segment()
+
+class BufferedStreamWriter:
+    """Ring buffer gồm các block cấp phát sẵn giữa luồng nhận mạng và luồng ghi đĩa.
+
+    Luồng nhận lấy block trống bằng acquire(), chép dần các lần đọc socket vào block rồi
+    commit(); luồng ghi riêng ghi cả block một lần và trả block về vòng. Khi đĩa
+    chậm, acquire() chờ block trống (back-pressure) thay vì làm chậm từng lần đọc socket.
+    """
+    def __init__(self, sink, buffer_size=STREAM_BUFFER_SIZE, block_size=STREAM_BLOCK_SIZE, name=""):
+        self.sink = sink
+        self.name = name
+        self.block_size = block_size
+        self.block_count = max(2, buffer_size // block_size)
+        self.free_blocks = queue.Queue()
+        self.filled_blocks = queue.Queue()
+        for _ in range(self.block_count):
+            self.free_blocks.put(bytearray(block_size))
+
+        self.bytes_written = 0
+        self.high_water = 0
+        self.stalls = 0
+        self.error = None
+        self.last_warning = 0.0
+        self.thread = threading.Thread(target=self._write_loop, name=f"StreamWriter-{name}", daemon=True)
+        self.thread.start()
+
+    def acquire(self):
+        if self.error:
+            raise self.error
+        try:
+            return self.free_blocks.get_nowait()
+        except queue.Empty:
+            self.stalls += 1
+        # Chờ có thời hạn để không treo luồng nhận nếu luồng ghi đã gặp lỗi hoặc đã dừng
+        while True:
+            try:
+                return self.free_blocks.get(timeout=1)
+            except queue.Empty:
+                if self.error:
+                    raise self.error
+                if not self.thread.is_alive():
+                    raise OSError(f"Luồng ghi của {self.name} đã dừng")
+
+    def commit(self, block, length):
+        if not length:
+            self.free_blocks.put(block)
+            return
+        self.filled_blocks.put((block, length))
+        pending = self.filled_blocks.qsize()
+        if pending > self.high_water:
+            self.high_water = pending
+        if pending / self.block_count >= STREAM_BUFFER_WARN_RATIO:
+            now = time.monotonic()
+            if now - self.last_warning > 30:
+                self.last_warning = now
+                logger.warning(f"Bộ đệm ghi của {self.name} đầy {self.fill_ratio():.0%}, ổ đĩa ghi chậm hơn tốc độ stream")
+
+    def fill_ratio(self):
+        return self.filled_blocks.qsize() / self.block_count
+
+    def stats(self):
+        return {
+            'fill_ratio': self.fill_ratio(),
+            'high_water_ratio': self.high_water / self.block_count,
+            'buffer_size': self.block_count * self.block_size,
+            'bytes_written': self.bytes_written,
+            'stalls': self.stalls,
+        }
+
+    def _write_loop(self):
+        while True:
+            item = self.filled_blocks.get()
+            if item is None:
+                break
+            block, length = item
+            try:
+                if self.error is None:
+                    self.sink.write(memoryview(block)[:length])
+                    self.bytes_written += length
+            except Exception as e:
+                # Kể cả lỗi từ callback của sink (vd. xếp hàng segment), để luồng nhận không chờ block mãi
+                self.error = e
+                logger.error(f"Lỗi ghi dữ liệu stream của {self.name}: {e}")
+            finally:
+                self.free_blocks.put(block)
+
+    def close(self):
+        """Ghi nốt các block còn lại và đóng sink. Lỗi ghi (nếu có) nằm trong self.error."""
+        self.filled_blocks.put(None)
+        self.thread.join()
+        try:
+            self.sink.close()
+        except Exception as e:
+            self.error = self.error or e
+        logger.debug(
+            f"Đóng bộ đệm ghi của {self.name}: {self.bytes_written} bytes, "
+            f"đầy tối đa {self.high_water}/{self.block_count} block, {self.stalls} lần chờ"
+        )
@@ -1,4 +1,9 @@
 import tkinter as tk
+import threading
+import time
+
+from logger_setup import logger
+from config import UI_FRAME_MS
 
 class ToolTip:
     """
@@ -55,4 +60,101 @@ def center_dialog(dialog):
     dialog_height = dialog.winfo_height()
     x = parent_x + (parent_width - dialog_width) // 2
     y = parent_y + (parent_height - dialog_height) // 2
-    dialog.geometry(f"+{x}+{y}")
\ No newline at end of file
+    dialog.geometry(f"+{x}+{y}")
+
+class UiUpdater:
+    """
+    Đưa cập nhật giao diện từ mọi luồng về luồng Tk.
+
+    Cập nhật có khóa (vd. trạng thái của một hàng) được gộp, chỉ bản mới nhất được
+    áp dụng; mọi cập nhật đang chờ được áp dụng cùng lúc, tối đa một lần mỗi khung
+    hình. Lần áp dụng chỉ được lên lịch khi có cập nhật mới (không có nhịp kiểm tra
+    định kỳ): luồng Tk lên lịch trực tiếp, luồng nền đánh thức luồng Tk bằng một sự
+    kiện ảo đặt cuối hàng đợi, và chỉ một lần cho mỗi lượt áp dụng đang chờ.
+    """
+    WAKE_EVENT = "<<UiUpdaterWake>>"
+
+    def __init__(self, root, frame_ms=UI_FRAME_MS):
+        self.root = root
+        self.frame_ms = frame_ms
+        self.tk_thread = threading.current_thread()
+        self.lock = threading.Lock()
+        self.latest = {}      # khóa -> callback mới nhất
+        self.callbacks = []   # callback không gộp (hộp thoại, dọn hàng...), chạy theo thứ tự
+        self.after_id = None
+        self.flush_pending = False   # Đã có một lượt áp dụng được lên lịch hoặc đang chờ đánh thức
+        self.wakeups = 0             # Số luồng nền đang gửi sự kiện đánh thức
+        self.last_flush = 0.0
+        self.is_running = True
+        root.bind(self.WAKE_EVENT, self._on_wake)
+
+    def set(self, key, callback):
+        """Thay cập nhật đang chờ của key bằng callback."""
+        with self.lock:
+            self.latest[key] = callback
+        self._request()
+
+    def call(self, callback):
+        """Chạy callback trên luồng Tk ở lần áp dụng kế tiếp."""
+        with self.lock:
+            self.callbacks.append(callback)
+        self._request()
+
+    def _request(self):
+        with self.lock:
+            if self.flush_pending or not self.is_running:
+                return
+            self.flush_pending = True
+            from_worker = threading.current_thread() is not self.tk_thread
+            if from_worker:
+                self.wakeups += 1
+        if not from_worker:
+            self._schedule_flush()
+            return
+        try:
+            self.root.event_generate(self.WAKE_EVENT, when="tail")
+        except (tk.TclError, RuntimeError) as e:
+            logger.debug(f"Không đánh thức được luồng giao diện: {e}")
+            with self.lock:
+                self.flush_pending = False
+        finally:
+            with self.lock:
+                self.wakeups -= 1
+
+    def _on_wake(self, event=None):
+        if self.is_running:
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        elapsed_ms = (time.monotonic() - self.last_flush) * 1000
+        self.after_id = self.root.after(max(0, int(self.frame_ms - elapsed_ms)), self._flush)
+
+    def _flush(self):
+        self.after_id = None
+        with self.lock:
+            latest, self.latest = self.latest, {}
+            callbacks, self.callbacks = self.callbacks, []
+            # Cập nhật đến sau thời điểm này sẽ lên lịch một lượt mới (cách lượt này ít nhất một khung hình)
+            self.flush_pending = False
+        pending = callbacks + list(latest.values())
+        if pending:
+            self.last_flush = time.monotonic()
+        for callback in pending:
+            try:
+                callback()
+            except tk.TclError as e:
+                logger.debug(f"Bỏ qua cập nhật giao diện cho widget đã bị xóa: {e}")
+
+    def stop(self):
+        with self.lock:
+            self.is_running = False
+        # event_generate từ luồng nền chờ luồng Tk xử lý: phục vụ nốt các lần đang gửi dở
+        # trước khi luồng chính chặn để chờ các luồng đó kết thúc
+        while True:
+            with self.lock:
+                if not self.wakeups: break
+            self.root.update()
+            time.sleep(0.001)
+        if self.after_id:
+            self.root.after_cancel(self.after_id)
+            self.after_id = None